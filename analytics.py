@@ -0,0 +1,280 @@
+"""全従業員を対象にした勤怠分析（残業・深夜・休憩・時間帯別の人数）
+
+期間の打刻を (従業員ID, エポック秒, 打刻コード) の NumPy 配列に読み込み、
+打刻の対応付け・日別の分割・集計をすべて配列演算で行う。
+区間の定義は attendance.iter_segments と同じで、日別の勤務/休憩秒数は
+attendance.accumulate_daily と一致する。
+
+NumPy は任意の依存関係で、インストールされていない場合は available() が False を返す。
+
+時刻はすべて保存時刻（UTC）に utc_offset_seconds を足した基準で扱う。
+既定値 0 は日別集計（daily_work_totals）と同じ基準で、深夜時間帯や曜日を
+現地時間で判定したい場合は ANALYTICS_UTC_OFFSET_HOURS（例: 9）を設定する。
+"""
+import itertools
+import logging
+import os
+from collections import namedtuple
+
+import archive
+import attendance
+
+try:
+    import numpy as np
+except ImportError:  # 任意の依存関係
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = attendance.SECONDS_PER_DAY
+SECONDS_PER_HOUR = 3600
+
+EVENT_CODES = {'clock_in': 0, 'clock_out': 1, 'start_break': 2, 'end_break': 3}
+WORK, BREAK = 0, 1
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# 法定労働時間（1日8時間・週40時間）を超えた分を残業とする
+DAILY_OVERTIME_SECONDS = int(_env_float('ANALYTICS_DAILY_OVERTIME_HOURS', 8) * SECONDS_PER_HOUR)
+WEEKLY_OVERTIME_SECONDS = int(_env_float('ANALYTICS_WEEKLY_OVERTIME_HOURS', 40) * SECONDS_PER_HOUR)
+OVERTIME_PREMIUM_RATE = _env_float('ANALYTICS_OVERTIME_PREMIUM_RATE', 0.25)
+# 深夜時間帯 22:00〜翌5:00
+NIGHT_START_SECONDS = 22 * SECONDS_PER_HOUR
+NIGHT_END_SECONDS = 5 * SECONDS_PER_HOUR
+NIGHT_PREMIUM_RATE = _env_float('ANALYTICS_NIGHT_PREMIUM_RATE', 0.25)
+UTC_OFFSET_SECONDS = int(_env_float('ANALYTICS_UTC_OFFSET_HOURS', 0) * SECONDS_PER_HOUR)
+
+_EVENT_COLUMNS = (
+    "employee_id, {epoch}, "
+    "CASE event_type WHEN 'clock_in' THEN 0 WHEN 'clock_out' THEN 1 WHEN 'start_break' THEN 2 ELSE 3 END"
+)
+_ID_CHUNK_SIZE = 500
+
+# 打刻列の配列（従業員ID・時刻順）
+Punches = namedtuple('Punches', ['employee_id', 'ts', 'code'])
+# 勤務/休憩の区間（kind: WORK / BREAK、end は排他的）
+Segments = namedtuple('Segments', ['employee_id', 'kind', 'start', 'end'])
+# 区間を日ごとに分割したもの（day: 期間の先頭からの日インデックス）
+DayPieces = namedtuple('DayPieces', ['employee_id', 'kind', 'day', 'start', 'end'])
+
+
+def available():
+    return np is not None
+
+
+def load_punches(conn, employee_ids, window_start, window_end, utc_offset_seconds=0):
+    """期間（前後1日の余裕を含む）の打刻を配列で読み込む。ts は utc_offset_seconds を足したエポック秒"""
+    range_start = window_start - utc_offset_seconds - attendance.MAX_SHIFT_SECONDS
+    range_end = window_end - utc_offset_seconds + attendance.MAX_SHIFT_SECONDS
+    with archive.attached(conn, range_start, range_end) as sources:
+        return _load_punches(conn, employee_ids, range_start, range_end, utc_offset_seconds, sources.records)
+
+
+def _load_punches(conn, employee_ids, range_start, range_end, utc_offset_seconds, records):
+    event_sql, params = attendance.epoch_range_query(conn, _EVENT_COLUMNS, range_start, range_end, records)
+    if employee_ids is None:
+        queries = [(event_sql.format(ids="SELECT id FROM employees"), params)]
+    else:
+        ids = sorted(set(employee_ids))
+        queries = [
+            (event_sql.format(ids=','.join('?' * len(chunk))), (*chunk, *params))
+            for chunk in (ids[i:i + _ID_CHUNK_SIZE] for i in range(0, len(ids), _ID_CHUNK_SIZE))
+        ]
+    arrays = []
+    for sql, query_params in queries:
+        cursor = conn.cursor()
+        # sqlite3.Row を作らずにタプルのまま平坦化して配列にする
+        cursor.row_factory = None
+        cursor.execute(sql, query_params)
+        arrays.append(np.fromiter(itertools.chain.from_iterable(cursor), dtype=np.int64).reshape(-1, 3))
+    data = np.concatenate(arrays) if arrays else np.empty((0, 3), dtype=np.int64)
+    return Punches(data[:, 0], data[:, 1] + utc_offset_seconds, data[:, 2].astype(np.int8))
+
+
+def pair_segments(punches):
+    """隣り合う打刻を対応付けて区間にする
+
+    同じ従業員の打刻 i → i+1 について、i が出勤/休憩終了なら勤務、休憩開始なら休憩の区間。
+    """
+    emp, ts, code = punches
+    if len(ts) < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return Segments(empty, empty.astype(np.int8), empty, empty)
+    opening = code[:-1] != EVENT_CODES['clock_out']
+    mask = (emp[1:] == emp[:-1]) & opening & (ts[1:] > ts[:-1])
+    kind = np.where(code[:-1] == EVENT_CODES['start_break'], BREAK, WORK).astype(np.int8)
+    return Segments(emp[:-1][mask], kind[mask], ts[:-1][mask], ts[1:][mask])
+
+
+def clip_segments(segments, window_start, window_end):
+    """期間外の部分を切り落とし、期間と重ならない区間を除く"""
+    start = np.maximum(segments.start, window_start)
+    end = np.minimum(segments.end, window_end)
+    mask = end > start
+    return Segments(segments.employee_id[mask], segments.kind[mask], start[mask], end[mask])
+
+
+def split_days(segments, window_start):
+    """（期間内に切り詰めた）区間を日の境界で分割する"""
+    first = (segments.start - window_start) // SECONDS_PER_DAY
+    last = (segments.end - 1 - window_start) // SECONDS_PER_DAY
+    counts = last - first + 1
+    index = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    day = first[index] + offsets
+    day_start = window_start + day * SECONDS_PER_DAY
+    start = np.maximum(segments.start[index], day_start)
+    end = np.minimum(segments.end[index], day_start + SECONDS_PER_DAY)
+    return DayPieces(segments.employee_id[index], segments.kind[index], day, start, end)
+
+
+def _overlap(start, end, range_start, range_end):
+    return np.clip(np.minimum(end, range_end) - np.maximum(start, range_start), 0, None)
+
+
+def night_seconds(pieces, window_start):
+    """日ごとに分割した区間のうち、深夜時間帯（0:00〜5:00 と 22:00〜24:00）にかかる秒数"""
+    day_start = window_start + pieces.day * SECONDS_PER_DAY
+    return (_overlap(pieces.start, pieces.end, day_start, day_start + NIGHT_END_SECONDS)
+            + _overlap(pieces.start, pieces.end, day_start + NIGHT_START_SECONDS, day_start + SECONDS_PER_DAY))
+
+
+def _matrix(rows, days, weights, n_rows, n_days):
+    return np.bincount(rows * n_days + days, weights=weights, minlength=n_rows * n_days).reshape(n_rows, n_days)
+
+
+def headcount_by_hour(segments, window_start, n_days):
+    """時間帯（0〜23時）ごとの平均勤務人数
+
+    勤務区間の開始/終了の累積和から、各1時間の「延べ勤務秒数」を求めて日数と3600秒で割る。
+    """
+    if n_days <= 0:
+        return [0.0] * 24
+    starts = np.sort(segments.start)
+    ends = np.sort(segments.end)
+    start_sums = np.concatenate(([0], np.cumsum(starts)))
+    end_sums = np.concatenate(([0], np.cumsum(ends)))
+    bounds = window_start + np.arange(n_days * 24 + 1, dtype=np.int64) * SECONDS_PER_HOUR
+    # t までの延べ勤務秒数 = Σ_{start<t}(t - start) - Σ_{end<t}(t - end)
+    n_started = np.searchsorted(starts, bounds)
+    n_ended = np.searchsorted(ends, bounds)
+    covered = (bounds * n_started - start_sums[n_started]) - (bounds * n_ended - end_sums[n_ended])
+    per_hour = np.diff(covered).reshape(n_days, 24).sum(axis=0)
+    return (per_hour / (n_days * SECONDS_PER_HOUR)).tolist()
+
+
+# 分析の中間結果（work / breaks / night は [従業員, 日] の秒数、break_* は従業員ごと）
+WorkforceMatrices = namedtuple(
+    'WorkforceMatrices', ['work', 'breaks', 'night', 'break_count', 'break_total', 'work_segments']
+)
+
+
+def compute_matrices(punches, employee_ids, window_start, n_days):
+    """打刻配列から日別の勤務・休憩・深夜秒数と休憩の回数・合計を求める
+
+    employee_ids は昇順の配列。それ以外の従業員の打刻は無視する。
+    """
+    n_employees = len(employee_ids)
+    window_end = window_start + n_days * SECONDS_PER_DAY
+    segments = clip_segments(pair_segments(punches), window_start, window_end)
+    known = np.isin(segments.employee_id, employee_ids)
+    segments = Segments(*(column[known] for column in segments))
+    pieces = split_days(segments, window_start)
+
+    rows = np.searchsorted(employee_ids, pieces.employee_id)
+    seconds = (pieces.end - pieces.start).astype(np.float64)
+    is_work = pieces.kind == WORK
+    work = _matrix(rows[is_work], pieces.day[is_work], seconds[is_work], n_employees, n_days)
+    breaks = _matrix(rows[~is_work], pieces.day[~is_work], seconds[~is_work], n_employees, n_days)
+    night = _matrix(rows[is_work], pieces.day[is_work],
+                    night_seconds(pieces, window_start)[is_work].astype(np.float64), n_employees, n_days)
+
+    # 休憩は区間（日で分割しない）単位で数える
+    is_break = segments.kind == BREAK
+    break_rows = np.searchsorted(employee_ids, segments.employee_id[is_break])
+    break_lengths = (segments.end - segments.start)[is_break].astype(np.float64)
+    break_count = np.bincount(break_rows, minlength=n_employees)
+    break_total = np.bincount(break_rows, weights=break_lengths, minlength=n_employees)
+    work_segments = Segments(*(column[segments.kind == WORK] for column in segments))
+    return WorkforceMatrices(work, breaks, night, break_count, break_total, work_segments)
+
+
+def overtime(work, window_start):
+    """日単位の残業秒数の合計と、日単位の残業を除いた勤務の週（月曜始まり）単位の超過秒数の合計
+
+    期間の先頭・末尾の週は期間内の日だけで判定する。
+    """
+    n_days = work.shape[1]
+    if not n_days:
+        return np.zeros(work.shape[0]), np.zeros(work.shape[0])
+    daily = np.clip(work - DAILY_OVERTIME_SECONDS, 0, None)
+    regular = work - daily
+    # 1970-01-01 は木曜日のため +3 で月曜始まりの週番号になる
+    week = (window_start // SECONDS_PER_DAY + np.arange(n_days) + 3) // 7
+    week_starts = np.flatnonzero(np.diff(week, prepend=week[0] - 1))
+    weekly = np.clip(np.add.reduceat(regular, week_starts, axis=1) - WEEKLY_OVERTIME_SECONDS, 0, None)
+    return daily.sum(axis=1), weekly.sum(axis=1)
+
+
+def analyze(conn, employees, window_start, n_days, all_employees=False, utc_offset_seconds=None):
+    """employees（id, name, hourly_wage を持つ行、id 昇順）の期間の分析結果を API の形式で返す
+
+    window_start は期間の先頭の日の 0 時（utc_offset_seconds を足した基準）のエポック秒。
+    all_employees=True の場合は従業員IDで絞り込まずに読み込む。
+    """
+    if utc_offset_seconds is None:
+        utc_offset_seconds = UTC_OFFSET_SECONDS
+    window_end = window_start + n_days * SECONDS_PER_DAY
+    ids = np.array([e['id'] for e in employees], dtype=np.int64)
+    wages = np.array([e['hourly_wage'] or 0 for e in employees], dtype=np.float64)
+
+    punches = load_punches(conn, None if all_employees else ids.tolist(), window_start, window_end,
+                           utc_offset_seconds)
+    m = compute_matrices(punches, ids, window_start, n_days)
+    daily_overtime, weekly_overtime = overtime(m.work, window_start)
+
+    work_hours = m.work.sum(axis=1) / SECONDS_PER_HOUR
+    daily_ot_hours = daily_overtime / SECONDS_PER_HOUR
+    weekly_ot_hours = weekly_overtime / SECONDS_PER_HOUR
+    night_hours = m.night.sum(axis=1) / SECONDS_PER_HOUR
+    overtime_premium = (daily_ot_hours + weekly_ot_hours) * wages * OVERTIME_PREMIUM_RATE
+    night_premium = night_hours * wages * NIGHT_PREMIUM_RATE
+    average_break = m.break_total / np.maximum(m.break_count, 1) / 60
+
+    results = []
+    for i, employee in enumerate(employees):
+        results.append({
+            'employee_id': employee['id'],
+            'name': employee['name'],
+            'work_hours': round(float(work_hours[i]), 2),
+            'daily_overtime_hours': round(float(daily_ot_hours[i]), 2),
+            'weekly_overtime_hours': round(float(weekly_ot_hours[i]), 2),
+            'night_hours': round(float(night_hours[i]), 2),
+            'overtime_premium': round(float(overtime_premium[i])),
+            'night_premium': round(float(night_premium[i])),
+            'break_count': int(m.break_count[i]),
+            'average_break_minutes': round(float(average_break[i]), 1),
+        })
+    total_breaks = int(m.break_count.sum())
+    totals = {
+        'employees': len(employees),
+        'work_hours': round(float(work_hours.sum()), 2),
+        'daily_overtime_hours': round(float(daily_ot_hours.sum()), 2),
+        'weekly_overtime_hours': round(float(weekly_ot_hours.sum()), 2),
+        'night_hours': round(float(night_hours.sum()), 2),
+        'overtime_premium': round(float(overtime_premium.sum())),
+        'night_premium': round(float(night_premium.sum())),
+        'break_count': total_breaks,
+        'average_break_minutes': round(float(m.break_total.sum()) / total_breaks / 60, 1) if total_breaks else 0.0,
+    }
+    return {
+        'employees': results,
+        'totals': totals,
+        'headcount_by_hour': [round(v, 3) for v in headcount_by_hour(m.work_segments, window_start, n_days)],
+    }
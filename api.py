@@ -1,36 +1,103 @@
 import sqlite3
 import datetime
-import itertools
 import logging
 import os
-from werkzeug.security import check_password_hash, generate_password_hash
-from database import get_db_connection
+import time
+from database import db_connection, schema_version, write_transaction
+import archive
+import attendance
+import auth
+import bulk
+import directory
+import events
+import metrics
+import presence
+import punch_queue
+import scheduling
+import startup
 
 logger = logging.getLogger(__name__)
 
 
+@metrics.instrument
 class Api:
     def __init__(self):
         self.current_user = None
 
     def login(self, name, password):
         logger.info(f"Login attempt: name={name}")
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM employees WHERE name = ?', (name,)).fetchone()
-        conn.close()
-
-        if user and check_password_hash(user['password'], password):
-            self.current_user = {
-                'id': user['id'],
-                'name': user['name'],
-                'is_admin': bool(user['is_admin'])
-            }
-            logger.info(f"Login success: {self.current_user}")
-            return { 'success': True, 'user': self.current_user }
+        with db_connection() as conn:
+            user = conn.execute('SELECT id, name, is_admin, password FROM employees WHERE name = ?', (name,)).fetchone()
+
+        ok, rehashed = auth.verify('password', user['id'], user['password'], password) if user else (False, None)
+        if ok:
+            if rehashed:
+                self._save_rehashed('password', user['id'], user['password'], rehashed)
+            return self._start_session(user, is_admin=bool(user['is_admin']))
         else:
             logger.warning("Login failed: invalid credentials")
             return { 'success': False, 'message': 'ユーザー名またはパスワードが正しくありません。' }
 
+    def login_with_pin(self, name, pin):
+        """従業員名と PIN でログインする（打刻端末向け。管理者の権限は付与しない）"""
+        logger.info(f"PIN login attempt: name={name}")
+        with db_connection() as conn:
+            if schema_version(conn) < auth.QUICK_LOGIN_SCHEMA_VERSION:
+                return {'success': False, 'message': 'PIN ログインは準備中です。しばらくしてから再度お試しください。'}
+            user = conn.execute('SELECT id, name, is_admin, pin_hash FROM employees WHERE name = ?', (name,)).fetchone()
+        if user and auth.pin_lockout.is_locked(user['id']):
+            logger.warning(f"PIN login locked: employee_id={user['id']}")
+            return {'success': False, 'message': 'PIN の入力に続けて失敗したため、しばらくの間 PIN ではログインできません。'}
+
+        ok, rehashed = auth.verify('pin', user['id'], user['pin_hash'], pin) if user else (False, None)
+        if not ok:
+            if user:
+                auth.pin_lockout.failed(user['id'])
+            logger.warning("PIN login failed: invalid credentials")
+            return {'success': False, 'message': 'ユーザー名または PIN が正しくありません。'}
+        auth.pin_lockout.succeeded(user['id'])
+        if rehashed:
+            self._save_rehashed('pin_hash', user['id'], user['pin_hash'], rehashed)
+        return self._start_session(user, is_admin=False)
+
+    def login_with_badge(self, badge_code):
+        """社員証のコードでログインする（打刻端末向け。管理者の権限は付与しない）"""
+        if not badge_code or not badge_code.strip():
+            return {'success': False, 'message': '社員証を読み取れませんでした。'}
+        with db_connection() as conn:
+            if schema_version(conn) < auth.QUICK_LOGIN_SCHEMA_VERSION:
+                return {'success': False, 'message': '社員証ログインは準備中です。しばらくしてから再度お試しください。'}
+            user = conn.execute(
+                'SELECT id, name, is_admin FROM employees WHERE badge_digest = ?', (auth.badge_digest(badge_code),)
+            ).fetchone()
+        if not user:
+            logger.warning("Badge login failed: unknown badge")
+            return {'success': False, 'message': '登録されていない社員証です。'}
+        return self._start_session(user, is_admin=False)
+
+    def _start_session(self, user, is_admin):
+        self.current_user = {
+            'id': user['id'],
+            'name': user['name'],
+            'is_admin': is_admin
+        }
+        logger.info(f"Login success: {self.current_user}")
+        return { 'success': True, 'user': self.current_user }
+
+    def _save_rehashed(self, column, employee_id, old_hash, new_hash):
+        """ハッシュの方式が変わった資格情報を作り直したものに置き換える（その間に変更されていれば何もしない）"""
+        try:
+            with db_connection() as conn:
+                with write_transaction(conn):
+                    conn.execute(
+                        f'UPDATE employees SET {column} = ? WHERE id = ? AND {column} = ?',
+                        (new_hash, employee_id, old_hash)
+                    )
+            logger.info(f"Rehashed {column} for employee_id={employee_id}")
+        except Exception as e:
+            # ログイン自体は成功しているため、次回のログインで再試行する
+            logger.warning(f"Failed to save rehashed {column} for employee_id={employee_id}: {e}")
+
     def logout(self):
         logger.info(f"Logout: user={self.current_user}")
         self.current_user = None
@@ -49,22 +116,24 @@ class Api:
             }
         }
 
+    def report_paint_timing(self, timings):
+        """画面の最初の描画までの時間（Performance API の値）を起動時間の記録に追加する（認証不要）"""
+        if not isinstance(timings, dict):
+            return {'success': False, 'message': '引数の形式が不正です。'}
+        if startup.record_paint(timings):
+            logger.info(f"First paint: {timings}")
+        return {'success': True}
+
     def get_events(self, start_date_str, end_date_str):
         """指定された期間内のイベントを取得する（認証不要）"""
         try:
-            conn = get_db_connection()
-            records = conn.execute(
-                "SELECT * FROM events WHERE start_datetime < ? AND end_datetime > ? ORDER BY start_datetime",
-                (end_date_str, start_date_str)
-            ).fetchall()
-            conn.close()
-            events = [dict(row) for row in records]
-            return {'success': True, 'events': events}
+            return {'success': True, 'events': events.get_events_cached(start_date_str, end_date_str)}
         except Exception as e:
             logger.exception(f"Failed to get events: {e}")
             return {'success': False, 'message': 'イベントの取得に失敗しました。'}
 
-    def add_event(self, title, description, start_datetime, end_datetime, is_allday):
+    def add_event(self, title, description, start_datetime, end_datetime, is_allday, rrule=None):
+        """イベントを追加する。rrule（例: 'FREQ=WEEKLY;UNTIL=20251231'）を指定すると繰り返しイベントになる"""
         if not self.current_user or not self.current_user['is_admin']:
             return {'success': False, 'message': '権限がありません。'}
         try:
@@ -75,19 +144,25 @@ class Api:
         except Exception:
             return {'success': False, 'message': '日時の形式が不正です。'}
         try:
-            conn = get_db_connection()
-            conn.execute(
-                "INSERT INTO events (title, description, start_datetime, end_datetime, is_allday) VALUES (?, ?, ?, ?, ?)",
-                (title, description, start_datetime, end_datetime, 1 if is_allday else 0)
-            )
-            conn.commit()
-            conn.close()
+            until = events.resolve_recurrence_until(rrule, start_datetime)
+        except ValueError:
+            return {'success': False, 'message': '繰り返しの設定が不正です。'}
+        try:
+            with db_connection() as conn:
+                conn.execute(
+                    "INSERT INTO events (title, description, start_datetime, end_datetime, is_allday, rrule, recurrence_until) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (title, description, start_datetime, end_datetime, 1 if is_allday else 0, rrule or None, until)
+                )
+                conn.commit()
+            events.window_cache.invalidate()
             return {'success': True}
         except Exception as e:
             logger.exception(f"Failed to add event: {e}")
             return {'success': False, 'message': 'イベントの追加に失敗しました。'}
 
-    def update_event(self, event_id, title, description, start_datetime, end_datetime, is_allday):
+    def update_event(self, event_id, title, description, start_datetime, end_datetime, is_allday, rrule=None):
+        """イベントを更新する。繰り返しイベントの場合は全体（初回の日時と rrule）を更新する"""
         if not self.current_user or not self.current_user["is_admin"]:
             return {"success": False, "message": "権限がありません。"}
         try:
@@ -98,13 +173,18 @@ class Api:
         except Exception:
             return {'success': False, 'message': '日時の形式が不正です。'}
         try:
-            conn = get_db_connection()
-            conn.execute(
-                "UPDATE events SET title=?, description=?, start_datetime=?, end_datetime=?, is_allday=? WHERE id=?",
-                (title, description, start_datetime, end_datetime, 1 if is_allday else 0, event_id)
-            )
-            conn.commit()
-            conn.close()
+            until = events.resolve_recurrence_until(rrule, start_datetime)
+        except ValueError:
+            return {'success': False, 'message': '繰り返しの設定が不正です。'}
+        try:
+            with db_connection() as conn:
+                conn.execute(
+                    "UPDATE events SET title=?, description=?, start_datetime=?, end_datetime=?, is_allday=?, "
+                    "rrule=?, recurrence_until=? WHERE id=?",
+                    (title, description, start_datetime, end_datetime, 1 if is_allday else 0, rrule or None, until, event_id)
+                )
+                conn.commit()
+            events.window_cache.invalidate()
             return {"success": True}
         except Exception as e:
             logger.exception(f"Failed to update event: {e}")
@@ -114,15 +194,35 @@ class Api:
         if not self.current_user or not self.current_user["is_admin"]:
             return {"success": False, "message": "権限がありません。"}
         try:
-            conn = get_db_connection()
-            conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
-            conn.commit()
-            conn.close()
+            with db_connection() as conn:
+                conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+                conn.commit()
+            events.window_cache.invalidate()
             return {"success": True}
         except Exception as e:
             logger.exception(f"Failed to delete event: {e}")
             return {"success": False, "message": "イベントの削除に失敗しました。"}
 
+    def delete_event_occurrence(self, event_id, occurrence_start):
+        """繰り返しイベントのうち、occurrence_start に始まる回だけを削除する"""
+        if not self.current_user or not self.current_user["is_admin"]:
+            return {"success": False, "message": "権限がありません。"}
+        try:
+            with db_connection() as conn:
+                updated = conn.execute(
+                    "INSERT OR IGNORE INTO event_exceptions (event_id, occurrence_start) "
+                    "SELECT id, ? FROM events WHERE id = ? AND rrule IS NOT NULL",
+                    (occurrence_start, event_id)
+                ).rowcount
+                conn.commit()
+            events.window_cache.invalidate()
+            if not updated:
+                return {"success": False, "message": "繰り返しイベントが見つかりません。"}
+            return {"success": True}
+        except Exception as e:
+            logger.exception(f"Failed to delete event occurrence: {e}")
+            return {"success": False, "message": "イベントの削除に失敗しました。"}
+
     def record_attendance(self, event_type):
         if not self.current_user:
             return {'success': False, 'message': 'ログインしていません。'}
@@ -130,29 +230,38 @@ class Api:
             return {'success': False, 'message': '不正なイベント種別です。'}
 
         employee_id = self.current_user['id']
+        queue = punch_queue.active()
+        if queue is not None:
+            # 打刻キュー有効時はまとめて書き込む（応答の時点での耐久性は punch_queue.py を参照）
+            try:
+                return queue.submit(employee_id, event_type)
+            except Exception as e:
+                logger.exception(f"Failed to queue attendance: {e}")
+                return {'success': False, 'message': 'データベースエラーが発生しました。'}
         try:
-            conn = get_db_connection()
-            last = conn.execute(
-                "SELECT event_type FROM attendance_records WHERE employee_id = ? ORDER BY timestamp DESC LIMIT 1",
-                (employee_id,)
-            ).fetchone()
+            with db_connection() as conn:
+                previous = attendance.state_cache.get(employee_id) or attendance.state_cache.load(conn, employee_id)
+                if not attendance.is_transition_allowed(previous.state, event_type):
+                    # 他プロセスでの打刻でキャッシュが古い可能性があるため、拒否する前に一度だけ読み直す
+                    previous = attendance.state_cache.load(conn, employee_id)
+                    if not attendance.is_transition_allowed(previous.state, event_type):
+                        return {'success': False, 'message': '現在の状態ではその操作はできません。'}
 
-            last_type = last['event_type'] if last else None
-            allowed_next = set()
-            if last_type is None or last_type == 'clock_out':
-                allowed_next = {'clock_in'}
-            elif last_type in ('clock_in', 'end_break'):
-                allowed_next = {'start_break', 'clock_out'}
-            elif last_type == 'start_break':
-                allowed_next = {'end_break'}
-
-            if event_type not in allowed_next:
-                conn.close()
-                return {'success': False, 'message': '現在の状態ではその操作はできません。'}
-
-            conn.execute("INSERT INTO attendance_records (employee_id, event_type) VALUES (?, ?)", (employee_id, event_type))
-            conn.commit()
-            conn.close()
+                # 打刻・状態・日別集計の更新を同じトランザクションで行う
+                with write_transaction(conn):
+                    now = max(int(time.time()), previous.last_timestamp or 0)
+                    record_id = attendance.insert_punch(
+                        conn, employee_id, event_type, now, attendance.has_ts_epoch(conn)
+                    )
+                    current = attendance.EmployeeState(event_type, record_id, now)
+                    if not attendance.compare_and_set_state(conn, employee_id, previous, current):
+                        conn.rollback()
+                        attendance.state_cache.invalidate(employee_id)
+                        logger.warning(f"Concurrent punch detected: employee_id={employee_id}")
+                        return {'success': False, 'message': '他の端末で打刻が行われました。状態を確認してもう一度お試しください。'}
+                    attendance.apply_punch_to_rollup(conn, employee_id, previous.state, previous.last_timestamp, event_type, now)
+            attendance.state_cache.set(employee_id, current)
+            presence.board.update(employee_id, event_type, now)
             return {'success': True}
         except Exception as e:
             logger.exception(f"Failed to record attendance: {e}")
@@ -162,20 +271,71 @@ class Api:
         if not self.current_user:
             return {'status': 'logged_out'}
         employee_id = self.current_user['id']
-        conn = get_db_connection()
-        record = conn.execute("SELECT event_type FROM attendance_records WHERE employee_id = ? ORDER BY timestamp DESC LIMIT 1", (employee_id,)).fetchone()
-        conn.close()
-        return {'status': record['event_type']} if record else {'status': 'none'}
+        entry = attendance.state_cache.get(employee_id)
+        if entry is None:
+            with db_connection() as conn:
+                entry = attendance.state_cache.load(conn, employee_id)
+        return {'status': entry.state} if entry.state else {'status': 'none'}
+
+    def get_presence(self, since=None):
+        """在席状況を返す（管理者のみ）
+
+        since に前回の応答の seq を渡すと、それ以降に状態が変わった従業員だけを changes で返す。
+        since が古すぎる場合や省略した場合は full=True で全従業員を employees で返す。
+        """
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            if since is not None:
+                seq, changes, counts = presence.board.changes_since(int(since))
+                if changes is not None:
+                    return {'success': True, 'full': False, 'seq': seq, 'changes': changes, 'counts': counts}
+            seq, employees, counts = presence.board.snapshot()
+            return {'success': True, 'full': True, 'seq': seq, 'employees': employees, 'counts': counts}
+        except Exception as e:
+            logger.exception(f"Failed to get presence: {e}")
+            return {'success': False, 'message': '在席状況の取得に失敗しました。'}
 
     def get_all_employees(self):
         if not self.current_user or not self.current_user['is_admin']:
             return {'success': False, 'message': '権限がありません。'}
-        conn = get_db_connection()
-        employees = conn.execute("SELECT id, name, hourly_wage, is_admin FROM employees ORDER BY id").fetchall()
-        conn.close()
+        with db_connection() as conn:
+            employees = conn.execute("SELECT id, name, hourly_wage, is_admin FROM employees ORDER BY id").fetchall()
         employees_list = [dict(row) for row in employees]
         return {'success': True, 'employees': employees_list}
 
+    def list_employees(self, cursor=None, limit=None, query=None, if_version=None):
+        """従業員一覧を id 順に1ページ分返す（管理者のみ）
+
+        cursor には前のページの next_cursor を渡す。query で名前を部分一致検索する。
+        if_version が現在の version と同じ場合は一覧を返さず not_modified を返す。
+        """
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            with db_connection() as conn:
+                # バージョンを先に読むため、間に変更があっても次回の確認で取り直される
+                current = directory.version(conn)
+                if if_version is not None and current is not None and if_version == current:
+                    return {'success': True, 'not_modified': True, 'version': current}
+                employees, next_cursor = directory.list_employees(conn, cursor, limit, query)
+            return {'success': True, 'employees': employees, 'next_cursor': next_cursor, 'version': current}
+        except Exception as e:
+            logger.exception(f"Failed to list employees: {e}")
+            return {'success': False, 'message': '従業員一覧の取得に失敗しました。'}
+
+    def get_employee(self, employee_id):
+        """従業員1人の情報を返す（管理者、または本人）"""
+        if not self.current_user:
+            return {'success': False, 'message': 'ログインしていません。'}
+        if not self.current_user['is_admin'] and self.current_user['id'] != int(employee_id):
+            return {'success': False, 'message': '権限がありません。'}
+        with db_connection() as conn:
+            employee = directory.get_employee(conn, employee_id)
+        if employee is None:
+            return {'success': False, 'message': '従業員が見つかりません。'}
+        return {'success': True, 'employee': employee}
+
     def change_password(self, current_password, new_password):
         """ログイン中ユーザー自身のパスワード変更"""
         if not self.current_user:
@@ -185,15 +345,14 @@ class Api:
 
         user_id = self.current_user['id']
         try:
-            conn = get_db_connection()
-            row = conn.execute('SELECT password FROM employees WHERE id = ?', (user_id,)).fetchone()
-            if not row or not check_password_hash(row['password'], current_password):
-                conn.close()
+            with db_connection() as conn:
+                row = conn.execute('SELECT password FROM employees WHERE id = ?', (user_id,)).fetchone()
+            if not row or not auth.verify('password', user_id, row['password'], current_password)[0]:
                 return {'success': False, 'message': '現在のパスワードが正しくありません。'}
-            hashed = generate_password_hash(new_password, method='pbkdf2:sha256')
-            conn.execute('UPDATE employees SET password = ? WHERE id = ?', (hashed, user_id))
-            conn.commit()
-            conn.close()
+            hashed = auth.hash_password(new_password)
+            with db_connection() as conn:
+                conn.execute('UPDATE employees SET password = ? WHERE id = ?', (hashed, user_id))
+                conn.commit()
             return {'success': True, 'message': 'パスワードを変更しました。'}
         except Exception as e:
             logger.exception(f"Failed to change password: {e}")
@@ -205,11 +364,11 @@ class Api:
         if not name or not password:
             return {'success': False, 'message': '名前とパスワードは必須です。'}
         try:
-            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-            conn = get_db_connection()
-            conn.execute("INSERT INTO employees (name, password, hourly_wage, is_admin) VALUES (?, ?, ?, ?)", (name, hashed_password, float(hourly_wage), 1 if is_admin else 0))
-            conn.commit()
-            conn.close()
+            hashed_password = auth.hash_password(password)
+            with db_connection() as conn:
+                cur = conn.execute("INSERT INTO employees (name, password, hourly_wage, is_admin) VALUES (?, ?, ?, ?)", (name, hashed_password, float(hourly_wage), 1 if is_admin else 0))
+                conn.commit()
+            presence.board.update(cur.lastrowid, None, None, name=name)
             return {'success': True}
         except sqlite3.IntegrityError:
             return {'success': False, 'message': f'従業員名 "{name}" は既に使用されています。'}
@@ -226,70 +385,300 @@ class Api:
             return {'success': False, 'message': 'ログイン中の自分自身を削除することはできません。'}
 
         try:
-            conn = get_db_connection()
-            conn.execute("DELETE FROM employees WHERE id = ?", (employee_id,))
-            conn.commit()
-            conn.close()
+            with db_connection() as conn:
+                conn.execute("DELETE FROM employees WHERE id = ?", (employee_id,))
+                conn.commit()
+            attendance.state_cache.invalidate(int(employee_id))
+            presence.board.remove(int(employee_id))
             return {'success': True}
         except Exception as e:
             logger.exception(f"Failed to delete employee: {e}")
             return {'success': False, 'message': '従業員の削除中にエラーが発生しました。'}
             
-    def get_attendance_summary(self, employee_id, start_date_str, end_date_str):
+    def set_employee_pin(self, employee_id, pin):
+        """従業員の PIN を設定する（管理者のみ）。pin が空なら PIN ログインを無効にする"""
         if not self.current_user or not self.current_user['is_admin']:
             return {'success': False, 'message': '権限がありません。'}
+        if pin and not auth.is_valid_pin(pin):
+            return {'success': False, 'message': f'PIN は{auth.PIN_MIN_LENGTH}桁以上の数字にしてください。'}
         try:
-            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
-            end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d') + datetime.timedelta(days=1)
+            with db_connection() as conn:
+                if schema_version(conn) < auth.QUICK_LOGIN_SCHEMA_VERSION:
+                    return {'success': False, 'message': 'データベースの更新中です。しばらくしてから再度お試しください。'}
+                with write_transaction(conn):
+                    cur = conn.execute(
+                        "UPDATE employees SET pin_hash = ? WHERE id = ?", (auth.hash_pin(pin) if pin else None, employee_id)
+                    )
+            if cur.rowcount == 0:
+                return {'success': False, 'message': '従業員が見つかりません。'}
+            return {'success': True, 'message': 'PIN を設定しました。' if pin else 'PIN を削除しました。'}
+        except Exception as e:
+            logger.exception(f"Failed to set PIN: {e}")
+            return {'success': False, 'message': 'データベースエラーが発生しました。'}
 
-            conn = get_db_connection()
-            employee = conn.execute("SELECT hourly_wage FROM employees WHERE id = ?", (employee_id,)).fetchone()
-            if not employee:
-                conn.close()
+    def set_employee_badge(self, employee_id, badge_code):
+        """従業員の社員証を登録する（管理者のみ）。badge_code が空なら登録を解除する"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        digest = auth.badge_digest(badge_code) if badge_code and badge_code.strip() else None
+        try:
+            with db_connection() as conn:
+                if schema_version(conn) < auth.QUICK_LOGIN_SCHEMA_VERSION:
+                    return {'success': False, 'message': 'データベースの更新中です。しばらくしてから再度お試しください。'}
+                with write_transaction(conn):
+                    cur = conn.execute("UPDATE employees SET badge_digest = ? WHERE id = ?", (digest, employee_id))
+            if cur.rowcount == 0:
                 return {'success': False, 'message': '従業員が見つかりません。'}
-            hourly_wage = employee['hourly_wage'] if employee['hourly_wage'] is not None else 0
-
-            records = conn.execute(
-                "SELECT event_type, timestamp FROM attendance_records WHERE employee_id = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
-                (employee_id, start_date, end_date)
-            ).fetchall()
-            conn.close()
-
-            daily_work_hours = {}
-            for date_obj, group in itertools.groupby(records, key=lambda r: datetime.datetime.strptime(r['timestamp'], '%Y-%m-%d %H:%M:%S').date()):
-                day_str = date_obj.strftime('%Y-%m-%d')
-                total_work_seconds = 0
-                last_start_time = None
-                for record in group:
-                    event_type = record['event_type']
-                    timestamp = datetime.datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S')
-
-                    if event_type in ('clock_in', 'end_break'):
-                        last_start_time = timestamp
-                    elif event_type in ('clock_out', 'start_break') and last_start_time:
-                        duration = timestamp - last_start_time
-                        total_work_seconds += duration.total_seconds()
-                        last_start_time = None
-                
-                daily_work_hours[day_str] = total_work_seconds / 3600
-
-            labels = []
-            current_date = start_date.date()
-            while current_date < end_date.date():
-                labels.append(current_date.strftime('%Y-%m-%d'))
-                current_date += datetime.timedelta(days=1)
-
-            data = [daily_work_hours.get(label, 0) for label in labels]
-            total_hours = sum(data)
-            total_wage = total_hours * hourly_wage
+            return {'success': True, 'message': '社員証を登録しました。' if digest else '社員証の登録を解除しました。'}
+        except sqlite3.IntegrityError:
+            return {'success': False, 'message': 'この社員証は既に他の従業員に登録されています。'}
+        except Exception as e:
+            logger.exception(f"Failed to set badge: {e}")
+            return {'success': False, 'message': 'データベースエラーが発生しました。'}
 
+    def _compute_summaries(self, employee_ids, start_date_str, end_date_str):
+        """従業員ごとの日別勤務時間を日別集計テーブルから集計する
+
+        employee_ids が None の場合は全従業員。戻り値: (labels, 集計結果のリスト)
+        """
+        start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
+        end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d') + datetime.timedelta(days=1)
+        n_days = max(0, (end_date - start_date).days)
+
+        labels = attendance.day_labels(start_date, n_days)
+        day_index = {label: i for i, label in enumerate(labels)}
+        totals = {}
+        with db_connection() as conn:
+            employees = self._load_employees(conn, employee_ids)
+            # 日別集計テーブルから読むため、コストは打刻数ではなく日数に比例する
+            if employees and labels:
+                id_filter = "" if employee_ids is None else f"employee_id IN ({','.join('?' * len(employees))}) AND "
+                # 締めた月はアーカイブの日別集計も読む（同じ日の行は足し合わせる）
+                window = attendance.date_to_epoch(start_date), attendance.date_to_epoch(end_date)
+                with archive.attached(conn, *window) as sources:
+                    rows = conn.execute(
+                        f"SELECT employee_id, day, work_seconds FROM {sources.rollup} WHERE {id_filter}day >= ? AND day <= ?",
+                        (*([] if employee_ids is None else [e['id'] for e in employees]), labels[0], labels[-1])
+                    )
+                    for employee_id, day, work_seconds in rows:
+                        buckets = totals.get(employee_id)
+                        if buckets is None:
+                            buckets = totals[employee_id] = ([0] * n_days,)
+                        buckets[0][day_index[day]] += work_seconds
+        return labels, attendance.summarize(employees, totals, n_days)
+
+    def get_attendance_summary(self, employee_id, start_date_str, end_date_str):
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            labels, results = self._compute_summaries([employee_id], start_date_str, end_date_str)
+            if not results:
+                return {'success': False, 'message': '従業員が見つかりません。'}
             return {
                 'success': True,
                 'labels': labels,
-                'data': data,
-                'summary': { 'total_hours': round(total_hours, 2), 'total_wage': round(total_wage), 'hourly_wage': hourly_wage }
+                'data': results[0]['data'],
+                'summary': results[0]['summary']
             }
         except Exception as e:
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Failed to summarize attendance: {e}")
+            return {'success': False, 'message': f'データ集計中にエラーが発生しました: {e}'}
+
+    def get_attendance_summaries(self, employee_ids, start_date_str, end_date_str):
+        """複数従業員（employee_ids='all' で全員）の勤怠集計をまとめて返す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            ids = None if employee_ids == 'all' else list(employee_ids or [])
+            labels, results = self._compute_summaries(ids, start_date_str, end_date_str)
+            return {'success': True, 'labels': labels, 'employees': results}
+        except Exception as e:
+            logger.exception(f"Failed to summarize attendance: {e}")
             return {'success': False, 'message': f'データ集計中にエラーが発生しました: {e}'}
+
+    def _load_employees(self, conn, employee_ids):
+        if employee_ids is None:
+            return conn.execute("SELECT id, name, hourly_wage FROM employees ORDER BY id").fetchall()
+        ids = sorted({int(i) for i in employee_ids})
+        if not ids:
+            return []
+        return conn.execute(
+            f"SELECT id, name, hourly_wage FROM employees WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+        ).fetchall()
+
+    def get_workforce_analytics(self, start_date_str, end_date_str, employee_ids='all'):
+        """期間の残業（日/週）・深夜勤務と割増額・平均休憩時間・時間帯別の平均勤務人数を返す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        # numpy の import は重いため、初めて分析するときまで遅らせる
+        import analytics
+        if not analytics.available():
+            return {'success': False, 'message': '分析機能には numpy が必要です。'}
+        try:
+            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
+            end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d') + datetime.timedelta(days=1)
+        except (TypeError, ValueError):
+            return {'success': False, 'message': '日付の形式が不正です。'}
+        n_days = max(0, (end_date - start_date).days)
+        try:
+            ids = None if employee_ids == 'all' else list(employee_ids or [])
+            with db_connection() as conn:
+                employees = self._load_employees(conn, ids)
+                result = analytics.analyze(
+                    conn, employees, attendance.date_to_epoch(start_date), n_days, all_employees=ids is None
+                )
+            return {'success': True, **result}
+        except Exception as e:
+            logger.exception(f"Failed to analyze attendance: {e}")
+            return {'success': False, 'message': f'分析中にエラーが発生しました: {e}'}
+
+    def _schedule_window(self, start_date_str, end_date_str):
+        """開始日〜終了日（両端を含む）を (開始, 翌日の 0 時) の datetime で返す。不正なら None"""
+        try:
+            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
+            end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d') + datetime.timedelta(days=1)
+        except (TypeError, ValueError):
+            return None
+        return start_date, end_date
+
+    def assign_shift(self, employee_ids, start_datetime, end_datetime):
+        """従業員にシフトを1件割り当てる（管理者のみ）。同じ開始のシフトがあれば置き換える"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            with db_connection() as conn:
+                if not scheduling.is_enabled(conn):
+                    return {'success': False, 'message': 'シフト機能は準備中です。しばらくしてから再度お試しください。'}
+                with write_transaction(conn):
+                    count = scheduling.assign(conn, employee_ids or [], start_datetime, end_datetime)
+            return {'success': True, 'assigned': count}
+        except scheduling.ScheduleError as e:
+            return {'success': False, 'message': str(e)}
+        except Exception as e:
+            logger.exception(f"Failed to assign shift: {e}")
+            return {'success': False, 'message': 'データベースエラーが発生しました。'}
+
+    def assign_event_shifts(self, event_id, employee_ids, start_date_str, end_date_str):
+        """カレンダーのイベントの期間内の各回を従業員のシフトにする（管理者のみ）
+
+        期間内のそのイベントのシフトは作り直すため、イベントを変更した後に呼び直せばよい。
+        """
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        window = self._schedule_window(start_date_str, end_date_str)
+        if window is None:
+            return {'success': False, 'message': '日付の形式が不正です。'}
+        try:
+            with db_connection() as conn:
+                if not scheduling.is_enabled(conn):
+                    return {'success': False, 'message': 'シフト機能は準備中です。しばらくしてから再度お試しください。'}
+                with write_transaction(conn):
+                    count = scheduling.assign_event(conn, int(event_id), employee_ids or [], *window)
+            return {'success': True, 'assigned': count}
+        except scheduling.ScheduleError as e:
+            return {'success': False, 'message': str(e)}
+        except Exception as e:
+            logger.exception(f"Failed to assign event shifts: {e}")
+            return {'success': False, 'message': 'データベースエラーが発生しました。'}
+
+    def delete_shift_assignments(self, assignment_ids):
+        """シフトを削除する（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            with db_connection() as conn:
+                if not scheduling.is_enabled(conn):
+                    return {'success': False, 'message': 'シフト機能は準備中です。しばらくしてから再度お試しください。'}
+                with write_transaction(conn):
+                    count = scheduling.delete(conn, assignment_ids or [])
+            return {'success': True, 'deleted': count}
+        except Exception as e:
+            logger.exception(f"Failed to delete shift assignments: {e}")
+            return {'success': False, 'message': 'データベースエラーが発生しました。'}
+
+    def get_shift_assignments(self, start_date_str, end_date_str, employee_ids='all'):
+        """期間に開始するシフトを従業員・開始日時の順に返す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        window = self._schedule_window(start_date_str, end_date_str)
+        if window is None:
+            return {'success': False, 'message': '日付の形式が不正です。'}
+        try:
+            ids = None if employee_ids == 'all' else list(employee_ids or [])
+            with db_connection() as conn:
+                if not scheduling.is_enabled(conn):
+                    return {'success': False, 'message': 'シフト機能は準備中です。しばらくしてから再度お試しください。'}
+                employees = self._load_employees(conn, ids)
+                shifts = scheduling.list_assignments(
+                    conn, employees, *map(scheduling.to_epoch, window), all_employees=ids is None
+                )
+            return {'success': True, 'shifts': shifts}
+        except Exception as e:
+            logger.exception(f"Failed to get shift assignments: {e}")
+            return {'success': False, 'message': 'シフトの取得に失敗しました。'}
+
+    def get_shift_variance_report(self, start_date_str, end_date_str, employee_ids='all'):
+        """期間のシフトと打刻の差異（遅刻・早退・欠勤、予定と実績の時間）を返す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        window = self._schedule_window(start_date_str, end_date_str)
+        if window is None:
+            return {'success': False, 'message': '日付の形式が不正です。'}
+        try:
+            ids = None if employee_ids == 'all' else list(employee_ids or [])
+            with db_connection() as conn:
+                if not scheduling.is_enabled(conn):
+                    return {'success': False, 'message': 'シフト機能は準備中です。しばらくしてから再度お試しください。'}
+                employees = self._load_employees(conn, ids)
+                report = scheduling.variance_report(
+                    conn, employees, *map(scheduling.to_epoch, window), all_employees=ids is None
+                )
+            return {'success': True, **report}
+        except Exception as e:
+            logger.exception(f"Failed to build shift variance report: {e}")
+            return {'success': False, 'message': f'レポートの作成中にエラーが発生しました: {e}'}
+
+    def import_attendance(self, path, fmt=None):
+        """CSV / JSON Lines の打刻ファイルを一括登録する（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            with db_connection() as conn:
+                result = bulk.import_punches(conn, path, fmt)
+            logger.info(f"Imported attendance from {path}: {result['imported']} rows, {result['rejected']} rejected")
+            return {'success': True, **result}
+        except FileNotFoundError:
+            return {'success': False, 'message': 'ファイルが見つかりません。'}
+        except Exception as e:
+            logger.exception(f"Failed to import attendance: {e}")
+            return {'success': False, 'message': f'インポートに失敗しました: {e}'}
+
+    def export_attendance(self, path, start_date_str=None, end_date_str=None, fmt=None):
+        """打刻データをファイルに書き出す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            with db_connection() as conn:
+                count = bulk.export_records(conn, path, fmt, start_date_str, end_date_str)
+            return {'success': True, 'rows': count}
+        except Exception as e:
+            logger.exception(f"Failed to export attendance: {e}")
+            return {'success': False, 'message': f'エクスポートに失敗しました: {e}'}
+
+    def export_attendance_summary(self, path, start_date_str, end_date_str, fmt=None):
+        """日別の勤務時間・概算給与をファイルに書き出す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        try:
+            with db_connection() as conn:
+                count = bulk.export_summaries(conn, path, start_date_str, end_date_str, fmt)
+            return {'success': True, 'rows': count}
+        except Exception as e:
+            logger.exception(f"Failed to export attendance summary: {e}")
+            return {'success': False, 'message': f'エクスポートに失敗しました: {e}'}
+
+    def get_metrics(self):
+        """メソッド別のレイテンシ（p50/p95/p99）・実行待ち時間・SQL 文別の所要時間を返す（管理者のみ）"""
+        if not self.current_user or not self.current_user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        return {'success': True, 'metrics': metrics.registry.snapshot()}
@@ -0,0 +1,356 @@
+"""締めた月の打刻を年別のアーカイブ DB へ移す
+
+attendance_records と daily_work_totals のうち、締めた月（既定では直近
+ARCHIVE_KEEP_MONTHS か月より前）の行を、年ごとの SQLite ファイル
+（<DB名>-archive-YYYY.db）へ月単位で移す。ライブの DB には直近の月だけが残る。
+
+- 移す順序: アーカイブ側へコピーしてコミットした後、ライブ側から削除して
+  archive_months に月を登録する（同じトランザクション）。途中で止まっても、
+  未登録の月のコピーは読み取りに使われず、次回の実行で作り直す。
+- 読み取り: attached() が期間に掛かる年のファイルを ATTACH し、ライブと
+  アーカイブの UNION ALL を FROM 句として返す。アーカイブ側は登録済みの月の
+  行だけを読む。アーカイブの無い期間では従来どおりライブのテーブルだけを読む。
+- 従業員ごとに、移す月の末より前の最後の打刻はライブに残す。月を跨ぐ勤務の
+  開始や employee_state の最後の打刻を、ライブの打刻だけで作り直せるようにする。
+
+アーカイブ済みの月への打刻の取り込みはできない（bulk.PunchValidator が拒否する）。
+従業員を削除しても、アーカイブ済みの打刻は残る。
+"""
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import attendance
+import database
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# ライブの DB に残す月数（当月を除く）
+KEEP_MONTHS = max(0, _env_int('ARCHIVE_KEEP_MONTHS', 3))
+# コピーの1トランザクションあたりの行数
+CHUNK_SIZE = max(1, _env_int('ARCHIVE_CHUNK_SIZE', 5000))
+
+# archive_months（登録簿）が使えるスキーマのバージョン（migrations.py）
+ARCHIVE_SCHEMA_VERSION = 5
+
+_RECORD_COLUMNS = "id, employee_id, event_type, timestamp, ts_epoch"
+_ROLLUP_COLUMNS = "employee_id, day, work_seconds, break_seconds"
+# アーカイブ側は登録済みの月の行だけを読む（登録簿はライブ側で同じ文のスナップショットから読む）
+_REGISTERED = "archived_in <= (SELECT MAX(month) FROM main.archive_months)"
+
+# FROM 句に書くテーブル（またはサブクエリ）と、ATTACH したアーカイブの年
+Sources = namedtuple('Sources', ['records', 'rollup', 'years'])
+LIVE_SOURCES = Sources('attendance_records', 'daily_work_totals', ())
+
+
+class ArchiveError(Exception):
+    """アーカイブの実行・参照ができない（ファイルが無い、実行中に打刻が変わった など）"""
+
+
+def archive_path(year):
+    base = os.path.splitext(database.DB_FILE)[0]
+    return f"{base}-archive-{year}.db"
+
+
+def _schema(year):
+    return f"archive_{year}"
+
+
+def is_enabled(conn):
+    return database.schema_version(conn) >= ARCHIVE_SCHEMA_VERSION
+
+
+def _month_start(year, month):
+    return attendance.date_to_epoch(datetime.date(year, month, 1))
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _month_of(epoch):
+    dt = datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc)
+    return dt.year, dt.month
+
+
+def horizon(conn):
+    """アーカイブ済みの範囲の終わり（エポック秒）。これより前の打刻はアーカイブにある。未実施なら None"""
+    if not is_enabled(conn):
+        return None
+    return conn.execute("SELECT MAX(end_epoch) FROM archive_months").fetchone()[0]
+
+
+def horizon_day(conn):
+    """ライブの日別集計が受け持つ最初の日（'YYYY-MM-DD'）。未実施なら None"""
+    end = horizon(conn)
+    return None if end is None else attendance.epoch_to_day(end)
+
+
+def archived_months(conn):
+    if not is_enabled(conn):
+        return []
+    return [dict(row) for row in conn.execute(
+        "SELECT month, year, records, rollup_rows, archived_at FROM archive_months ORDER BY month"
+    )]
+
+
+def _attach(conn, year, create=False):
+    """年のアーカイブを ATTACH する。接続に既に ATTACH されていれば何もしない"""
+    name = _schema(year)
+    if name in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        return name
+    path = archive_path(year)
+    if not create and not os.path.exists(path):
+        raise ArchiveError(f"archive file is missing: {path}")
+    conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+    return name
+
+
+def _detach(conn, names):
+    for name in names:
+        try:
+            conn.execute(f"DETACH DATABASE {name}")
+        except sqlite3.OperationalError as e:
+            # 読み切られていないカーソルが残っている場合。次の attached() はそのまま再利用する
+            logger.debug(f"Could not detach {name}: {e}")
+
+
+@contextmanager
+def attached(conn, start_epoch=None, end_epoch=None):
+    """[start_epoch, end_epoch) に掛かるアーカイブを ATTACH し、読み取り元の Sources を返す
+
+    with archive.attached(conn, start, end) as sources:
+        conn.execute(f"SELECT ... FROM {sources.records} WHERE ...")
+
+    sources.records / sources.rollup はそれぞれ attendance_records / daily_work_totals と
+    同じ列名を持つ（records: id, employee_id, event_type, timestamp, ts_epoch、
+    rollup: employee_id, day, work_seconds, break_seconds）。rollup は同じ従業員・日の
+    行が複数あり得るため、読み取り側で合計する。
+    """
+    years = []
+    if is_enabled(conn):
+        years = [row[0] for row in conn.execute(
+            "SELECT DISTINCT year FROM archive_months WHERE end_epoch > ? AND start_epoch < ? ORDER BY year",
+            (start_epoch if start_epoch is not None else -2**62, end_epoch if end_epoch is not None else 2**62)
+        )]
+    if not years:
+        yield LIVE_SOURCES
+        return
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(years) > limit:
+        raise ArchiveError(f"range spans {len(years)} archive years (at most {limit} can be attached)")
+    names = []
+    try:
+        for year in years:
+            names.append(_attach(conn, year))
+        # ライブ側を先に書き、同じ文の中でライブ → アーカイブの順にスナップショットを取る
+        records = " UNION ALL ".join(
+            [f"SELECT {_RECORD_COLUMNS} FROM main.attendance_records"]
+            + [f"SELECT {_RECORD_COLUMNS} FROM {name}.attendance_records WHERE {_REGISTERED}" for name in names]
+        )
+        rollup = " UNION ALL ".join(
+            [f"SELECT {_ROLLUP_COLUMNS} FROM main.daily_work_totals"]
+            + [f"SELECT {_ROLLUP_COLUMNS} FROM {name}.daily_work_totals WHERE {_REGISTERED}" for name in names]
+        )
+        yield Sources(f"({records})", f"({rollup})", tuple(years))
+    finally:
+        _detach(conn, names)
+
+
+def _create_archive_schema(conn, name):
+    conn.execute(f"PRAGMA {name}.journal_mode = WAL")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name}.attendance_records (
+            id INTEGER PRIMARY KEY,
+            employee_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            ts_epoch INTEGER NOT NULL,
+            archived_in TEXT NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name}.daily_work_totals (
+            employee_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            work_seconds INTEGER NOT NULL,
+            break_seconds INTEGER NOT NULL,
+            archived_in TEXT NOT NULL,
+            PRIMARY KEY (employee_id, day)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name}.idx_archive_employee_epoch ON attendance_records(employee_id, ts_epoch)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name}.idx_archive_records_month ON attendance_records(archived_in)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name}.idx_archive_totals_day ON daily_work_totals(day)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name}.idx_archive_totals_month ON daily_work_totals(archived_in)")
+
+
+def cutoff(keep_months=None, before=None, now=None):
+    """この時刻より前に終わる月をアーカイブの対象にする（エポック秒）
+
+    before（'YYYY-MM'）を指定した場合はその月の前まで。いずれの場合も当月より後にはならない。
+    """
+    keep_months = KEEP_MONTHS if keep_months is None else max(0, keep_months)
+    year, month = _month_of(int(now if now is not None else time.time()))
+    month_index = year * 12 + (month - 1) - keep_months
+    limit = _month_start(month_index // 12, month_index % 12 + 1)
+    if before:
+        try:
+            dt = datetime.datetime.strptime(before, '%Y-%m')
+        except ValueError:
+            raise ValueError(f"invalid month: {before!r} (expected YYYY-MM)") from None
+        limit = min(limit, _month_start(dt.year, dt.month))
+    return limit
+
+
+def plan(conn, keep_months=None, before=None, now=None):
+    """アーカイブする月を古い順に [(month, start_epoch, end_epoch, 打刻数)] で返す"""
+    if not is_enabled(conn):
+        raise ArchiveError(f"schema version {ARCHIVE_SCHEMA_VERSION} is required (run 'manage.py migrate')")
+    limit = cutoff(keep_months, before, now)
+    start = horizon(conn)
+    if start is None:
+        start = conn.execute("SELECT MIN(ts_epoch) FROM attendance_records").fetchone()[0]
+        if start is None:
+            return []
+    counts = dict(conn.execute(
+        "SELECT strftime('%Y-%m', ts_epoch, 'unixepoch'), COUNT(*) FROM attendance_records "
+        "WHERE ts_epoch >= ? AND ts_epoch < ? GROUP BY 1",
+        (start, limit)
+    ))
+    months = []
+    year, month = _month_of(start)
+    month_start = _month_start(year, month)
+    while True:
+        month_end = _month_start(*_next_month(year, month))
+        if month_end > limit:
+            break
+        label = f"{year:04d}-{month:02d}"
+        months.append((label, month_start, month_end, counts.get(label, 0)))
+        year, month = _next_month(year, month)
+        month_start = month_end
+    return months
+
+
+def _refresh_keep(conn, month_end):
+    """従業員ごとに month_end より前の最後の打刻を temp.archive_keep に入れる（ライブに残す）"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_keep (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.archive_keep")
+    conn.execute("""
+        INSERT INTO temp.archive_keep (id)
+        SELECT id FROM (
+            SELECT (SELECT a.id FROM main.attendance_records a
+                    WHERE a.employee_id = e.id AND a.ts_epoch < ?
+                    ORDER BY a.ts_epoch DESC, a.id DESC LIMIT 1) AS id
+            FROM main.employees e
+        ) WHERE id IS NOT NULL
+    """, (month_end,))
+    conn.commit()
+
+
+_MOVABLE = "ts_epoch < ? AND id NOT IN (SELECT id FROM temp.archive_keep)"
+
+
+def _copy_records(conn, label, month_end, years, chunk_size):
+    """移す打刻（month_end より前・ライブに残すもの以外）を年ごとのアーカイブへコピーする"""
+    position, copied = 0, 0
+    while True:
+        upper = conn.execute(
+            f"SELECT MAX(id) FROM (SELECT id FROM main.attendance_records WHERE id > ? AND {_MOVABLE} ORDER BY id LIMIT ?)",
+            (position, month_end, chunk_size)
+        ).fetchone()[0]
+        if upper is None:
+            return copied
+        with database.write_transaction(conn):
+            for year in years:
+                cur = conn.execute(
+                    f"INSERT INTO {_schema(year)}.attendance_records ({_RECORD_COLUMNS}, archived_in) "
+                    f"SELECT {_RECORD_COLUMNS}, ? FROM main.attendance_records "
+                    f"WHERE id > ? AND id <= ? AND {_MOVABLE} AND ts_epoch >= ?",
+                    (label, position, upper, min(month_end, _month_start(year + 1, 1)), _month_start(year, 1))
+                )
+                copied += cur.rowcount
+        position = upper
+
+
+def _rollup_summary(conn, table, where, params):
+    return tuple(conn.execute(
+        f"SELECT COUNT(*), TOTAL(work_seconds), TOTAL(break_seconds) FROM {table} WHERE {where}", params
+    ).fetchone())
+
+
+def archive_month(conn, label, month_start, month_end, chunk_size=None):
+    """1か月分をアーカイブへ移して登録する。戻り値: (移した打刻数, 移した日別集計の行数)
+
+    conn は単発の接続（get_db_connection）で、トランザクションの外で呼ぶ。
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    year = _month_of(month_start)[0]
+    _refresh_keep(conn, month_end)
+    first = conn.execute(f"SELECT MIN(ts_epoch) FROM main.attendance_records WHERE {_MOVABLE}", (month_end,)).fetchone()[0]
+    years = list(range(min(year, _month_of(first)[0]) if first is not None else year, year + 1))
+    names = []
+    try:
+        for y in years:
+            names.append(_attach(conn, y, create=True))
+            _create_archive_schema(conn, names[-1])
+        # 前回途中で止まったコピー（未登録のため読み取りには使われていない）を消してからやり直す
+        with database.write_transaction(conn):
+            for name in names:
+                conn.execute(f"DELETE FROM {name}.attendance_records WHERE archived_in = ?", (label,))
+                conn.execute(f"DELETE FROM {name}.daily_work_totals WHERE archived_in = ?", (label,))
+        records = _copy_records(conn, label, month_end, years, chunk_size)
+        first_day, end_day = attendance.epoch_to_day(month_start), attendance.epoch_to_day(month_end)
+        with database.write_transaction(conn):
+            conn.execute(
+                f"INSERT INTO {_schema(year)}.daily_work_totals ({_ROLLUP_COLUMNS}, archived_in) "
+                f"SELECT {_ROLLUP_COLUMNS}, ? FROM main.daily_work_totals WHERE day >= ? AND day < ?",
+                (label, first_day, end_day)
+            )
+
+        with database.write_transaction(conn):
+            # コピーの後に取り込まれた・変わった行があれば削除せずにやり直してもらう
+            live = conn.execute(f"SELECT COUNT(*) FROM main.attendance_records WHERE {_MOVABLE}", (month_end,)).fetchone()[0]
+            archived = sum(conn.execute(
+                f"SELECT COUNT(*) FROM {name}.attendance_records WHERE archived_in = ?", (label,)
+            ).fetchone()[0] for name in names)
+            live_rollup = _rollup_summary(conn, "main.daily_work_totals", "day >= ? AND day < ?", (first_day, end_day))
+            archived_rollup = _rollup_summary(conn, f"{_schema(year)}.daily_work_totals", "archived_in = ?", (label,))
+            if live != archived or live_rollup != archived_rollup:
+                raise ArchiveError(f"attendance for {label} changed while archiving; run archive again")
+            conn.execute(f"DELETE FROM main.attendance_records WHERE {_MOVABLE}", (month_end,))
+            conn.execute("DELETE FROM main.daily_work_totals WHERE day >= ? AND day < ?", (first_day, end_day))
+            conn.execute(
+                "INSERT INTO archive_months (month, year, start_epoch, end_epoch, records, rollup_rows, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                (label, year, month_start, month_end, records, live_rollup[0])
+            )
+    finally:
+        _detach(conn, names)
+    return records, live_rollup[0]
+
+
+def archive(conn, keep_months=None, before=None, chunk_size=None, now=None):
+    """締めた月を古い順にアーカイブへ移す。戻り値: [(month, 打刻数, 日別集計の行数)]"""
+    results = []
+    for label, month_start, month_end, _ in plan(conn, keep_months, before, now):
+        started = time.perf_counter()
+        records, rollup_rows = archive_month(conn, label, month_start, month_end, chunk_size)
+        logger.info(
+            f"Archived {label}: {records} records, {rollup_rows} daily totals "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        results.append((label, records, rollup_rows))
+    return results
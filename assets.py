@@ -0,0 +1,157 @@
+"""画面のファイル（frontend/）の配信: ハッシュ付きのマニフェスト、事前圧縮、キャッシュヘッダー
+
+起動時に frontend/ の全ファイルを1回だけ読み込み、内容のハッシュをファイル名に含めた
+パス（例: js/main.3f2a9c1d0b4e.js）をマニフェストに登録する。HTML の中の参照はその
+パスへ書き換えるため、CSS / JS は1年間キャッシュさせてよく（immutable）、再読み込みでは
+HTML の再検証（ETag による 304）だけで済む。HTML とハッシュ無しのパスは毎回再検証させる。
+
+圧縮できる種類のファイルは gzip（brotli がインストールされていれば brotli も）で事前に
+圧縮しておき、Accept-Encoding に応じてメモリから返す。配信中はディスクを読まない。
+ASSET_CACHE=0 の場合は従来どおり毎回ディスクから返す（frontend/ を編集しながら確認する場合）。
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import time
+from collections import namedtuple
+
+from flask import Response, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # 任意の依存関係
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+ENABLED = os.getenv('ASSET_CACHE', '1') != '0'
+# ファイル名に含めるハッシュの桁数（sha256 の16進）
+HASH_LENGTH = 12
+# これより小さいファイルは圧縮しない
+COMPRESS_MIN_BYTES = 256
+GZIP_LEVEL = _env_int('ASSET_GZIP_LEVEL', 9)
+BROTLI_QUALITY = _env_int('ASSET_BROTLI_QUALITY', 11)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# HTML の src / href のうち、相対パスでマニフェストにあるものを書き換える
+_REFERENCE = re.compile(r'(\b(?:src|href)=")([^":?#]+)(")')
+
+# encodings は Content-Encoding → 圧縮後の内容（元より小さくなったものだけ）
+Asset = namedtuple('Asset', ['body', 'digest', 'content_type', 'encodings'])
+
+
+def _digest(body):
+    return hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+
+
+def _content_type(path):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type == 'application/javascript':
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def _compress(body, content_type):
+    encodings = {}
+    if len(body) < COMPRESS_MIN_BYTES or not content_type.startswith(_COMPRESSIBLE_TYPES):
+        return encodings
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 で、同じ内容からは常に同じ圧縮結果になるようにする
+    encodings['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return {name: data for name, data in encodings.items() if len(data) < len(body)}
+
+
+def _hashed_path(path, digest):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{digest}{ext}"
+
+
+class AssetStore:
+    """frontend/ の内容をメモリに持ち、キャッシュヘッダー付きで返す"""
+
+    def __init__(self, root):
+        self.root = root
+        # 論理パス（frontend/ からの相対パス）→ ハッシュ付きのパス
+        self.manifest = {}
+        # 配信パス → (Asset, immutable)
+        self._routes = {}
+
+    def build(self):
+        """frontend/ を読み込んでマニフェストを作る。戻り値: 読み込んだファイル数"""
+        started = time.perf_counter()
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    # .DS_Store など
+                    continue
+                full = os.path.join(dirpath, filename)
+                with open(full, 'rb') as f:
+                    files[os.path.relpath(full, self.root).replace(os.sep, '/')] = f.read()
+
+        manifest, routes = {}, {}
+        # HTML 以外を先に登録し、HTML の参照をハッシュ付きのパスに書き換えられるようにする
+        for path, body in sorted(files.items(), key=lambda item: item[0].endswith('.html')):
+            content_type = _content_type(path)
+            if path.endswith('.html'):
+                text = body.decode('utf-8')
+                body = _REFERENCE.sub(
+                    lambda m: m.group(1) + manifest.get(m.group(2), m.group(2)) + m.group(3), text
+                ).encode('utf-8')
+            asset = Asset(body, _digest(body), content_type, _compress(body, content_type))
+            routes[path] = (asset, False)
+            if not path.endswith('.html'):
+                manifest[path] = _hashed_path(path, asset.digest)
+                routes[manifest[path]] = (asset, True)
+
+        self.manifest, self._routes = manifest, routes
+        raw = sum(len(a.body) for a, immutable in routes.values() if not immutable)
+        encodings = 'br, gzip' if brotli is not None else 'gzip'
+        logger.info(
+            f"Built asset manifest: {len(files)} files, {raw / 1000:.1f} KB ({encodings}) "
+            f"in {time.perf_counter() - started:.3f}s"
+        )
+        return len(files)
+
+    def lookup(self, path):
+        """配信パスの (Asset, immutable)。無ければ None"""
+        return self._routes.get(path)
+
+    def response(self, path):
+        """path の内容を返す Flask の Response（見つからなければ 404）"""
+        if not ENABLED:
+            return send_from_directory(self.root, path)
+        entry = self._routes.get(path)
+        if entry is None:
+            return Response('Not Found', status=404, mimetype='text/plain')
+        asset, immutable = entry
+        encoding = next((name for name in asset.encodings if request.accept_encodings[name]), None)
+        # 表現（圧縮の有無・種類）ごとに異なる ETag にする
+        etag = asset.digest if encoding is None else f"{asset.digest}-{encoding}"
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+            'Vary': 'Accept-Encoding',
+        }
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            body = asset.encodings[encoding]
+        else:
+            body = asset.body
+        return Response(body, headers=headers, content_type=asset.content_type)
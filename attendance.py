@@ -0,0 +1,433 @@
+import calendar
+import datetime
+import functools
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('clock_in', 'clock_out', 'start_break', 'end_break')
+WORK_START_EVENTS = ('clock_in', 'end_break')
+
+# 直前の状態（最後の打刻種別）から許可される次の打刻
+ALLOWED_TRANSITIONS = {
+    None: ('clock_in',),
+    'clock_out': ('clock_in',),
+    'clock_in': ('start_break', 'clock_out'),
+    'end_break': ('start_break', 'clock_out'),
+    'start_break': ('end_break',),
+}
+
+SECONDS_PER_DAY = 86400
+# 集計期間の前後に含まれる打刻も読み込み、日跨ぎ・期間跨ぎの勤務を正しく分割する
+MAX_SHIFT_SECONDS = SECONDS_PER_DAY
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+_EPOCH_DATE = datetime.date(1970, 1, 1)
+
+# 1回のクエリで IN 句に渡す従業員IDの上限
+_ID_CHUNK_SIZE = 500
+
+# attendance_records.ts_epoch（エポック秒）が使えるスキーマのバージョン（migrations.py）
+TS_EPOCH_SCHEMA_VERSION = 2
+
+_INSERT_PUNCH_SQL = "INSERT INTO attendance_records (employee_id, event_type, timestamp) VALUES (?, ?, ?)"
+_INSERT_PUNCH_EPOCH_SQL = (
+    "INSERT INTO attendance_records (employee_id, event_type, timestamp, ts_epoch) VALUES (?, ?, ?, ?)"
+)
+
+
+def date_to_epoch(date):
+    """date / datetime を（保存時刻と同じ基準の）エポック秒に変換する"""
+    if not isinstance(date, datetime.datetime):
+        date = datetime.datetime(date.year, date.month, date.day)
+    return calendar.timegm(date.timetuple())
+
+
+def epoch_to_timestamp(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def epoch_to_day(epoch):
+    return _day_label(epoch // SECONDS_PER_DAY)
+
+
+@functools.lru_cache(maxsize=65536)
+def _day_label(day_number):
+    return (_EPOCH_DATE + datetime.timedelta(days=day_number)).strftime('%Y-%m-%d')
+
+
+def day_labels(start_date, n_days):
+    return [(start_date + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(n_days)]
+
+
+def is_transition_allowed(previous_type, event_type):
+    return event_type in ALLOWED_TRANSITIONS.get(previous_type, ())
+
+
+def iter_segments(rows, include_open=False):
+    """打刻列を勤務/休憩の区間に変換する
+
+    rows は (employee_id, event_type, epoch) を従業員ID・時刻順に並べたもの。
+    (employee_id, 'work' | 'break', 開始エポック, 終了エポック) を順に返す。
+    include_open=True の場合、各従業員の未終了区間を終了エポック None として最後に返す。
+    """
+    current_employee = None
+    open_kind = None
+    open_start = None
+    for employee_id, event_type, ts in rows:
+        if employee_id != current_employee:
+            if include_open and open_kind is not None:
+                yield current_employee, open_kind, open_start, None
+            current_employee = employee_id
+            open_kind = None
+        if open_kind is not None and ts > open_start:
+            yield employee_id, open_kind, open_start, ts
+        if event_type in WORK_START_EVENTS:
+            open_kind = 'work'
+        elif event_type == 'start_break':
+            open_kind = 'break'
+        else:
+            open_kind = None
+        open_start = ts
+    if include_open and open_kind is not None:
+        yield current_employee, open_kind, open_start, None
+
+
+def split_by_day(start, end, window_start, window_end):
+    """区間 [start, end) を期間内に切り詰め、(日インデックス, 秒数) に日毎に分割する"""
+    start = max(start, window_start)
+    end = min(end, window_end)
+    while start < end:
+        day_index = (start - window_start) // SECONDS_PER_DAY
+        day_end = min(end, window_start + (day_index + 1) * SECONDS_PER_DAY)
+        yield day_index, day_end - start
+        start = day_end
+
+
+def accumulate_daily(rows, window_start, window_end):
+    """打刻列を1パスで集計し、従業員ごとの日別勤務秒数・休憩秒数を返す
+
+    戻り値: {employee_id: (work_seconds[], break_seconds[])}
+    """
+    n_days = (window_end - window_start) // SECONDS_PER_DAY
+    totals = {}
+    for employee_id, kind, start, end in iter_segments(rows):
+        if end <= window_start or start >= window_end:
+            continue
+        buckets = totals.get(employee_id)
+        if buckets is None:
+            buckets = totals[employee_id] = ([0] * n_days, [0] * n_days)
+        target = buckets[0] if kind == 'work' else buckets[1]
+        for day_index, seconds in split_by_day(start, end, window_start, window_end):
+            target[day_index] += seconds
+    return totals
+
+
+def has_ts_epoch(conn):
+    """ts_epoch 列のバックフィルまで完了しているか"""
+    return conn.execute("PRAGMA user_version").fetchone()[0] >= TS_EPOCH_SCHEMA_VERSION
+
+
+def insert_punch(conn, employee_id, event_type, ts, with_epoch):
+    """打刻を1件登録して id を返す（ts はエポック秒、with_epoch は has_ts_epoch の結果）
+
+    ts_epoch も値を渡して登録すると、トリガー（migrations.py）による2回目の書き込みが起きない。
+    """
+    if with_epoch:
+        cur = conn.execute(_INSERT_PUNCH_EPOCH_SQL, (employee_id, event_type, epoch_to_timestamp(ts), ts))
+    else:
+        cur = conn.execute(_INSERT_PUNCH_SQL, (employee_id, event_type, epoch_to_timestamp(ts)))
+    return cur.lastrowid
+
+
+def insert_punch_rows(conn, rows, with_epoch):
+    """(employee_id, event_type, timestamp, エポック秒) の打刻をまとめて登録する"""
+    if with_epoch:
+        conn.executemany(_INSERT_PUNCH_EPOCH_SQL, rows)
+    else:
+        conn.executemany(_INSERT_PUNCH_SQL, (row[:3] for row in rows))
+
+
+def epoch_range_query(conn, columns, window_start, window_end, records='attendance_records'):
+    """期間の打刻を employee_id・時刻順に読む SQL とパラメータを返す
+
+    SQL の {columns} は列の並び（{epoch} が時刻のエポック秒）、{ids} は従業員IDの IN 句の中身。
+    ts_epoch が使える場合はその列とインデックスで範囲を絞り、文字列の変換を省く。
+    records はアーカイブも読む場合の FROM 句（archive.attached の sources.records）。
+    """
+    if has_ts_epoch(conn):
+        epoch, order = 'ts_epoch', 'ts_epoch'
+        params = (window_start, window_end)
+    else:
+        epoch, order = "CAST(strftime('%s', timestamp) AS INTEGER)", 'timestamp'
+        params = (epoch_to_timestamp(window_start), epoch_to_timestamp(window_end))
+    sql = (
+        f"SELECT {columns.format(epoch=epoch)} FROM {records} "
+        f"WHERE employee_id IN ({{ids}}) AND {order} >= ? AND {order} < ? ORDER BY employee_id, {order}, id"
+    )
+    return sql, params
+
+
+def fetch_event_rows(conn, employee_ids, window_start, window_end):
+    """期間（前後の余裕を含む）の打刻を (employee_id, event_type, epoch) で順に返す
+
+    employee_ids が None の場合は全従業員。タイムスタンプは SQL 側でエポック秒に変換し、
+    Python 側では一切パースしない。
+    """
+    base, params = epoch_range_query(
+        conn, "employee_id, event_type, {epoch}",
+        window_start - MAX_SHIFT_SECONDS, window_end + MAX_SHIFT_SECONDS
+    )
+    if employee_ids is None:
+        yield from conn.execute(base.format(ids="SELECT id FROM employees"), params)
+        return
+    ids = sorted(set(employee_ids))
+    for i in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[i:i + _ID_CHUNK_SIZE]
+        sql = base.format(ids=','.join('?' * len(chunk)))
+        yield from conn.execute(sql, (*chunk, *params))
+
+
+def summarize(employees, totals, n_days):
+    """集計結果を API のレスポンス形式（時間単位）に整形する"""
+    results = []
+    for employee in employees:
+        hourly_wage = employee['hourly_wage'] if employee['hourly_wage'] is not None else 0
+        work_seconds = totals.get(employee['id'], ([0] * n_days,))[0]
+        data = [seconds / 3600 for seconds in work_seconds]
+        total_hours = sum(work_seconds) / 3600
+        results.append({
+            'employee_id': employee['id'],
+            'name': employee['name'],
+            'data': data,
+            'summary': {
+                'total_hours': round(total_hours, 2),
+                'total_wage': round(total_hours * hourly_wage),
+                'hourly_wage': hourly_wage,
+            },
+        })
+    return results
+
+
+# --- 日別集計テーブル (daily_work_totals) ---
+
+_ADD_WORK_SQL = (
+    "INSERT INTO daily_work_totals (employee_id, day, work_seconds) VALUES (?, ?, ?) "
+    "ON CONFLICT (employee_id, day) DO UPDATE SET work_seconds = work_seconds + excluded.work_seconds"
+)
+_ADD_BREAK_SQL = (
+    "INSERT INTO daily_work_totals (employee_id, day, break_seconds) VALUES (?, ?, ?) "
+    "ON CONFLICT (employee_id, day) DO UPDATE SET break_seconds = break_seconds + excluded.break_seconds"
+)
+_SET_OPEN_SQL = (
+    "INSERT INTO daily_work_totals (employee_id, day, open_since) VALUES (?, ?, ?) "
+    "ON CONFLICT (employee_id, day) DO UPDATE SET open_since = excluded.open_since"
+)
+
+
+def _split_absolute(start, end):
+    """区間を暦日（UTC基準）ごとに分割し (日付文字列, 秒数) を返す"""
+    day_start = start - start % SECONDS_PER_DAY
+    for day_index, seconds in split_by_day(start, end, day_start, end):
+        yield epoch_to_day(day_start + day_index * SECONDS_PER_DAY), seconds
+
+
+def apply_punch_to_rollup(conn, employee_id, previous_type, previous_ts, event_type, ts):
+    """打刻1件分を日別集計テーブルに反映する（呼び出し側のトランザクション内で実行する）
+
+    previous_type / previous_ts は直前の打刻の種別とエポック秒（employee_state の値）。
+    未終了区間は直前の打刻から始まっているため、open_since の行を探す必要はない。
+    """
+    if previous_type is not None and previous_type != 'clock_out' and previous_ts is not None:
+        conn.execute(
+            "UPDATE daily_work_totals SET open_since = NULL WHERE employee_id = ? AND day = ?",
+            (employee_id, epoch_to_day(previous_ts))
+        )
+        sql = _ADD_WORK_SQL if previous_type in WORK_START_EVENTS else _ADD_BREAK_SQL
+        if ts > previous_ts:
+            conn.executemany(sql, ((employee_id, day, seconds) for day, seconds in _split_absolute(previous_ts, ts)))
+    if event_type != 'clock_out':
+        conn.execute(_SET_OPEN_SQL, (employee_id, epoch_to_day(ts), ts))
+
+
+def fetch_all_event_rows(conn, employee_ids=None):
+    """全期間の打刻を (employee_id, event_type, epoch) で従業員ID・時刻順に返す"""
+    sql = (
+        "SELECT employee_id, event_type, CAST(strftime('%s', timestamp) AS INTEGER) "
+        "FROM attendance_records {} ORDER BY employee_id, timestamp, id"
+    )
+    if employee_ids is None:
+        yield from conn.execute(sql.format(''))
+        return
+    ids = sorted(set(employee_ids))
+    for i in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[i:i + _ID_CHUNK_SIZE]
+        yield from conn.execute(sql.format(f"WHERE employee_id IN ({','.join('?' * len(chunk))})"), chunk)
+
+
+def iter_expected_rollup(rows):
+    """生の打刻列から、日別集計テーブルのあるべき行を従業員ID・日付順に生成する
+
+    (employee_id, day, work_seconds, break_seconds, open_since) を返す。
+    メモリ使用量は1従業員分の日数に比例する。
+    """
+    current_employee = None
+    days = {}
+
+    def flush():
+        for day in sorted(days):
+            work, brk, open_since = days[day]
+            yield current_employee, day, work, brk, open_since
+
+    for employee_id, kind, start, end in iter_segments(rows, include_open=True):
+        if employee_id != current_employee:
+            yield from flush()
+            current_employee = employee_id
+            days = {}
+        if end is None:
+            entry = days.setdefault(epoch_to_day(start), [0, 0, None])
+            entry[2] = start
+            continue
+        index = 0 if kind == 'work' else 1
+        for day, seconds in _split_absolute(start, end):
+            days.setdefault(day, [0, 0, None])[index] += seconds
+    yield from flush()
+
+
+def _expected_rollup_since(conn, employee_ids, since_day):
+    rows = iter_expected_rollup(fetch_all_event_rows(conn, employee_ids))
+    if since_day is None:
+        return rows
+    return (row for row in rows if row[1] >= since_day)
+
+
+def rebuild_daily_totals(conn, employee_ids=None, since_day=None):
+    """生の打刻から日別集計テーブルを作り直す（コミットは呼び出し側で行う）
+
+    since_day（archive.horizon_day）より前の日はアーカイブにあるため触らない。
+    戻り値: 書き込んだ行数
+    """
+    since_param = since_day or ''
+    if employee_ids is None:
+        conn.execute("DELETE FROM daily_work_totals WHERE day >= ?", (since_param,))
+    else:
+        conn.executemany(
+            "DELETE FROM daily_work_totals WHERE employee_id = ? AND day >= ?", ((i, since_param) for i in employee_ids)
+        )
+    cur = conn.executemany(
+        "INSERT INTO daily_work_totals (employee_id, day, work_seconds, break_seconds, open_since) VALUES (?, ?, ?, ?, ?)",
+        _expected_rollup_since(conn, employee_ids, since_day)
+    )
+    return cur.rowcount
+
+
+def verify_daily_totals(conn, employee_ids=None, limit=20, since_day=None):
+    """日別集計テーブルと生の打刻から再計算した値を突き合わせる（since_day より前の日は除く）
+
+    戻り値: 不一致のリスト [(employee_id, day, 期待値, 実際の値)]（最大 limit 件）
+    """
+    expected = {(r[0], r[1]): tuple(r[2:]) for r in _expected_rollup_since(conn, employee_ids, since_day)}
+    sql = "SELECT employee_id, day, work_seconds, break_seconds, open_since FROM daily_work_totals WHERE day >= ?"
+    since_param = since_day or ''
+    if employee_ids is None:
+        actual_rows = conn.execute(sql, (since_param,))
+    else:
+        ids = sorted(set(employee_ids))
+        actual_rows = conn.execute(f"{sql} AND employee_id IN ({','.join('?' * len(ids))})", (since_param, *ids))
+    mismatches = []
+    for row in actual_rows:
+        key = (row[0], row[1])
+        actual = tuple(row[2:])
+        want = expected.pop(key, None)
+        # 勤務・休憩ともに0で未終了でもない行は、存在しない行と同じ扱い
+        if want is None and actual == (0, 0, None):
+            continue
+        if want != actual:
+            mismatches.append((key[0], key[1], want, actual))
+    mismatches.extend((key[0], key[1], want, None) for key, want in expected.items())
+    return mismatches[:limit]
+
+
+# --- 現在の打刻状態 (employee_state) ---
+
+EmployeeState = namedtuple('EmployeeState', ['state', 'last_event_id', 'last_timestamp'])
+EMPTY_STATE = EmployeeState(None, None, None)
+
+_CAS_STATE_SQL = (
+    "UPDATE employee_state SET state = ?, last_event_id = ?, last_timestamp = ? "
+    "WHERE employee_id = ? AND state IS ? AND last_event_id IS ?"
+)
+
+
+def rebuild_employee_state(conn, employee_ids=None):
+    """各従業員の最新打刻（時刻・ID順で最後のもの）から employee_state を作り直す"""
+    if employee_ids is None:
+        id_filter, params = "", ()
+        conn.execute("INSERT OR IGNORE INTO employee_state (employee_id) SELECT id FROM employees")
+    else:
+        ids = sorted(set(employee_ids))
+        placeholders = ','.join('?' * len(ids))
+        id_filter, params = f"WHERE employee_id IN ({placeholders})", tuple(ids)
+        conn.execute(f"INSERT OR IGNORE INTO employee_state (employee_id) SELECT id FROM employees WHERE id IN ({placeholders})", params)
+    conn.execute(f'''
+        UPDATE employee_state SET (state, last_event_id, last_timestamp) = (
+            SELECT event_type, id, CAST(strftime('%s', timestamp) AS INTEGER)
+            FROM attendance_records a
+            WHERE a.employee_id = employee_state.employee_id
+            ORDER BY a.timestamp DESC, a.id DESC LIMIT 1
+        ) {id_filter}
+    ''', params)
+
+
+def compare_and_set_state(conn, employee_id, expected, new):
+    """employee_state を直前の状態が expected の場合にのみ new へ更新する
+
+    戻り値: 更新できた場合 True（他の打刻が先に反映されていた場合 False）
+    """
+    conn.execute("INSERT OR IGNORE INTO employee_state (employee_id) VALUES (?)", (employee_id,))
+    cur = conn.execute(_CAS_STATE_SQL, (
+        new.state, new.last_event_id, new.last_timestamp,
+        employee_id, expected.state, expected.last_event_id
+    ))
+    return cur.rowcount == 1
+
+
+class EmployeeStateCache:
+    """employee_state のプロセス内キャッシュ
+
+    読み取りは辞書の1回の参照で済む。書き込みの正しさは DB 側の compare-and-set で担保し、
+    競合を検出したらその従業員のエントリを捨てて読み直す。
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, employee_id):
+        return self._states.get(employee_id)
+
+    def load(self, conn, employee_id):
+        row = conn.execute(
+            "SELECT state, last_event_id, last_timestamp FROM employee_state WHERE employee_id = ?",
+            (employee_id,)
+        ).fetchone()
+        entry = EmployeeState(*row) if row else EMPTY_STATE
+        with self._lock:
+            self._states[employee_id] = entry
+        return entry
+
+    def set(self, employee_id, entry):
+        with self._lock:
+            self._states[employee_id] = entry
+
+    def invalidate(self, employee_id=None):
+        with self._lock:
+            if employee_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(employee_id, None)
+
+
+state_cache = EmployeeStateCache()
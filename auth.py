@@ -0,0 +1,186 @@
+"""パスワード・PIN・社員証（バッジ）の検証
+
+打刻端末では従業員が入れ替わりでログインするため、検証のコストを段階に分ける。
+
+- パスワード: PBKDF2-SHA256（反復回数は AUTH_PASSWORD_ITERATIONS）。保存済みの
+  ハッシュの反復回数が設定と異なる場合は、ログイン成功時に作り直して保存する。
+- PIN: 従業員名 + 数字の PIN。反復回数は AUTH_PIN_ITERATIONS（パスワードより軽い）。
+  総当たりに弱いため、連続で失敗した従業員は一定時間 PIN ログインを止める。
+- 社員証: バッジのコードの SHA-256 で従業員を引く（PBKDF2 は使わない）。
+
+いずれも、直近に検証に成功した資格情報をメモリ上に AUTH_CACHE_TTL_SECONDS だけ
+保持し、同じ入力の再検証では PBKDF2 を省く。キャッシュにはプロセスごとの乱数鍵による
+HMAC だけを持ち、平文は保持しない。
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+PASSWORD_ITERATIONS = max(1, _env_int('AUTH_PASSWORD_ITERATIONS', 600_000))
+PIN_ITERATIONS = max(1, _env_int('AUTH_PIN_ITERATIONS', 50_000))
+CACHE_TTL_SECONDS = max(0, _env_int('AUTH_CACHE_TTL_SECONDS', 300))
+CACHE_SIZE = max(1, _env_int('AUTH_CACHE_SIZE', 256))
+PIN_MIN_LENGTH = 4
+PIN_MAX_FAILURES = 5
+PIN_LOCKOUT_SECONDS = 300
+
+# employees.pin_hash / badge_digest が使えるスキーマのバージョン（migrations.py）
+QUICK_LOGIN_SCHEMA_VERSION = 3
+
+PASSWORD_METHOD = f'pbkdf2:sha256:{PASSWORD_ITERATIONS}'
+PIN_METHOD = f'pbkdf2:sha256:{PIN_ITERATIONS}'
+
+
+def _security():
+    # werkzeug の import は重く起動時には不要なため、最初のハッシュの計算・照合のときに行う
+    from werkzeug import security
+    return security
+
+
+def hash_password(password):
+    return _security().generate_password_hash(password, method=PASSWORD_METHOD)
+
+
+def hash_pin(pin):
+    return _security().generate_password_hash(pin, method=PIN_METHOD)
+
+
+def badge_digest(code):
+    """社員証のコードを検索用のダイジェストにする（前後の空白は読み取り機の差として無視する）"""
+    return hashlib.sha256(code.strip().encode('utf-8')).hexdigest()
+
+
+def is_valid_pin(pin):
+    return isinstance(pin, str) and pin.isdigit() and len(pin) >= PIN_MIN_LENGTH
+
+
+def needs_rehash(stored, method):
+    """保存済みハッシュの方式（アルゴリズムと反復回数）が method と異なるか"""
+    stored_method = stored.split('$', 1)[0]
+    if stored_method == 'pbkdf2:sha256':
+        # 反復回数の無い古い形式は werkzeug の既定値で作られている
+        return method != 'pbkdf2:sha256'
+    return stored_method != method
+
+
+class VerifiedCredentialCache:
+    """検証に成功した (種別, 従業員ID, 保存済みハッシュ, 入力) を期限付きで覚える
+
+    保存済みハッシュもキーに含めるため、パスワードや PIN を変更すると古いエントリは
+    一致しなくなる。件数が上限を超えたら最も古く使われたものから捨てる。
+    """
+
+    def __init__(self, ttl_seconds=None, max_entries=None):
+        self.ttl_seconds = CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_entries = max_entries or CACHE_SIZE
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, kind, employee_id, stored, secret):
+        message = f'{kind}\0{employee_id}\0{stored}\0{secret}'.encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def check(self, kind, employee_id, stored, secret):
+        if not self.ttl_seconds:
+            return False
+        digest = self._digest(kind, employee_id, stored, secret)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(digest)
+            if expires is None or expires < now:
+                if expires is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return False
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return True
+
+    def add(self, kind, employee_id, stored, secret):
+        if not self.ttl_seconds:
+            return
+        digest = self._digest(kind, employee_id, stored, secret)
+        with self._lock:
+            self._entries[digest] = time.monotonic() + self.ttl_seconds
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class PinLockout:
+    """従業員ごとの PIN の連続失敗回数を数え、上限に達したら一定時間ロックする"""
+
+    def __init__(self, max_failures=PIN_MAX_FAILURES, lockout_seconds=PIN_LOCKOUT_SECONDS):
+        self.max_failures = max_failures
+        self.lockout_seconds = lockout_seconds
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def is_locked(self, employee_id):
+        with self._lock:
+            count, since = self._failures.get(employee_id, (0, 0.0))
+            if count < self.max_failures:
+                return False
+            if time.monotonic() - since >= self.lockout_seconds:
+                del self._failures[employee_id]
+                return False
+            return True
+
+    def failed(self, employee_id):
+        with self._lock:
+            count, _ = self._failures.get(employee_id, (0, 0.0))
+            self._failures[employee_id] = (count + 1, time.monotonic())
+
+    def succeeded(self, employee_id):
+        with self._lock:
+            self._failures.pop(employee_id, None)
+
+
+credential_cache = VerifiedCredentialCache()
+pin_lockout = PinLockout()
+
+
+def verify(kind, employee_id, stored, secret):
+    """保存済みハッシュ stored に対して secret を検証する（kind: 'password' / 'pin'）
+
+    戻り値: (一致したか, 作り直したハッシュ | None)。後者が None でなければ呼び出し側で保存する。
+    """
+    if not stored or not secret:
+        return False, None
+    if credential_cache.check(kind, employee_id, stored, secret):
+        return True, None
+    if not _security().check_password_hash(stored, secret):
+        return False, None
+    method = PASSWORD_METHOD if kind == 'password' else PIN_METHOD
+    rehashed = None
+    if needs_rehash(stored, method):
+        rehashed = _security().generate_password_hash(secret, method=method)
+        stored = rehashed
+    credential_cache.add(kind, employee_id, stored, secret)
+    return True, rehashed
@@ -0,0 +1,345 @@
+"""稼働中の DB のバックアップ（SQLite オンラインバックアップ API）
+
+WAL モードの DB はファイルをコピーすると、-wal に残ったコミット済みの変更が
+欠けたり、書き込み途中のページを写したりするため、sqlite3 の backup API で
+ページを少しずつ（BACKUP_PAGES_PER_STEP ページごとに BACKUP_STEP_PAUSE_MS 休みながら）
+写す。写している間はコピー元の接続で読み取りトランザクションを開いたままにする。
+WAL では読み取りが書き込みを止めないため打刻は続けられ、途中で書き込まれても
+バックアップは最初からやり直しにならない（開始時点のスナップショットになる）。
+
+1回のバックアップは BACKUP_DIR（既定はデータディレクトリの backups）の下の
+YYYYmmdd-HHMMSS ディレクトリで、ライブの DB とアーカイブ（archive.py）を gzip で
+圧縮したものと manifest.json を置く。前回のスナップショットと内容（SHA-256）が
+同じファイル（締めた年のアーカイブなど）は、圧縮し直さずにハードリンクする。
+BACKUP_KEEP を超えた古いスナップショットは削除する。
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import archive
+import database
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# 1ステップで写すページ数（既定のページサイズ 4KB で約1MB）と、ステップ間の休み
+PAGES_PER_STEP = max(1, _env_int('BACKUP_PAGES_PER_STEP', 256))
+STEP_PAUSE_SECONDS = max(0, _env_int('BACKUP_STEP_PAUSE_MS', 5)) / 1000
+# 残すスナップショットの数
+KEEP = max(1, _env_int('BACKUP_KEEP', 7))
+# 定期バックアップの間隔（0 で無効）
+INTERVAL_MINUTES = max(0, _env_int('BACKUP_INTERVAL_MINUTES', 0))
+COMPRESS_LEVEL = min(9, max(1, _env_int('BACKUP_COMPRESS_LEVEL', 6)))
+
+MANIFEST_NAME = 'manifest.json'
+_NAME_FORMAT = '%Y%m%d-%H%M%S'
+_PARTIAL_SUFFIX = '.partial'
+_COPY_BUFFER = 1024 * 1024
+
+# 同じプロセス内でバックアップが重ならないようにする
+_backup_lock = threading.Lock()
+
+
+class BackupError(Exception):
+    """バックアップ・検証・復元ができない（整合性チェックの失敗、ファイルの欠落 など）"""
+
+
+def backup_dir():
+    return os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(database.DB_FILE), 'backups')
+
+
+def list_snapshots(directory=None):
+    """完了したスナップショットを古い順に (パス, manifest の dict) で返す"""
+    directory = directory or backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        manifest = os.path.join(path, MANIFEST_NAME)
+        if name.endswith(_PARTIAL_SUFFIX) or not os.path.isfile(manifest):
+            continue
+        with open(manifest, encoding='utf-8') as f:
+            snapshots.append((path, json.load(f)))
+    return snapshots
+
+
+def _copy_database(path, target, pages, pause_seconds, progress, stop_event):
+    """path の DB を target へ段階的に写す。戻り値: (ページ数, ステップ数, user_version)"""
+    source = sqlite3.connect(path, timeout=30)
+    steps = [0, 0]
+
+    def on_step(status, remaining, total):
+        if stop_event is not None and stop_event.is_set():
+            raise BackupError(f"backup of {path} was stopped")
+        steps[0] += 1
+        steps[1] = total
+        if progress is not None:
+            progress(os.path.basename(path), total - remaining, total)
+        if pause_seconds and remaining:
+            time.sleep(pause_seconds)
+
+    try:
+        # 読み取りトランザクションを開いたまま写し、開始時点のスナップショットに固定する
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination, pages=pages, progress=on_step)
+            # スナップショットは単独のファイルとして扱えるように WAL を使わない形にする
+            destination.execute("PRAGMA journal_mode = DELETE")
+            result = destination.execute("PRAGMA quick_check").fetchone()[0]
+            if result != 'ok':
+                raise BackupError(f"quick_check failed for the copy of {path}: {result}")
+            user_version = database.schema_version(destination)
+        finally:
+            destination.close()
+    finally:
+        source.rollback()
+        source.close()
+    return steps[1], steps[0], user_version
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_COPY_BUFFER), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compress(source, target, level):
+    with open(source, 'rb') as src, gzip.open(target, 'wb', compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, _COPY_BUFFER)
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _archive_paths():
+    """アーカイブ済みの年のファイル（登録簿はライブの DB から読む）"""
+    conn = database.get_db_connection()
+    try:
+        years = sorted({m['year'] for m in archive.archived_months(conn)})
+    finally:
+        conn.close()
+    return [archive.archive_path(year) for year in years]
+
+
+def create_snapshot(directory=None, compress=True, pages=None, pause_seconds=None, keep=None, progress=None,
+                    stop_event=None):
+    """ライブの DB とアーカイブのスナップショットを作り、古いものを削除する。戻り値: スナップショットのパス
+
+    progress(ファイル名, 写したページ数, 全ページ数) はステップごとに呼ばれる。
+    stop_event がセットされると次のステップで BackupError を送出し、途中のファイルは削除する。
+    ライブの DB を先に写すため、同時にアーカイブの処理が進んでいても、ライブ側に
+    登録済みの月はアーカイブ側のコピーにも必ず含まれる。
+    """
+    directory = directory or backup_dir()
+    pages = pages or PAGES_PER_STEP
+    pause_seconds = STEP_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+    with _backup_lock:
+        os.makedirs(directory, exist_ok=True)
+        _remove_partials(directory)
+        previous = list_snapshots(directory)
+        reusable = {}
+        if previous:
+            last_path, last_manifest = previous[-1]
+            reusable = {(f['name'], f['sha256']): os.path.join(last_path, f['stored']) for f in last_manifest['files']}
+
+        started = time.perf_counter()
+        created = datetime.datetime.now()
+        name, suffix = created.strftime(_NAME_FORMAT), 1
+        while os.path.exists(os.path.join(directory, name)):
+            suffix += 1
+            name = f"{created.strftime(_NAME_FORMAT)}-{suffix}"
+        final = os.path.join(directory, name)
+        partial = final + _PARTIAL_SUFFIX
+        os.makedirs(partial)
+        try:
+            files = []
+            for path in [database.DB_FILE, *_archive_paths()]:
+                files.append(_snapshot_file(path, partial, compress, pages, pause_seconds, reusable, progress, stop_event))
+            manifest = {
+                'created_at': created.isoformat(timespec='seconds'),
+                'schema_version': files[0]['user_version'],
+                'elapsed_seconds': round(time.perf_counter() - started, 3),
+                'files': files,
+            }
+            with open(os.path.join(partial, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(partial, final)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        logger.info(
+            f"Backup {name} completed in {manifest['elapsed_seconds']:.1f}s: "
+            + ', '.join(f"{f['name']} {f['bytes'] / 1e6:.1f}MB -> {f['stored_bytes'] / 1e6:.1f}MB"
+                        f"{' (unchanged)' if f['reused'] else ''}" for f in files)
+        )
+        prune(keep, directory)
+    return final
+
+
+def _snapshot_file(path, snapshot_dir, compress, pages, pause_seconds, reusable, progress, stop_event):
+    name = os.path.basename(path)
+    copy_path = os.path.join(snapshot_dir, name)
+    started = time.perf_counter()
+    page_count, steps, user_version = _copy_database(path, copy_path, pages, pause_seconds, progress, stop_event)
+    size = os.path.getsize(copy_path)
+    digest = _sha256(copy_path)
+    stored = f"{name}.gz" if compress else name
+    previous = reusable.get((name, digest))
+    if previous is not None and os.path.basename(previous) == stored and os.path.exists(previous):
+        os.remove(copy_path)
+        _link_or_copy(previous, os.path.join(snapshot_dir, stored))
+    elif compress:
+        _compress(copy_path, os.path.join(snapshot_dir, stored), COMPRESS_LEVEL)
+        os.remove(copy_path)
+    return {
+        'name': name,
+        'stored': stored,
+        'bytes': size,
+        'stored_bytes': os.path.getsize(os.path.join(snapshot_dir, stored)),
+        'sha256': digest,
+        'pages': page_count,
+        'user_version': user_version,
+        'steps': steps,
+        'reused': previous is not None,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def _remove_partials(directory):
+    """前回途中で止まったスナップショットを削除する"""
+    for name in os.listdir(directory):
+        if name.endswith(_PARTIAL_SUFFIX):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def prune(keep=None, directory=None):
+    """新しい順に keep 個を残して古いスナップショットを削除する。戻り値: 削除したパスのリスト"""
+    keep = KEEP if keep is None else max(1, keep)
+    removed = []
+    for path, _ in list_snapshots(directory)[:-keep]:
+        shutil.rmtree(path)
+        removed.append(path)
+        logger.info(f"Removed old backup {os.path.basename(path)}")
+    return removed
+
+
+def _extract(snapshot, entry, target):
+    source = os.path.join(snapshot, entry['stored'])
+    if not os.path.exists(source):
+        raise BackupError(f"{entry['stored']} is missing from {snapshot}")
+    if entry['stored'].endswith('.gz'):
+        with gzip.open(source, 'rb') as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, _COPY_BUFFER)
+    else:
+        shutil.copyfile(source, target)
+    if _sha256(target) != entry['sha256']:
+        raise BackupError(f"checksum mismatch for {entry['name']} in {snapshot}")
+
+
+def _read_manifest(snapshot):
+    try:
+        with open(os.path.join(snapshot, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise BackupError(f"not a backup snapshot: {snapshot}") from None
+
+
+def verify(snapshot):
+    """スナップショットを一時ディレクトリに展開し、チェックサムと integrity_check を確認する"""
+    manifest = _read_manifest(snapshot)
+    with tempfile.TemporaryDirectory() as tmp:
+        for entry in manifest['files']:
+            target = os.path.join(tmp, entry['name'])
+            _extract(snapshot, entry, target)
+            conn = sqlite3.connect(target)
+            try:
+                result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                conn.close()
+            if result != 'ok':
+                raise BackupError(f"integrity_check failed for {entry['name']} in {snapshot}: {result}")
+    return manifest
+
+
+def restore(snapshot, destination):
+    """スナップショットを destination ディレクトリへ展開する（既存のファイルは上書きしない）
+
+    アプリを止めてから、展開したファイルをデータディレクトリへ置き換える。
+    """
+    manifest = _read_manifest(snapshot)
+    os.makedirs(destination, exist_ok=True)
+    targets = [os.path.join(destination, entry['name']) for entry in manifest['files']]
+    existing = [t for t in targets if os.path.exists(t)]
+    if existing:
+        raise BackupError(f"refusing to overwrite existing files: {', '.join(existing)}")
+    for entry, target in zip(manifest['files'], targets):
+        _extract(snapshot, entry, target)
+    return targets
+
+
+class BackupScheduler:
+    """interval_minutes ごとにスナップショットを作るバックグラウンドスレッド
+
+    起動時は最新のスナップショットの時刻から次回の実行時刻を決めるため、
+    アプリを頻繁に再起動してもバックアップが途切れない。
+    """
+
+    def __init__(self, interval_minutes=None, directory=None):
+        self.interval_seconds = (INTERVAL_MINUTES if interval_minutes is None else interval_minutes) * 60
+        self.directory = directory
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name='backup', daemon=True)
+            self._thread.start()
+        return self
+
+    def _first_delay(self):
+        snapshots = list_snapshots(self.directory)
+        if not snapshots:
+            return 0
+        last = datetime.datetime.fromisoformat(snapshots[-1][1]['created_at'])
+        age = (datetime.datetime.now() - last).total_seconds()
+        return max(0, self.interval_seconds - age)
+
+    def _run(self):
+        delay = self._first_delay()
+        while not self._stop.wait(delay):
+            try:
+                create_snapshot(self.directory, stop_event=self._stop)
+            except Exception as e:
+                logger.error(f"Scheduled backup failed: {e}")
+            delay = self.interval_seconds
+
+    def stop(self, timeout=None):
+        """実行中のバックアップは次のステップで中止する（途中のファイルは残さない）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
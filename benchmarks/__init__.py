@@ -0,0 +1,10 @@
+"""GUI を起動せずに api.py / database.py の性能を測るためのベンチマーク群
+
+各スクリプトは一時ディレクトリに DB を作成して実行するため、
+ユーザーデータディレクトリの本番 DB には触れない。
+
+    python -m benchmarks.bench_connection_pool
+
+`python -m benchmarks` は datagen.py の合成データに対して scenarios.py の
+全シナリオを実行し、結果を JSON で出力する。
+"""
@@ -0,0 +1,102 @@
+"""ベンチマーク一式を実行し、結果を JSON で出力する
+
+    python -m benchmarks [--employees 200] [--months 3] [--events 1000] [--seed 0]
+                         [--scenario NAME ...] [--iterations N] [--output result.json]
+                         [--compare baseline.json]
+
+同じ seed とデータ量なら生成データは毎回同じになるため、別の実行の JSON と
+--compare で比較できる（ops/s の比と p95 の比を表示する）。
+"""
+import argparse
+import datetime
+import json
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+import database
+from benchmarks import datagen, scenarios
+from benchmarks.common import temporary_database
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    with temporary_database():
+        started = time.perf_counter()
+        with database.db_connection() as conn:
+            dataset = datagen.generate(conn, args.employees, args.months, args.events, args.seed)
+        generate_seconds = time.perf_counter() - started
+        print(f"generated {dataset['punches']} punches / {dataset['events']} events "
+              f"for {dataset['employees']} employees in {generate_seconds:.1f}s", file=sys.stderr)
+
+        results = {}
+        for name in args.scenario or scenarios.SCENARIOS:
+            results[name] = scenarios.run_scenario(name, dataset, args.iterations)
+            print(f"{name:<26} {results[name]['ops_per_second']:>10} ops/s  p95 {results[name]['p95_ms']} ms",
+                  file=sys.stderr)
+
+    dataset = {k: v for k, v in dataset.items() if k not in ('employee_ids', 'admin_id')}
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'dataset': {**dataset, 'generate_seconds': round(generate_seconds, 2)},
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """baseline に対する ops/s の比（>1 が速い）と p95 の比（<1 が速い）を表示する"""
+    print(f"{'scenario':<26} {'ops/s':>10} {'baseline':>10} {'ratio':>7} {'p95 ratio':>10}", file=sys.stderr)
+    for name, result in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        ratio = result['ops_per_second'] / base['ops_per_second'] if base['ops_per_second'] else float('nan')
+        p95 = result['p95_ms'] / base['p95_ms'] if base['p95_ms'] else float('nan')
+        print(f"{name:<26} {result['ops_per_second']:>10} {base['ops_per_second']:>10} {ratio:>7.2f} {p95:>10.2f}",
+              file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Api のベンチマーク（JSON 出力）')
+    parser.add_argument('--employees', type=int, default=200)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios.SCENARIOS),
+                        help='実行するシナリオ（複数指定可、既定はすべて）')
+    parser.add_argument('--iterations', type=int, help='全シナリオの繰り返し回数（既定はシナリオごと）')
+    parser.add_argument('--output', help='結果の JSON を書き出すファイル（既定は標準出力）')
+    parser.add_argument('--compare', help='比較対象の過去の結果 JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""勤怠分析: Python ループでの集計 vs NumPy の一括集計 (analytics.py)
+
+ループ側は attendance.iter_segments / accumulate_daily をそのまま使い、
+残業・深夜・休憩・時間帯別人数も1区間ずつ計算する。両者の結果が一致することを確認する。
+
+    python -m benchmarks.bench_analytics [employees] [months]
+"""
+import datetime
+import sys
+import time
+
+import numpy as np
+
+import analytics
+import attendance
+import database
+from benchmarks import datagen
+from benchmarks.common import temporary_database
+
+SECONDS_PER_DAY = attendance.SECONDS_PER_DAY
+
+
+def loop_reference(conn, employee_ids, window_start, n_days):
+    """analytics.compute_matrices / overtime / headcount_by_hour と同じ値をループで求める"""
+    window_end = window_start + n_days * SECONDS_PER_DAY
+    rows = list(attendance.fetch_event_rows(conn, None, window_start, window_end))
+    totals = attendance.accumulate_daily(rows, window_start, window_end)
+
+    night = {}
+    breaks = {}
+    covered = [0] * 24
+    for employee_id, kind, start, end in attendance.iter_segments(rows):
+        start, end = max(start, window_start), min(end, window_end)
+        if end <= start:
+            continue
+        if kind == 'break':
+            count, total = breaks.get(employee_id, (0, 0))
+            breaks[employee_id] = (count + 1, total + end - start)
+            continue
+        for day_index, _ in attendance.split_by_day(start, end, window_start, window_end):
+            day_start = window_start + day_index * SECONDS_PER_DAY
+            piece_start, piece_end = max(start, day_start), min(end, day_start + SECONDS_PER_DAY)
+            for lo, hi in ((0, analytics.NIGHT_END_SECONDS), (analytics.NIGHT_START_SECONDS, SECONDS_PER_DAY)):
+                overlap = min(piece_end, day_start + hi) - max(piece_start, day_start + lo)
+                if overlap > 0:
+                    night[employee_id] = night.get(employee_id, 0) + overlap
+            for hour in range(24):
+                overlap = min(piece_end, day_start + (hour + 1) * 3600) - max(piece_start, day_start + hour * 3600)
+                if overlap > 0:
+                    covered[hour] += overlap
+
+    daily_ot = {}
+    weekly_ot = {}
+    for employee_id, (work, _) in totals.items():
+        daily_ot[employee_id] = sum(max(0, s - analytics.DAILY_OVERTIME_SECONDS) for s in work)
+        weeks = {}
+        for day_index, seconds in enumerate(work):
+            week = ((window_start // SECONDS_PER_DAY) + day_index + 3) // 7
+            weeks[week] = weeks.get(week, 0) + min(seconds, analytics.DAILY_OVERTIME_SECONDS)
+        weekly_ot[employee_id] = sum(max(0, s - analytics.WEEKLY_OVERTIME_SECONDS) for s in weeks.values())
+
+    zeros = [0] * n_days
+    return {
+        'work': [totals.get(i, (zeros, zeros))[0] for i in employee_ids],
+        'breaks': [totals.get(i, (zeros, zeros))[1] for i in employee_ids],
+        'night': [night.get(i, 0) for i in employee_ids],
+        'break_count': [breaks.get(i, (0, 0))[0] for i in employee_ids],
+        'break_total': [breaks.get(i, (0, 0))[1] for i in employee_ids],
+        'daily_overtime': [daily_ot.get(i, 0) for i in employee_ids],
+        'weekly_overtime': [weekly_ot.get(i, 0) for i in employee_ids],
+        'headcount': [c / (n_days * 3600) for c in covered],
+    }
+
+
+def vectorized(conn, employee_ids, window_start, n_days):
+    ids = np.array(employee_ids, dtype=np.int64)
+    window_end = window_start + n_days * SECONDS_PER_DAY
+    punches = analytics.load_punches(conn, None, window_start, window_end)
+    m = analytics.compute_matrices(punches, ids, window_start, n_days)
+    daily_ot, weekly_ot = analytics.overtime(m.work, window_start)
+    return {
+        'work': m.work,
+        'breaks': m.breaks,
+        'night': m.night.sum(axis=1),
+        'break_count': m.break_count,
+        'break_total': m.break_total,
+        'daily_overtime': daily_ot,
+        'weekly_overtime': weekly_ot,
+        'headcount': analytics.headcount_by_hour(m.work_segments, window_start, n_days),
+    }
+
+
+def main(employees=1000, months=6):
+    with temporary_database():
+        with database.db_connection() as conn:
+            started = time.perf_counter()
+            dataset = datagen.generate(conn, employees, months, events=0)
+            print(f"generated {dataset['punches']} punches for {employees} employees / {months} months "
+                  f"in {time.perf_counter() - started:.1f}s")
+            employee_ids = [dataset['admin_id'], *dataset['employee_ids']]
+            window_start = attendance.date_to_epoch(datetime.date.fromisoformat(dataset['start_date']))
+            n_days = (datetime.date.fromisoformat(dataset['end_date'])
+                      - datetime.date.fromisoformat(dataset['start_date'])).days + 1
+
+            started = time.perf_counter()
+            expected = loop_reference(conn, employee_ids, window_start, n_days)
+            loop_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            actual = vectorized(conn, employee_ids, window_start, n_days)
+            numpy_elapsed = time.perf_counter() - started
+
+        mismatched = [key for key in expected if not np.allclose(np.asarray(expected[key]), np.asarray(actual[key]))]
+        print(f"python loop                {loop_elapsed:8.3f}s")
+        print(f"numpy (analytics)          {numpy_elapsed:8.3f}s  ({loop_elapsed / numpy_elapsed:.1f}x)")
+        print(f"mismatched metrics: {mismatched or 'none'}")
+        return not mismatched
+
+
+if __name__ == '__main__':
+    ok = main(*(int(a) for a in sys.argv[1:3]))
+    sys.exit(0 if ok else 1)
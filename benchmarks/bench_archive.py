@@ -0,0 +1,113 @@
+"""締めた月のアーカイブ: ライブ DB のサイズと、アーカイブを跨ぐ集計・出力
+
+    python -m benchmarks.bench_archive [employees] [months]
+
+2024年1月からの合成データを作り、最後の3か月を残してアーカイブへ移す。
+移す前と後で、期間の集計（get_attendance_summaries）・勤怠分析・CSV 出力の
+結果が一致すること、ライブの日別集計が生の打刻と一致することを確認し、
+ライブ DB のサイズ（VACUUM 後）と、ライブのみ / アーカイブを跨ぐ集計の速さを比べる。
+"""
+import datetime
+import os
+import sys
+import tempfile
+
+import analytics
+import archive
+import attendance
+import bulk
+import database
+from api import Api
+from benchmarks import datagen
+from benchmarks.common import temporary_database, measure, report
+
+
+def _admin_api(admin_id):
+    api = Api()
+    api.current_user = {'id': admin_id, 'name': datagen.ADMIN_NAME, 'is_admin': True}
+    return api
+
+
+def _snapshot(api, conn, start, end, tmp):
+    summaries = api.get_attendance_summaries('all', start, end)
+    assert summaries['success'], summaries
+    window_start = attendance.date_to_epoch(datetime.date.fromisoformat(start))
+    window_end = attendance.date_to_epoch(datetime.date.fromisoformat(end) + datetime.timedelta(days=1))
+    punches = analytics.load_punches(conn, None, window_start, window_end) if analytics.available() else None
+    records, summary = os.path.join(tmp, 'records.csv'), os.path.join(tmp, 'summary.csv')
+    bulk.export_records(conn, records, None, start, end)
+    bulk.export_summaries(conn, summary, start, end)
+    exported = []
+    for path in (records, summary):
+        with open(path, encoding='utf-8') as f:
+            exported.append(f.read())
+    return summaries['employees'], None if punches is None else [a.tolist() for a in punches], exported
+
+
+def _size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def main(employees=200, months=18):
+    with temporary_database() as db_file, tempfile.TemporaryDirectory() as tmp:
+        with database.db_connection() as conn:
+            dataset = datagen.generate(conn, employees=employees, months=months, events=0)
+        last_month = datagen.add_months(datagen.DEFAULT_START, months - 1)
+        keep_from = datagen.add_months(last_month, -2)
+        # アーカイブとライブの境目を跨ぐ期間（締めた月の最後と、残す月の最初）
+        start = (keep_from - datetime.timedelta(days=20)).isoformat()
+        end = (keep_from + datetime.timedelta(days=20)).isoformat()
+        # アーカイブへ移す直近1年
+        year_range = (keep_from.replace(year=keep_from.year - 1).isoformat(),
+                      (keep_from - datetime.timedelta(days=1)).isoformat())
+        api = _admin_api(dataset['admin_id'])
+        print(f"{employees} employees, {months} months, {dataset['punches']} punches")
+
+        with database.db_connection() as conn:
+            before = _snapshot(api, conn, start, end, tmp)
+            before_year = _snapshot(api, conn, *year_range, tmp)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_before = _size(db_file)
+        elapsed, rate = measure(lambda: api.get_attendance_summaries('all', *year_range), 20)
+        report('year summary (live only)', elapsed, rate)
+
+        conn = database.get_db_connection()
+        try:
+            planned = archive.plan(conn, before=keep_from.strftime('%Y-%m'), keep_months=0)
+            started = datetime.datetime.now()
+            archive.archive(conn, before=keep_from.strftime('%Y-%m'), keep_months=0)
+            elapsed = (datetime.datetime.now() - started).total_seconds()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            since_day = archive.horizon_day(conn)
+            mismatches = attendance.verify_daily_totals(conn, since_day=since_day)
+            live_rows = conn.execute("SELECT COUNT(*) FROM attendance_records").fetchone()[0]
+        finally:
+            conn.close()
+        archived = sum(records for _, _, _, records in planned)
+        print(f"archived {len(planned)} months ({archived} punches) in {elapsed:.2f}s; "
+              f"{live_rows} punches left in the live database")
+        archive_bytes = sum(_size(archive.archive_path(year)) for year in {m[0][:4] for m in planned})
+        print(f"live database {size_before / 1e6:.1f} MB -> {_size(db_file) / 1e6:.1f} MB "
+              f"(archives {archive_bytes / 1e6:.1f} MB)")
+
+        with database.db_connection() as conn:
+            after = _snapshot(api, conn, start, end, tmp)
+            after_year = _snapshot(api, conn, *year_range, tmp)
+        elapsed, rate = measure(lambda: api.get_attendance_summaries('all', *year_range), 20)
+        report('year summary (archive)', elapsed, rate)
+        elapsed, rate = measure(lambda: api.get_attendance_summaries('all', start, end), 20)
+        report('boundary summary (live + archive)', elapsed, rate)
+
+    checks = {
+        'summaries': before[0] == after[0] and before_year[0] == after_year[0],
+        'analytics punches': before[1] == after[1] and before_year[1] == after_year[1],
+        'exports': before[2] == after[2] and before_year[2] == after_year[2],
+        'live rollup': not mismatches,
+    }
+    print(', '.join(f"{name}: {'ok' if ok else 'MISMATCH'}" for name, ok in checks.items()))
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
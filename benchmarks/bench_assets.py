@@ -0,0 +1,184 @@
+"""画面のファイルの配信: 従来の send_from_directory と、メモリ上の事前圧縮・キャッシュヘッダー
+
+    python -m benchmarks.bench_assets [rounds] [clients]
+
+実際の HTTP サーバーを起動し、ブラウザと同じ手順でページを読み込む（index.html を取得し、
+参照している CSS / JS を6本の接続で並行して取得する）。描画を止める HTML / CSS / JS が
+揃うまでの時間を、最初の描画までの時間の代わりとして比べる。
+
+- 初回（キャッシュなし）
+- 再読み込み（キャッシュあり。Cache-Control と ETag に従い、期限内のファイルは取得せず、
+  それ以外は If-None-Match で再検証する）
+- clients 台が同時に初回の読み込みを繰り返した場合の1秒あたりの読み込み数
+
+外部の CDN（Chart.js）は対象外。実際のウィンドウでの最初の描画までの時間は、
+`python main.py --startup-report` の logs/startup.json（paint）で確認できる。
+"""
+import http.client
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, send_from_directory
+from werkzeug.serving import make_server
+
+import assets
+import webserver
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend')
+ACCEPT_ENCODING = 'gzip, deflate, br' if assets.brotli is not None else 'gzip, deflate'
+# ブラウザが1つのホストに同時に張る接続数
+CONNECTIONS = 6
+_REFERENCE = re.compile(rb'(?:src|href)="([^":?#]+)"')
+
+
+def _legacy_app():
+    """変更前の main.py と同じ配信（毎回ディスクから読む）"""
+    app = Flask(__name__, static_folder=None)
+
+    @app.route('/')
+    def index():
+        return send_from_directory(FRONTEND_DIR, 'index.html')
+
+    @app.route('/<path:path>')
+    def static_files(path):
+        return send_from_directory(FRONTEND_DIR, path)
+    return app
+
+
+def _asset_app():
+    app = Flask(__name__, static_folder=None)
+    store = assets.AssetStore(FRONTEND_DIR)
+    store.build()
+
+    @app.route('/')
+    def index():
+        return store.response('index.html')
+
+    @app.route('/<path:path>')
+    def static_files(path):
+        return store.response(path)
+    return app
+
+
+class Browser:
+    """1つのタブ。Cache-Control / ETag に従ってキャッシュする"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cache = {}
+        self.requests = 0
+        self.bytes = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        return conn
+
+    def get(self, path):
+        cached = self.cache.get(path)
+        if cached and 'immutable' in cached['cache_control']:
+            return cached['body']
+        headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        conn = self._connection()
+        conn.request('GET', '/' + path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        self.requests += 1
+        self.bytes += len(body)
+        if response.status == 304:
+            return cached['body']
+        assert response.status == 200, (path, response.status)
+        if response.getheader('Content-Encoding') == 'gzip':
+            import gzip
+            body = gzip.decompress(body)
+        elif response.getheader('Content-Encoding') == 'br':
+            body = assets.brotli.decompress(body)
+        self.cache[path] = {
+            'body': body, 'etag': response.getheader('ETag'), 'cache_control': response.getheader('Cache-Control') or ''
+        }
+        return body
+
+    def load(self, pool):
+        """ページを読み込み、描画を止めるファイルが揃うまでの秒数を返す"""
+        started = time.perf_counter()
+        html = self.get('')
+        references = [r.decode() for r in _REFERENCE.findall(html)]
+        list(pool.map(self.get, references))
+        return time.perf_counter() - started
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _measure(label, port, rounds):
+    cold, warm = [], []
+    with ThreadPoolExecutor(CONNECTIONS) as pool:
+        for _ in range(rounds):
+            browser = Browser(port)
+            cold.append(browser.load(pool))
+            cold_requests, cold_bytes = browser.requests, browser.bytes
+            browser.requests = browser.bytes = 0
+            warm.append(browser.load(pool))
+    print(f"{label:<34} cold p50 {_percentile(cold, 50) * 1000:6.2f} ms ({cold_requests} req, {cold_bytes / 1000:5.1f} KB)  "
+          f"reload p50 {_percentile(warm, 50) * 1000:6.2f} ms ({browser.requests} req, {browser.bytes / 1000:4.1f} KB)")
+
+
+def _throughput(label, port, clients, duration=3.0):
+    stop = threading.Event()
+    counts = [0] * clients
+
+    def client(i):
+        with ThreadPoolExecutor(CONNECTIONS) as pool:
+            while not stop.is_set():
+                Browser(port).load(pool)
+                counts[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    print(f"{label:<34} {sum(counts) / duration:7.0f} cold page loads/s with {clients} clients")
+
+
+def main(rounds=50, clients=8):
+    started = time.perf_counter()
+    store = assets.AssetStore(FRONTEND_DIR)
+    files = store.build()
+    print(f"asset manifest: {files} files in {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"(brotli {'on' if assets.brotli else 'off'}), server {webserver.backend()}")
+
+    servers = [
+        ('send_from_directory (dev server)', make_server('127.0.0.1', 0, _legacy_app(), threaded=False)),
+        ('send_from_directory (threaded)', make_server('127.0.0.1', 0, _legacy_app(), threaded=True)),
+        (f'asset store ({webserver.backend()})', webserver.WSGIServer(_asset_app(), '127.0.0.1', 0)),
+    ]
+    threads = []
+    for _, server in servers:
+        t = threading.Thread(target=server.serve_forever, daemon=True)
+        t.start()
+        threads.append(t)
+    try:
+        for label, server in servers:
+            _measure(label, server.port, rounds)
+        for label, server in servers:
+            _throughput(label, server.port, clients)
+    finally:
+        for _, server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
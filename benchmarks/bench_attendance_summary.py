@@ -0,0 +1,122 @@
+"""勤怠集計: 従業員ごとの旧実装ループ vs 一括集計 (get_attendance_summaries)
+
+1年分の合成データ（日勤＋一部の夜勤）で比較する。
+
+    python -m benchmarks.bench_attendance_summary [employees]
+"""
+import datetime
+import itertools
+import random
+import sys
+import time
+
+import attendance
+import database
+from api import Api
+from benchmarks.common import temporary_database, add_employee
+
+START = datetime.datetime(2024, 1, 1)
+DAYS = 366
+
+
+def generate_year(conn, employees, seed=42):
+    rng = random.Random(seed)
+    ids = [add_employee(conn, f'emp{i:04d}', hourly_wage=1000 + i % 5 * 100) for i in range(employees)]
+    rows = []
+    night_workers = set()
+    for employee_id in ids:
+        night_shift = rng.random() < 0.1
+        if night_shift:
+            night_workers.add(employee_id)
+        for day in range(DAYS):
+            if rng.random() < 2 / 7:
+                continue
+            base = START + datetime.timedelta(days=day)
+            if night_shift:
+                start = base + datetime.timedelta(hours=22, minutes=rng.randint(-10, 10))
+                end = start + datetime.timedelta(hours=8, minutes=rng.randint(0, 30))
+                events = [('clock_in', start), ('clock_out', end)]
+            else:
+                start = base + datetime.timedelta(hours=9, minutes=rng.randint(-15, 15))
+                lunch = base + datetime.timedelta(hours=12, minutes=rng.randint(0, 30))
+                events = [
+                    ('clock_in', start),
+                    ('start_break', lunch),
+                    ('end_break', lunch + datetime.timedelta(minutes=rng.randint(40, 60))),
+                    ('clock_out', base + datetime.timedelta(hours=18, minutes=rng.randint(0, 60))),
+                ]
+            rows.extend((employee_id, t, ts.strftime('%Y-%m-%d %H:%M:%S')) for t, ts in events)
+    conn.executemany("INSERT INTO attendance_records (employee_id, event_type, timestamp) VALUES (?, ?, ?)", rows)
+    # 直接登録した打刻は日別集計に反映されないため作り直す
+    attendance.rebuild_employee_state(conn)
+    attendance.rebuild_daily_totals(conn)
+    conn.commit()
+    return ids, night_workers, len(rows)
+
+
+def legacy_summary(conn, employee_id, start_date_str, end_date_str):
+    """1従業員分を集計する旧実装（タイムスタンプを2回パースし、日跨ぎを分割しない）"""
+    start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
+    end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d') + datetime.timedelta(days=1)
+    records = conn.execute(
+        "SELECT event_type, timestamp FROM attendance_records WHERE employee_id = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
+        (employee_id, start_date.strftime('%Y-%m-%d %H:%M:%S'), end_date.strftime('%Y-%m-%d %H:%M:%S'))
+    ).fetchall()
+    daily = {}
+    for date_obj, group in itertools.groupby(records, key=lambda r: datetime.datetime.strptime(r['timestamp'], '%Y-%m-%d %H:%M:%S').date()):
+        total = 0
+        last_start = None
+        for record in group:
+            ts = datetime.datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S')
+            if record['event_type'] in ('clock_in', 'end_break'):
+                last_start = ts
+            elif last_start:
+                total += (ts - last_start).total_seconds()
+                last_start = None
+        daily[date_obj.strftime('%Y-%m-%d')] = total / 3600
+    labels = []
+    current = start_date.date()
+    while current < end_date.date():
+        labels.append(current.strftime('%Y-%m-%d'))
+        current += datetime.timedelta(days=1)
+    return [daily.get(label, 0) for label in labels]
+
+
+def main(employees=300):
+    with temporary_database():
+        conn = database.get_db_connection()
+        started = time.perf_counter()
+        ids, night_workers, n_rows = generate_year(conn, employees)
+        print(f"generated {n_rows} punches for {employees} employees in {time.perf_counter() - started:.2f}s")
+
+        api = Api()
+        api.current_user = {'id': 0, 'name': 'bench', 'is_admin': True}
+        start, end = '2024-01-01', '2024-12-31'
+
+        started = time.perf_counter()
+        legacy = {employee_id: legacy_summary(conn, employee_id, start, end) for employee_id in ids}
+        legacy_elapsed = time.perf_counter() - started
+        conn.close()
+
+        started = time.perf_counter()
+        result = api.get_attendance_summaries('all', start, end)
+        batch_elapsed = time.perf_counter() - started
+        assert result['success'], result
+
+        print(f"legacy per-employee loop   {legacy_elapsed:8.3f}s")
+        print(f"get_attendance_summaries   {batch_elapsed:8.3f}s  ({legacy_elapsed / batch_elapsed:.1f}x)")
+
+        # 日勤者は旧実装と一致し、夜勤者は旧実装では日跨ぎ分が欠落する
+        mismatched = sum(
+            1 for item in result['employees']
+            if item['employee_id'] not in night_workers
+            and any(abs(a - b) > 1e-9 for a, b in zip(legacy[item['employee_id']], item['data']))
+        )
+        night_hours = sum(item['summary']['total_hours'] for item in result['employees'] if item['employee_id'] in night_workers)
+        legacy_night_hours = sum(sum(legacy[i]) for i in night_workers)
+        print(f"day-shift employees differing from legacy: {mismatched}")
+        print(f"night-shift hours: legacy {legacy_night_hours:.0f}h, split across midnight {night_hours:.0f}h")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
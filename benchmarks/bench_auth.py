@@ -0,0 +1,73 @@
+"""ログインのスループット（パスワード / PIN / 社員証、検証済みキャッシュの有無）
+
+    python -m benchmarks.bench_auth [employees]
+
+各従業員が1回ずつログインする流れを繰り返し、1秒あたりのログイン数を比べる。
+最初の行は、werkzeug の既定（1,000,000 回）で作られた既存のハッシュを検証し、
+設定の反復回数で作り直す（rehash）ときのコスト。
+"""
+import sys
+
+from werkzeug.security import generate_password_hash
+
+import auth
+import database
+from api import Api
+from benchmarks.common import temporary_database, add_employee, measure, report
+
+PASSWORD = 'kiosk-password'
+PIN = '482913'
+
+
+def _login_all(method, credentials):
+    api = Api()
+    items = iter(credentials)
+
+    def call():
+        assert method(api, *next(items))['success']
+    return call
+
+
+def main(employees=20):
+    with temporary_database():
+        legacy = generate_password_hash(PASSWORD, method='pbkdf2:sha256')
+        pin_hash = auth.hash_pin(PIN)
+        names = [f'emp{i:04d}' for i in range(employees)]
+        with database.db_connection() as conn:
+            for i, name in enumerate(names):
+                employee_id = add_employee(conn, name, password=legacy)
+                conn.execute(
+                    "UPDATE employees SET pin_hash = ?, badge_digest = ? WHERE id = ?",
+                    (pin_hash, auth.badge_digest(f'BADGE-{i:06d}'), employee_id)
+                )
+            conn.commit()
+
+        passwords = [(name, PASSWORD) for name in names]
+        pins = [(name, PIN) for name in names]
+        badges = [(f'BADGE-{i:06d}',) for i in range(employees)]
+        print(f"{employees} employees, password {auth.PASSWORD_METHOD}, PIN {auth.PIN_METHOD}")
+
+        auth.credential_cache.clear()
+        elapsed, rate = measure(_login_all(Api.login, passwords), employees)
+        report('password (legacy hash + rehash)', elapsed, rate)
+
+        auth.credential_cache.clear()
+        elapsed, rate = measure(_login_all(Api.login, passwords), employees)
+        report('password (configured cost)', elapsed, rate)
+        elapsed, rate = measure(_login_all(Api.login, passwords * 50), employees * 50)
+        report('password (verified cache)', elapsed, rate)
+
+        auth.credential_cache.clear()
+        elapsed, rate = measure(_login_all(Api.login_with_pin, pins), employees)
+        report('PIN', elapsed, rate)
+        elapsed, rate = measure(_login_all(Api.login_with_pin, pins * 50), employees * 50)
+        report('PIN (verified cache)', elapsed, rate)
+
+        elapsed, rate = measure(_login_all(Api.login_with_badge, badges * 50), employees * 50)
+        report('badge', elapsed, rate)
+        print(f"cache: {len(auth.credential_cache)} entries, "
+              f"{auth.credential_cache.hits} hits / {auth.credential_cache.misses} misses")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,104 @@
+"""バックアップ中の打刻（record_attendance）の応答時間
+
+    python -m benchmarks.bench_backup [employees] [months]
+
+合成データの DB に対して複数の端末（スレッド）が打刻を続け、次の各場合の
+応答時間を比べる。
+
+- バックアップなし
+- 段階的なバックアップ（既定の BACKUP_PAGES_PER_STEP / BACKUP_STEP_PAUSE_MS）
+- 1ステップで全ページを写すバックアップ
+
+バックアップは計測の間くり返し実行し、最後のスナップショットを展開して
+チェックサムと integrity_check を確認する。
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import attendance
+import backup
+import database
+from api import Api
+from benchmarks import datagen
+from benchmarks.common import temporary_database
+
+TERMINALS = 8
+DURATION_SECONDS = 5.0
+PUNCH_INTERVAL_SECONDS = 0.01
+_NEXT = {'none': 'clock_in', 'clock_out': 'clock_in', 'clock_in': 'clock_out', 'end_break': 'clock_out',
+         'start_break': 'end_break'}
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _terminal(employee_id, stop, latencies):
+    api = Api()
+    api.current_user = {'id': employee_id, 'name': f'emp{employee_id}', 'is_admin': False}
+    event_type = _NEXT[api.get_user_status()['status']]
+    while not stop.is_set():
+        started = time.perf_counter()
+        result = api.record_attendance(event_type)
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert result['success'], result
+        event_type = _NEXT[event_type]
+        time.sleep(PUNCH_INTERVAL_SECONDS)
+
+
+def _backup_loop(directory, stop, runs, options):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            path = backup.create_snapshot(directory, keep=1, stop_event=stop, **options)
+        except backup.BackupError:
+            # 計測の終了で中止された回
+            return
+        runs.append((time.perf_counter() - started, path))
+
+
+def run(label, employee_ids, directory, backup_options=None):
+    stop = threading.Event()
+    latencies, runs = [], []
+    threads = [threading.Thread(target=_terminal, args=(e, stop, latencies)) for e in employee_ids[:TERMINALS]]
+    if backup_options is not None:
+        threads.append(threading.Thread(target=_backup_loop, args=(directory, stop, runs, backup_options)))
+    for t in threads:
+        t.start()
+    time.sleep(DURATION_SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    line = (f"{label:<28} {len(latencies) / DURATION_SECONDS:7.0f} punches/s  p50 {_percentile(latencies, 50):6.2f} ms  "
+            f"p99 {_percentile(latencies, 99):7.2f} ms  max {max(latencies):7.2f} ms")
+    if runs:
+        line += f"  | {len(runs)} backups, {sum(r[0] for r in runs) / len(runs):.2f}s each"
+    print(line)
+    return runs
+
+
+def main(employees=200, months=12):
+    with temporary_database(), tempfile.TemporaryDirectory() as tmp:
+        with database.db_connection() as conn:
+            dataset = datagen.generate(conn, employees=employees, months=months, events=0)
+        attendance.state_cache.invalidate()
+        print(f"{dataset['punches']} punches, database {os.path.getsize(database.DB_FILE) / 1e6:.1f} MB, "
+              f"{TERMINALS} terminals")
+        ids = dataset['employee_ids']
+        run('no backup', ids, tmp)
+        runs = run(f'stepped ({backup.PAGES_PER_STEP} pages/step)', ids, tmp, {})
+        # keep=1 のため、次の計測で消される前に確認する
+        manifest = backup.verify(runs[-1][1])
+        run('single step', ids, tmp, {'pages': -1, 'pause_seconds': 0})
+
+        entry = manifest['files'][0]
+        print(f"last stepped snapshot: {entry['bytes'] / 1e6:.1f} MB -> {entry['stored_bytes'] / 1e6:.1f} MB gzip, "
+              f"{entry['steps']} steps, verified")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,65 @@
+"""一括インポート/エクスポートのスループットとメモリ使用量
+
+    python -m benchmarks.bench_bulk_import [rows]
+"""
+import csv
+import datetime
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import bulk
+import database
+from benchmarks.common import temporary_database, add_employee
+
+
+def write_punch_csv(path, employees, rows):
+    """従業員ごとに出勤→休憩→復帰→退勤を繰り返す CSV を生成する"""
+    cycle = ('clock_in', 'start_break', 'end_break', 'clock_out')
+    offsets = (0, 3 * 3600, 4 * 3600, 9 * 3600)
+    start = datetime.datetime(2020, 1, 1, 9)
+    per_employee = rows // len(employees)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('employee_id', 'event_type', 'timestamp'))
+        for employee_id in employees:
+            for i in range(per_employee):
+                day, step = divmod(i, 4)
+                ts = start + datetime.timedelta(days=day, seconds=offsets[step])
+                writer.writerow((employee_id, cycle[step], ts.strftime('%Y-%m-%d %H:%M:%S')))
+    return per_employee * len(employees)
+
+
+def peak_rss_mb():
+    # Linux では KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(rows=1_000_000):
+    with temporary_database(), tempfile.TemporaryDirectory() as tmp:
+        conn = database.get_db_connection()
+        employees = [add_employee(conn, f'emp{i:04d}') for i in range(200)]
+        conn.commit()
+
+        src = os.path.join(tmp, 'punches.csv')
+        n = write_punch_csv(src, employees, rows)
+        print(f"generated {n} rows ({os.path.getsize(src) / 1e6:.1f} MB), peak RSS {peak_rss_mb():.0f} MB")
+
+        started = time.perf_counter()
+        result = bulk.import_punches(conn, src)
+        elapsed = time.perf_counter() - started
+        print(f"import: {result['imported']} rows in {elapsed:.2f}s ({result['imported'] / elapsed:,.0f} rows/s), "
+              f"rejected={result['rejected']}, peak RSS {peak_rss_mb():.0f} MB")
+
+        out = os.path.join(tmp, 'export.jsonl')
+        started = time.perf_counter()
+        count = bulk.export_records(conn, out)
+        elapsed = time.perf_counter() - started
+        print(f"export: {count} rows in {elapsed:.2f}s ({count / elapsed:,.0f} rows/s), peak RSS {peak_rss_mb():.0f} MB")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,60 @@
+"""接続プール導入前後の API 呼び出しスループット比較
+
+    python -m benchmarks.bench_connection_pool [iterations]
+"""
+import sys
+import threading
+import time
+
+import database
+from api import Api
+from benchmarks.common import temporary_database, add_employee, measure, report
+
+STATUS_SQL = "SELECT event_type FROM attendance_records WHERE employee_id = ? ORDER BY timestamp DESC LIMIT 1"
+
+
+def legacy_status(employee_id):
+    """プール導入前の get_user_status と同じ接続の開き方"""
+    conn = database.get_db_connection()
+    conn.execute(STATUS_SQL, (employee_id,)).fetchone()
+    conn.close()
+
+
+def run_threaded(func, threads, iterations):
+    per_thread = iterations // threads
+
+    def worker():
+        for _ in range(per_thread):
+            func()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return elapsed, per_thread * threads / elapsed
+
+
+def main(iterations=5000):
+    with temporary_database():
+        conn = database.get_db_connection()
+        employee_id = add_employee(conn, 'bench')
+        conn.commit()
+        conn.close()
+
+        api = Api()
+        api.current_user = {'id': employee_id, 'name': 'bench', 'is_admin': False}
+
+        report('get_user_status (connect per call)', *measure(lambda: legacy_status(employee_id), iterations))
+        report('get_user_status (pooled)', *measure(api.get_user_status, iterations))
+        report('get_user_status x8 threads (connect)', *run_threaded(lambda: legacy_status(employee_id), 8, iterations))
+        report('get_user_status x8 threads (pooled)', *run_threaded(api.get_user_status, 8, iterations))
+
+        events = iter(['clock_in', 'clock_out'] * iterations)
+        report('record_attendance (pooled)', *measure(lambda: api.record_attendance(next(events)), iterations // 5))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
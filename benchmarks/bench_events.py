@@ -0,0 +1,105 @@
+"""カレンダーのイベント期間検索（従来のインデックス検索 / R*Tree / 表示期間キャッシュ）の比較
+
+繰り返しイベント（2020年からの毎日・毎週の予定）も含め、展開の手間が
+表示期間の長さにだけ比例することを確認する。
+
+    python -m benchmarks.bench_events [n_events] [n_recurring]
+"""
+import datetime
+import random
+import sys
+
+import database
+import events
+from benchmarks.common import temporary_database, measure, report
+
+WINDOW_DAYS = 45
+YEARS = 10
+
+
+def generate_events(conn, n_events, seed=1):
+    """YEARS 年分に散らばった、数時間〜数日のイベントを登録する"""
+    rng = random.Random(seed)
+    origin = datetime.datetime(2020, 1, 1)
+    span_minutes = YEARS * 365 * 24 * 60
+    rows = []
+    for i in range(n_events):
+        start = origin + datetime.timedelta(minutes=rng.randrange(span_minutes))
+        if rng.random() < 0.2:
+            end = start + datetime.timedelta(days=rng.randint(1, 5))
+        else:
+            end = start + datetime.timedelta(minutes=rng.randint(30, 480))
+        rows.append((f'event {i}', '', start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), 0))
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO events (title, description, start_datetime, end_datetime, is_allday) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+
+
+def generate_recurring(conn, n_series, seed=3):
+    """2020年から始まる毎日/毎週/毎月の繰り返しイベントを登録する（半数は無期限）"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_series):
+        start = datetime.datetime(2020, 1, 1, rng.randint(6, 20)) + datetime.timedelta(days=rng.randrange(60))
+        end = start + datetime.timedelta(hours=1)
+        rrule = rng.choice(('FREQ=DAILY', 'FREQ=WEEKLY;BYDAY=MO,WE,FR', 'FREQ=MONTHLY'))
+        if i % 2:
+            rrule += f';UNTIL={2020 + rng.randrange(YEARS)}1231'
+        start_str = start.strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((f'series {i}', start_str, end.strftime('%Y-%m-%d %H:%M:%S'), rrule,
+                     events.resolve_recurrence_until(rrule, start_str)))
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO events (title, start_datetime, end_datetime, rrule, recurrence_until) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+
+
+def month_windows(n, seed=2):
+    """カレンダー表示と同じく、月初の7日前から月末の8日後までの期間を返す"""
+    rng = random.Random(seed)
+    windows = []
+    for _ in range(n):
+        month_start = datetime.datetime(2020 + rng.randrange(YEARS), rng.randint(1, 12), 1)
+        start = month_start - datetime.timedelta(days=7)
+        end = start + datetime.timedelta(days=WINDOW_DAYS)
+        windows.append((start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')))
+    return windows
+
+
+def main(n_events=100_000, n_recurring=200, iterations=500):
+    with temporary_database():
+        with database.db_connection() as conn:
+            generate_events(conn, n_events)
+            generate_recurring(conn, n_recurring)
+        windows = month_windows(iterations)
+        print(f"{n_events} events + {n_recurring} recurring series, {iterations} month windows")
+
+        with database.db_connection() as conn:
+            rtree = [events.query_events(conn, start, end) for start, end in windows[:50]]
+            events._rtree_available = False
+            assert rtree == [events.query_events(conn, start, end) for start, end in windows[:50]]
+
+            it = iter(windows * 2)
+            elapsed, rate = measure(lambda: events.query_events(conn, *next(it)), iterations)
+            report('index scan (no R*Tree)', elapsed, rate)
+
+            events._rtree_available = None
+            it = iter(windows * 2)
+            elapsed, rate = measure(lambda: events.query_events(conn, *next(it)), iterations)
+            report('R*Tree', elapsed, rate)
+
+        hot = windows[:3]
+        for start, end in hot:
+            events.get_events_cached(start, end)
+        it = iter(hot * iterations)
+        elapsed, rate = measure(lambda: events.get_events_cached(*next(it)), iterations)
+        report('window cache (hit)', elapsed, rate)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,93 @@
+"""マイグレーション中の打刻の遅延と、中断からの再開
+
+    python -m benchmarks.bench_migration [employees] [months]
+
+基本スキーマの DB に合成データを入れ、ts_epoch のバックフィルを別スレッドで
+実行しながら打刻を続けて、その遅延を計測する。途中で一度止めて再開し、
+最後に全行の ts_epoch が timestamp と一致することを確認する。
+"""
+import sys
+import threading
+import time
+
+import database
+import migrations
+from benchmarks import datagen
+from benchmarks.common import temporary_database
+
+_INSERT_PUNCH = "INSERT INTO attendance_records (employee_id, event_type, timestamp) VALUES (?, ?, ?)"
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _punch_loop(employee_ids, stop, latencies):
+    """打刻端末の代わりに、短い書き込みトランザクションを続ける"""
+    with database.db_connection() as conn:
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            with database.write_transaction(conn):
+                conn.execute(_INSERT_PUNCH, (employee_ids[i % len(employee_ids)], 'clock_in', '2030-01-01 09:00:00'))
+            latencies.append((time.perf_counter() - started) * 1000)
+            i += 1
+            time.sleep(0.002)
+
+
+def _run(conn, employee_ids, **kwargs):
+    latencies = []
+    stop = threading.Event()
+    worker = threading.Thread(target=_punch_loop, args=(employee_ids, stop, latencies))
+    worker.start()
+    started = time.perf_counter()
+    try:
+        migrations.migrate(conn, **kwargs)
+        interrupted = False
+    except migrations.MigrationInterrupted:
+        interrupted = True
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worker.join()
+    return elapsed, interrupted, latencies
+
+
+def main(employees=300, months=12):
+    with temporary_database(migrate=False):
+        conn = database.get_db_connection()
+        dataset = datagen.generate(conn, employees=employees, months=months, events=0)
+        print(f"generated {dataset['punches']} punches (schema version {database.schema_version(conn)})")
+
+        # 半分ほど進んだところで止める
+        halt = threading.Event()
+
+        def progress(migration, position, target):
+            if position * 2 >= target:
+                halt.set()
+
+        elapsed, interrupted, latencies = _run(conn, dataset['employee_ids'], progress=progress, stop_event=halt)
+        status = migrations.status(conn)[0]
+        print(f"first run:  {elapsed:.2f}s interrupted={interrupted} "
+              f"at {status['backfill_position']}/{status['backfill_target']}, {len(latencies)} punches")
+
+        elapsed, interrupted, more = _run(conn, dataset['employee_ids'])
+        latencies += more
+        print(f"resumed:    {elapsed:.2f}s, schema version {database.schema_version(conn)}, {len(more)} punches")
+        print(f"punch latency during migration: p50 {_percentile(latencies, 50):.2f} ms, "
+              f"p99 {_percentile(latencies, 99):.2f} ms, max {max(latencies):.2f} ms")
+
+        mismatches = conn.execute(
+            "SELECT COUNT(*) FROM attendance_records "
+            "WHERE ts_epoch IS NULL OR ts_epoch != CAST(strftime('%s', timestamp) AS INTEGER)"
+        ).fetchone()[0]
+        conn.close()
+    if mismatches:
+        print(f"ERROR: {mismatches} rows have a wrong ts_epoch")
+        return 1
+    print("all rows have ts_epoch matching timestamp")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
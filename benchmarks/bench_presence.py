@@ -0,0 +1,152 @@
+"""在席状況ボードの更新コスト: 従業員ごとの問い合わせ / 全件の集計 / 差分の取得
+
+    python -m benchmarks.bench_presence [employees] [punches]
+
+ダッシュボードの1回の更新にかかる時間を、次の方法で比べる。
+
+- 従業員ごとに最新の打刻を問い合わせる（get_user_status をキャッシュなしで全員分）
+- employee_state と employees を1回の SQL で全件読む
+- get_presence の全件（ボードのスナップショット）
+- get_presence(since)（前回の更新から punches 件打刻した後の差分）
+
+get_presence は画面へ送るときと同じく JSON への変換まで含めて測り、送る量も表示する。
+
+最後に、打刻スレッドと打刻キュー（commit モード）の両方で打刻したあとのボードが
+DB の employee_state と一致すること、差分を適用した画面側の状態が全件と一致することを確認する。
+"""
+import json
+import random
+import sys
+import threading
+import time
+
+import attendance
+import database
+import presence
+import punch_queue
+from api import Api
+from benchmarks import datagen
+from benchmarks.common import temporary_database, measure, report
+
+_NEXT = {'none': 'clock_in', 'clock_out': 'clock_in', 'clock_in': 'start_break', 'start_break': 'end_break',
+         'end_break': 'clock_out'}
+_LATEST_QUERY = (
+    "SELECT event_type, timestamp FROM attendance_records WHERE employee_id = ? "
+    "ORDER BY timestamp DESC, id DESC LIMIT 1"
+)
+_ALL_QUERY = (
+    "SELECT e.id, e.name, s.state, s.last_timestamp FROM employees e "
+    "LEFT JOIN employee_state s ON s.employee_id = e.id"
+)
+
+
+def _api(employee_id, is_admin=False):
+    api = Api()
+    api.current_user = {'id': employee_id, 'name': f'emp{employee_id}', 'is_admin': is_admin}
+    return api
+
+
+def _punch_randomly(rng, employee_ids, count):
+    for employee_id in rng.sample(employee_ids, count):
+        api = _api(employee_id)
+        result = api.record_attendance(_NEXT[api.get_user_status()['status']])
+        assert result['success'], result
+
+
+def _punch_concurrently(employee_ids, rounds):
+    def terminal(ids):
+        for _ in range(rounds):
+            for employee_id in ids:
+                api = _api(employee_id)
+                result = api.record_attendance(_NEXT[api.get_user_status()['status']])
+                assert result['success'], result
+
+    threads = [threading.Thread(target=terminal, args=(employee_ids[i::8],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def _board_matches_database():
+    with database.db_connection() as conn:
+        expected = {row[0]: (row[2], row[3]) for row in conn.execute(_ALL_QUERY)}
+    _, entries, _ = presence.board.snapshot()
+    return {e['employee_id']: (e['state'], e['since']) for e in entries} == expected
+
+
+def main(employees=2000, punches=20):
+    with temporary_database():
+        with database.db_connection() as conn:
+            dataset = datagen.generate(conn, employees=employees, months=1, events=0)
+        ids = dataset['employee_ids']
+        admin = _api(dataset['admin_id'], is_admin=True)
+        rng = random.Random(0)
+        print(f"{employees} employees, {dataset['punches']} punches")
+
+        def per_employee():
+            with database.db_connection() as conn:
+                for employee_id in ids:
+                    conn.execute(_LATEST_QUERY, (employee_id,)).fetchone()
+
+        def aggregate():
+            with database.db_connection() as conn:
+                conn.execute(_ALL_QUERY).fetchall()
+
+        elapsed, rate = measure(per_employee, 5)
+        report('per-employee latest punch', elapsed, rate)
+        elapsed, rate = measure(aggregate, 50)
+        report('employee_state join (all rows)', elapsed, rate)
+
+        started = time.perf_counter()
+        presence.board.load()
+        print(f"board load: {(time.perf_counter() - started) * 1000:.1f} ms")
+        elapsed, rate = measure(lambda: json.dumps(admin.get_presence(), ensure_ascii=False), 200)
+        report('get_presence (full)', elapsed, rate)
+        print(f"  {len(json.dumps(admin.get_presence(), ensure_ascii=False)) / 1000:.1f} KB per refresh")
+
+        # 画面側の状態（差分を適用していく）
+        first = admin.get_presence()
+        client = {e['employee_id']: e for e in first['employees']}
+        seq = first['seq']
+        delta_seconds, rounds, changed, delta_bytes = 0.0, 50, 0, 0
+        for _ in range(rounds):
+            _punch_randomly(rng, ids, punches)
+            started = time.perf_counter()
+            result = admin.get_presence(seq)
+            delta_bytes += len(json.dumps(result, ensure_ascii=False))
+            delta_seconds += time.perf_counter() - started
+            assert not result['full'], result
+            changed += len(result['changes'])
+            for change in result['changes']:
+                client[change['employee_id']] = change
+            seq = result['seq']
+        report(f'get_presence(since) after {punches} punches', delta_seconds, rounds / delta_seconds)
+        print(f"  {changed / rounds:.1f} changes, {delta_bytes / rounds / 1000:.1f} KB per refresh")
+
+        _punch_concurrently(ids[:400], rounds=3)
+        threaded_ok = _board_matches_database()
+        punch_queue.start('commit', flush_interval=0.005)
+        try:
+            _punch_concurrently(ids[:400], rounds=3)
+        finally:
+            punch_queue.stop()
+        attendance.state_cache.invalidate()
+        queued_ok = _board_matches_database()
+
+        result = admin.get_presence(seq)
+        for change in result['changes'] if not result['full'] else result['employees']:
+            client[change['employee_id']] = change
+        full = {e['employee_id']: e for e in admin.get_presence()['employees']}
+
+    checks = {
+        'board vs employee_state (threads)': threaded_ok,
+        'board vs employee_state (punch queue)': queued_ok,
+        'client deltas vs full': client == full,
+    }
+    print(', '.join(f"{name}: {'ok' if ok else 'MISMATCH'}" for name, ok in checks.items()))
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
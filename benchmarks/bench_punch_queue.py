@@ -0,0 +1,163 @@
+"""打刻キュー（グループコミット）のスループットと、異常終了からの復旧
+
+    python -m benchmarks.bench_punch_queue [terminals] [punches_per_terminal]
+
+1. off / commit / journal の各モードで、複数の端末（スレッド）が同時に打刻した
+   ときのスループットと応答時間を比べる。
+2. journal モードの子プロセスに打刻させ、途中で SIGKILL する。親プロセスで
+   キューを起動し直してジャーナルから復旧し、応答済み（ack 済み）の打刻が
+   すべて DB にあること、employee_state と日別集計が打刻と一致することを確認する。
+   続けて復旧した各従業員の状態の表示が DB と一致し、無効な打刻が拒否され、
+   次の打刻が受け付けられて書き込まれることを確認する。
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import attendance
+import database
+import punch_queue
+from api import Api
+from benchmarks.common import temporary_database, add_employee
+
+_NEXT = {'clock_in': 'clock_out', 'clock_out': 'clock_in'}
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _terminal(employee_id, punches, latencies):
+    api = Api()
+    api.current_user = {'id': employee_id, 'name': f'emp{employee_id}', 'is_admin': False}
+    event_type = 'clock_in'
+    for _ in range(punches):
+        started = time.perf_counter()
+        result = api.record_attendance(event_type)
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert result['success'], result
+        event_type = _NEXT[event_type]
+
+
+def run_mode(mode, terminals, punches):
+    with temporary_database():
+        with database.db_connection() as conn:
+            employees = [add_employee(conn, f'emp{i:04d}') for i in range(terminals)]
+            conn.commit()
+        attendance.state_cache.invalidate()
+        punch_queue.start(mode)
+        latencies = []
+        threads = [threading.Thread(target=_terminal, args=(e, punches, latencies)) for e in employees]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        queue = punch_queue.active()
+        # 終了時にキューに残った打刻の書き込みまで含めて計る
+        punch_queue.stop()
+        elapsed = time.perf_counter() - started
+        stats = queue.stats if queue is not None else None
+        with database.db_connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM attendance_records").fetchone()[0]
+            mismatches = attendance.verify_daily_totals(conn)
+    assert rows == terminals * punches, (rows, terminals * punches)
+    assert not mismatches, mismatches
+    batches = f", {stats['batches']} commits (max {stats['max_batch']} per commit)" if stats else ''
+    print(f"{mode:<8} {rows / elapsed:9.0f} punches/s  p50 {_percentile(latencies, 50):7.2f} ms  "
+          f"p99 {_percentile(latencies, 99):7.2f} ms{batches}")
+
+
+def _child(db_file, terminals):
+    """journal モードで打刻を続け、応答のたびに標準出力へ書く（親プロセスに強制終了される）"""
+    database.DB_FILE = db_file
+    database.close_pool()
+    punch_queue.start('journal', flush_interval=0.5)
+    queue = punch_queue.active()
+    employees = [row[0] for row in database.get_db_connection().execute("SELECT id FROM employees ORDER BY id")]
+    next_type = {employee_id: 'clock_in' for employee_id in employees}
+    while True:
+        for employee_id in employees[:terminals]:
+            event_type = next_type[employee_id]
+            assert queue.submit(employee_id, event_type)['success']
+            print(f"ack {employee_id} {event_type}", flush=True)
+            next_type[employee_id] = _NEXT[event_type]
+            time.sleep(0.001)
+
+
+def crash_recovery(terminals=20, acks_before_kill=500):
+    with temporary_database() as db_file:
+        with database.db_connection() as conn:
+            for i in range(terminals):
+                add_employee(conn, f'emp{i:04d}')
+            conn.commit()
+        database.close_pool()
+
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.bench_punch_queue', '--child', db_file, str(terminals)],
+            stdout=subprocess.PIPE, text=True,
+        )
+        acked = {}
+        for line in proc.stdout:
+            _, employee_id, event_type = line.split()
+            acked[int(employee_id)] = acked.get(int(employee_id), 0) + 1
+            if sum(acked.values()) >= acks_before_kill:
+                break
+        proc.kill()
+        proc.wait()
+
+        journal = os.path.join(os.path.dirname(db_file), punch_queue.JOURNAL_NAME)
+        with database.db_connection() as conn:
+            before = conn.execute("SELECT COUNT(*) FROM attendance_records").fetchone()[0]
+        journaled = sum(1 for _ in punch_queue.read_journal(journal))
+        attendance.state_cache.invalidate()
+        queue = punch_queue.PunchQueue('journal', journal_path=journal).start()
+        # 復旧した従業員ごとに、無効な打刻が拒否され、次の打刻が受け付けられて書き込まれることを確認する
+        with database.db_connection() as conn:
+            recovered = dict(conn.execute("SELECT employee_id, state FROM employee_state WHERE state IS NOT NULL"))
+        stale_status = wrongly_accepted = rejected_next = 0
+        for employee_id, state in recovered.items():
+            api = Api()
+            api.current_user = {'id': employee_id, 'name': f'emp{employee_id}', 'is_admin': False}
+            stale_status += api.get_user_status()['status'] != state
+            wrongly_accepted += queue.submit(employee_id, state)['success']
+            rejected_next += not queue.submit(employee_id, _NEXT[state])['success']
+        queue.close()
+
+        with database.db_connection() as conn:
+            latest = dict(conn.execute("SELECT employee_id, state FROM employee_state WHERE state IS NOT NULL"))
+            not_committed = sum(latest.get(employee_id) != _NEXT[state] for employee_id, state in recovered.items())
+            counts = dict(conn.execute("SELECT employee_id, COUNT(*) FROM attendance_records GROUP BY employee_id"))
+            mismatches = attendance.verify_daily_totals(conn)
+            stale_state = conn.execute("""
+                SELECT COUNT(*) FROM employee_state s
+                WHERE s.last_event_id IS NOT (SELECT id FROM attendance_records a WHERE a.employee_id = s.employee_id
+                                              ORDER BY a.timestamp DESC, a.id DESC LIMIT 1)
+            """).fetchone()[0]
+    # 復旧後の打刻1件ずつを除いた件数で比べる
+    lost = sum(max(0, n - counts.get(employee_id, 0) + 1) for employee_id, n in acked.items())
+    print(f"killed after {sum(acked.values())} acks: {before} rows committed, {journaled} journal lines, "
+          f"{sum(counts.values()) - len(recovered)} rows after recovery")
+    print(f"lost acked punches: {lost}, stale employee_state rows: {stale_state}, rollup mismatches: {len(mismatches)}")
+    print(f"after restart ({len(recovered)} employees): stale status {stale_status}, "
+          f"invalid punches accepted {wrongly_accepted}, next punches rejected {rejected_next}, "
+          f"next punches not committed {not_committed}")
+    failed = (lost or stale_state or mismatches or not recovered
+              or stale_status or wrongly_accepted or rejected_next or not_committed)
+    return 1 if failed else 0
+
+
+def main(terminals=50, punches=40):
+    for mode in ('off', 'commit', 'journal'):
+        run_mode(mode, terminals, punches)
+    return crash_recovery()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        _child(sys.argv[2], int(sys.argv[3]))
+    else:
+        sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
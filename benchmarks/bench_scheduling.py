@@ -0,0 +1,134 @@
+"""シフトの差異レポート: シフトごとの問い合わせ vs ソートマージの1パス (scheduling.py)
+
+    python -m benchmarks.bench_scheduling [employees] [months]
+
+勤務形態ごとの繰り返しイベント（平日の日勤・毎日の夜勤・毎日の午後の短時間）を作り、
+assign_event_shifts で全従業員に割り当ててから、全従業員の期間の差異を次の方法で求める。
+
+- シフトごとに、その前後の打刻を問い合わせて突き合わせる
+- scheduling.reconcile（シフトと区間を1回ずつ読むソートマージ）
+- get_shift_variance_report（上記に従業員ごとの集計・日時の整形・JSON への変換を加えたもの）
+
+両者のシフトごとの結果（出勤・退勤・勤務秒数・遅刻・早退・欠勤）が一致することを確認する。
+"""
+import datetime
+import json
+import sys
+import time
+
+import attendance
+import database
+import scheduling
+from api import Api
+from benchmarks import datagen
+from benchmarks.common import temporary_database
+
+# 勤務形態 → (タイトル, 開始時刻, 終了時刻（翌日なら +24）, RRULE)
+SHIFT_EVENTS = {
+    'day': ('日勤', 9, 18, 'FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR'),
+    'night': ('夜勤', 22, 30, 'FREQ=DAILY'),
+    'part_time': ('短時間', 13, 17, 'FREQ=DAILY'),
+}
+
+
+def per_shift_reference(conn, shifts, now):
+    """シフトごとに打刻を問い合わせ、scheduling.reconcile と同じ値を求める"""
+    results = {}
+    for shift in shifts:
+        rows = attendance.fetch_event_rows(conn, [shift.employee_id], shift.start, shift.end)
+        overlapping = [
+            (kind, start, max(start, now) if end is None else end)
+            for _, kind, start, end in attendance.iter_segments(rows, include_open=True)
+        ]
+        overlapping = [s for s in overlapping if s[1] < shift.end and s[2] > shift.start]
+        arrival = overlapping[0][1] if overlapping else None
+        departure = overlapping[-1][2] if overlapping else None
+        worked = sum(min(end, shift.end) - max(start, shift.start) for kind, start, end in overlapping if kind == 'work')
+        late = early = 0
+        if arrival is not None:
+            late = arrival - shift.start if arrival - shift.start > scheduling.GRACE_SECONDS else 0
+            if shift.end <= now and shift.end - departure > scheduling.GRACE_SECONDS:
+                early = shift.end - departure
+        no_show = arrival is None and shift.end <= now
+        results[shift.id] = (arrival, departure, worked, late, early, no_show)
+    return results
+
+
+def main(employees=2000, months=1):
+    with temporary_database():
+        with database.db_connection() as conn:
+            dataset = datagen.generate(conn, employees=employees, months=months, events=0)
+        api = Api()
+        api.current_user = {'id': dataset['admin_id'], 'name': datagen.ADMIN_NAME, 'is_admin': True}
+        first, last = dataset['start_date'], dataset['end_date']
+        print(f"{employees} employees, {dataset['punches']} punches, {first} .. {last}")
+
+        started = time.perf_counter()
+        for shift_type, (title, begin, end, rrule) in SHIFT_EVENTS.items():
+            base = datetime.datetime.fromisoformat(first)
+            result = api.add_event(
+                title, 'bench', str(base + datetime.timedelta(hours=begin)), str(base + datetime.timedelta(hours=end)),
+                False, rrule
+            )
+            assert result['success'], result
+            with database.db_connection() as conn:
+                event_id = conn.execute("SELECT MAX(id) FROM events").fetchone()[0]
+            ids = [i for i, t in dataset['shift_types'].items() if t == shift_type]
+            result = api.assign_event_shifts(event_id, ids, first, last)
+            assert result['success'], result
+        with database.db_connection() as conn:
+            total_shifts = conn.execute("SELECT COUNT(*) FROM shift_assignments").fetchone()[0]
+        print(f"assign_event_shifts: {total_shifts} shifts in {time.perf_counter() - started:.2f}s")
+
+        window_start = scheduling.to_epoch(datetime.datetime.fromisoformat(first))
+        window_end = scheduling.to_epoch(datetime.datetime.fromisoformat(last) + datetime.timedelta(days=1))
+        now = int(time.time())
+        with database.db_connection() as conn:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN " + scheduling._SHIFT_QUERY.format(ids="SELECT id FROM employees"),
+                (window_start, window_end)
+            ).fetchall()
+            print("shift query plan: " + "; ".join(row[-1] for row in plan))
+            shifts = list(scheduling.iter_shifts(conn, None, window_start, window_end))
+
+            started = time.perf_counter()
+            expected = per_shift_reference(conn, shifts, now)
+            per_shift_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = api.get_shift_variance_report(first, last)
+        payload = json.dumps(result, ensure_ascii=False)
+        report_seconds = time.perf_counter() - started
+        assert result['success'], result
+
+        with database.db_connection() as conn:
+            employees_rows = api._load_employees(conn, None)
+            started = time.perf_counter()
+            variances, _ = scheduling.reconcile(
+                scheduling.iter_shifts(conn, None, window_start, window_end),
+                attendance.iter_segments(attendance.fetch_event_rows(conn, None, window_start, window_end),
+                                         include_open=True),
+                window_start, window_end, now
+            )
+            merge_seconds = time.perf_counter() - started
+    actual = {
+        v.shift.id: (v.arrival, v.departure, v.worked_seconds, v.late_seconds, v.early_leave_seconds, v.no_show)
+        for v in variances
+    }
+
+    print(f"{'per-shift queries':<32} {per_shift_seconds:8.3f}s ({len(shifts)} queries)")
+    print(f"{'sort-merge pass':<32} {merge_seconds:8.3f}s ({per_shift_seconds / merge_seconds:.1f}x, 2 queries)")
+    print(f"{'get_shift_variance_report':<32} {report_seconds:8.3f}s "
+          f"(including totals and {len(payload) / 1000:.0f} KB JSON)")
+    totals = {key: sum(e[key] for e in result['employees'])
+              for key in ('late_count', 'early_leave_count', 'no_show_count')}
+    print(f"  {len(employees_rows)} employees, {len(result['exceptions'])} exceptions: "
+          + ", ".join(f"{key} {value}" for key, value in totals.items()))
+
+    ok = actual == expected
+    print(f"sort-merge vs per-shift: {'ok' if ok else 'MISMATCH'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
@@ -0,0 +1,122 @@
+"""サーバーモードの負荷試験: N 台の端末が同時に打刻した場合の打刻数/秒
+
+実際の HTTP サーバー（スレッド型）を一時 DB（WAL モード）に対して起動し、
+端末ごとに別の従業員でログインして出勤/退勤を繰り返す。
+
+    python -m benchmarks.bench_server_load [秒数] [端末数 ...]
+"""
+import json
+import logging
+import sys
+import threading
+import time
+import urllib.request
+
+from flask import Flask
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+import database
+from benchmarks.common import temporary_database, add_employee
+from dispatcher import ApiExecutor
+from server_api import register_api_routes, TOKEN_HEADER
+
+PASSWORD = 'benchmark-password'
+
+
+class Terminal:
+    def __init__(self, base_url, name):
+        self.base_url = base_url
+        self.name = name
+        self.token = None
+
+    def call(self, method, *args):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        req = urllib.request.Request(
+            f'{self.base_url}/api/{method}', data=json.dumps({'args': list(args)}).encode(), headers=headers
+        )
+        with urllib.request.urlopen(req) as res:
+            return json.loads(res.read())
+
+    def login(self):
+        result = self.call('login', self.name, PASSWORD)
+        assert result['success'], result
+        self.token = result['token']
+
+
+def run_terminals(base_url, names, duration):
+    counts = [0] * len(names)
+    failures = [0] * len(names)
+    latencies = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(len(names) + 1)
+
+    def worker(i):
+        terminal = Terminal(base_url, names[i])
+        terminal.login()
+        # 前回の実行で出勤中のまま終わった従業員もいるため、現在の状態から始める
+        event = 'clock_out' if terminal.call('get_user_status')['status'] == 'clock_in' else 'clock_in'
+        start_barrier.wait()
+        deadline = time.perf_counter() + duration
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            result = terminal.call('record_attendance', event)
+            local.append(time.perf_counter() - started)
+            if result['success']:
+                counts[i] += 1
+                event = 'clock_out' if event == 'clock_in' else 'clock_in'
+            else:
+                failures[i] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(names))]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+    return sum(counts), sum(failures), elapsed, p95
+
+
+def main(duration=5.0, terminal_counts=(1, 4, 16, 32)):
+    with temporary_database():
+        conn = database.get_db_connection()
+        journal = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        # ベンチマークではログイン時のハッシュ計算コストを下げる
+        hashed = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+        names = [f'terminal{i:03d}' for i in range(max(terminal_counts))]
+        for name in names:
+            add_employee(conn, name, password=hashed)
+        conn.commit()
+        conn.close()
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        app = Flask(__name__)
+        executor = ApiExecutor()
+        register_api_routes(app, executor)
+        httpd = make_server('127.0.0.1', 0, app, threaded=True)
+        base_url = f'http://127.0.0.1:{httpd.server_port}'
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        print(f"journal_mode={journal}, {duration:.0f}s per run")
+        try:
+            for n in terminal_counts:
+                punches, failures, elapsed, p95 = run_terminals(base_url, names[:n], duration)
+                print(f"{n:3d} terminals: {punches / elapsed:8.1f} punches/s  (failed {failures}, p95 {p95 * 1000:.1f} ms)")
+        finally:
+            httpd.shutdown()
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    duration = float(args[0]) if args else 5.0
+    counts = tuple(int(a) for a in args[1:]) or (1, 4, 16, 32)
+    main(duration, counts)
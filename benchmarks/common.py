@@ -0,0 +1,53 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import database
+import migrations
+
+
+@contextmanager
+def temporary_database(migrate=True):
+    """一時ディレクトリに DB を作成し、database.DB_FILE を差し替える
+
+    migrate=False の場合は基本スキーマ（マイグレーション適用前）のままにする。
+    """
+    original = database.DB_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'database.db')
+        database.close_pool()
+        try:
+            database.create_tables()
+            if migrate:
+                conn = database.get_db_connection()
+                try:
+                    migrations.migrate(conn)
+                finally:
+                    conn.close()
+            yield database.DB_FILE
+        finally:
+            database.close_pool()
+            database.DB_FILE = original
+
+
+def add_employee(conn, name, hourly_wage=1000, is_admin=False, password='x'):
+    """ベンチマーク用に従業員を直接登録する（パスワードハッシュは計算しない）"""
+    cur = conn.execute(
+        "INSERT INTO employees (name, password, hourly_wage, is_admin) VALUES (?, ?, ?, ?)",
+        (name, password, hourly_wage, 1 if is_admin else 0)
+    )
+    return cur.lastrowid
+
+
+def measure(func, iterations):
+    """func を iterations 回実行し、(経過秒, 1秒あたりの呼び出し回数) を返す"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    return elapsed, iterations / elapsed if elapsed else float('inf')
+
+
+def report(label, elapsed, rate):
+    print(f"{label:<40} {elapsed:8.3f}s {rate:12.0f} calls/s")
@@ -0,0 +1,171 @@
+"""ベンチマーク用の合成データ生成（同じ seed なら常に同じデータ）
+
+従業員・打刻（休憩と夜勤の日跨ぎを含む）・カレンダーイベントを DB に直接書き込み、
+最後に employee_state と日別集計を作り直す。
+
+    with temporary_database():
+        with database.db_connection() as conn:
+            dataset = generate(conn, employees=200, months=3, events=1000)
+"""
+import datetime
+import random
+
+import attendance
+import auth
+import events as events_module
+import presence
+
+PASSWORD = 'benchmark-password'
+ADMIN_NAME = 'bench-admin'
+DEFAULT_START = datetime.date(2024, 1, 1)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 勤務形態の比率（日勤 / 夜勤 / 短時間）
+SHIFT_WEIGHTS = (('day', 0.75), ('night', 0.1), ('part_time', 0.15))
+
+_INSERT_EMPLOYEE = "INSERT INTO employees (name, password, hourly_wage, is_admin) VALUES (?, ?, ?, ?)"
+_INSERT_PUNCH = "INSERT INTO attendance_records (employee_id, event_type, timestamp) VALUES (?, ?, ?)"
+_INSERT_EVENT = (
+    "INSERT INTO events (title, description, start_datetime, end_datetime, is_allday, rrule, recurrence_until) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def add_months(date, months):
+    year, month = divmod(date.month - 1 + months, 12)
+    return date.replace(year=date.year + year, month=month + 1, day=1)
+
+
+def _minutes(rng, low, high):
+    return datetime.timedelta(minutes=rng.randint(low, high))
+
+
+def _day_shift(rng, base):
+    start = base + datetime.timedelta(hours=9) + _minutes(rng, -20, 20)
+    lunch = base + datetime.timedelta(hours=12) + _minutes(rng, 0, 40)
+    punches = [('clock_in', start), ('start_break', lunch), ('end_break', lunch + _minutes(rng, 40, 60))]
+    end = base + datetime.timedelta(hours=18) + _minutes(rng, -10, 120)
+    if rng.random() < 0.3:
+        # 夕方の短い休憩
+        rest = base + datetime.timedelta(hours=15, minutes=30) + _minutes(rng, 0, 30)
+        punches += [('start_break', rest), ('end_break', rest + _minutes(rng, 10, 15))]
+    punches.append(('clock_out', end))
+    return punches
+
+
+def _night_shift(rng, base):
+    # 22時頃出勤、日付を跨いだ休憩をはさんで翌朝退勤
+    start = base + datetime.timedelta(hours=22) + _minutes(rng, -15, 15)
+    rest = base + datetime.timedelta(hours=23, minutes=50) + _minutes(rng, 0, 30)
+    return [
+        ('clock_in', start),
+        ('start_break', rest),
+        ('end_break', rest + _minutes(rng, 30, 60)),
+        ('clock_out', start + datetime.timedelta(hours=8) + _minutes(rng, 0, 60)),
+    ]
+
+
+def _part_time(rng, base):
+    start = base + datetime.timedelta(hours=rng.choice((10, 13, 17))) + _minutes(rng, -10, 10)
+    return [('clock_in', start), ('clock_out', start + datetime.timedelta(hours=4) + _minutes(rng, -15, 30))]
+
+
+_SHIFTS = {'day': _day_shift, 'night': _night_shift, 'part_time': _part_time}
+
+
+def generate_employees(conn, rng, count):
+    """従業員と管理者1名を登録する。PBKDF2 は重いため、全員同じパスワードのハッシュを使い回す"""
+    hashed = auth.hash_password(PASSWORD)
+    admin_id = conn.execute(_INSERT_EMPLOYEE, (ADMIN_NAME, hashed, 0, 1)).lastrowid
+    employees = []
+    for i in range(count):
+        shift = rng.choices([s for s, _ in SHIFT_WEIGHTS], [w for _, w in SHIFT_WEIGHTS])[0]
+        employee_id = conn.execute(
+            _INSERT_EMPLOYEE, (f'emp{i:05d}', hashed, rng.choice((1000, 1100, 1200, 1500)), 0)
+        ).lastrowid
+        employees.append((employee_id, shift))
+    return admin_id, employees
+
+
+def iter_punches(rng, employees, start_date, days):
+    """(employee_id, event_type, timestamp) を従業員ごとに時刻順で返す"""
+    for employee_id, shift in employees:
+        make = _SHIFTS[shift]
+        # 週2日程度の休み + たまの欠勤
+        days_off = set(rng.sample(range(7), 2))
+        for day in range(days):
+            date = start_date + datetime.timedelta(days=day)
+            if date.weekday() in days_off or rng.random() < 0.03:
+                continue
+            base = datetime.datetime.combine(date, datetime.time())
+            for event_type, ts in make(rng, base):
+                yield employee_id, event_type, ts.strftime(TIMESTAMP_FORMAT)
+
+
+def generate_events(conn, rng, count, start_date, days, recurring_ratio=0.05):
+    """期間内にカレンダーイベントを登録する（一部は毎週/毎月の繰り返し）"""
+    rows = []
+    for i in range(count):
+        base = datetime.datetime.combine(start_date, datetime.time()) + datetime.timedelta(
+            days=rng.randrange(days), hours=rng.randint(8, 18)
+        )
+        if rng.random() < 0.1:
+            start, end, allday = base.replace(hour=0), base.replace(hour=23, minute=59, second=59), 1
+        else:
+            start, end, allday = base, base + _minutes(rng, 30, 180), 0
+        rrule = until = None
+        start_str = start.strftime(TIMESTAMP_FORMAT)
+        if rng.random() < recurring_ratio:
+            rrule = rng.choice(('FREQ=WEEKLY', 'FREQ=WEEKLY;BYDAY=MO,TH', 'FREQ=MONTHLY', 'FREQ=DAILY;COUNT=10'))
+            until = events_module.resolve_recurrence_until(rrule, start_str)
+        rows.append((f'event {i}', 'generated', start_str, end.strftime(TIMESTAMP_FORMAT), allday, rrule, until))
+    conn.executemany(_INSERT_EVENT, rows)
+    return len(rows)
+
+
+def generate(conn, employees=100, months=3, events=500, seed=0, start_date=DEFAULT_START):
+    """合成データを登録し、生成した内容の概要を dict で返す"""
+    rng = random.Random(seed)
+    end_date = add_months(start_date, months)
+    days = (end_date - start_date).days
+    conn.execute("BEGIN")
+    try:
+        admin_id, staff = generate_employees(conn, rng, employees)
+        punches = 0
+        for batch in _batched(iter_punches(rng, staff, start_date, days), 10_000):
+            conn.executemany(_INSERT_PUNCH, batch)
+            punches += len(batch)
+        n_events = generate_events(conn, rng, events, start_date, days)
+        attendance.rebuild_employee_state(conn)
+        attendance.rebuild_daily_totals(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    attendance.state_cache.invalidate()
+    events_module.window_cache.invalidate()
+    presence.board.reset()
+    return {
+        'seed': seed,
+        'employees': employees,
+        'months': months,
+        'start_date': start_date.isoformat(),
+        'end_date': (end_date - datetime.timedelta(days=1)).isoformat(),
+        'punches': punches,
+        'events': n_events,
+        'admin_id': admin_id,
+        'employee_ids': [employee_id for employee_id, _ in staff],
+        # 従業員ID → 勤務形態（'day' / 'night' / 'part_time'）
+        'shift_types': dict(staff),
+    }
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
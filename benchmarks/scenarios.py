@@ -0,0 +1,202 @@
+"""Api メソッドごとのベンチマークシナリオ
+
+各シナリオは datagen.generate() の結果を受け取り、1回分の呼び出しを行う
+関数（引数なし）を返す。run_scenario() はそれを繰り返し呼び、1回ごとの
+所要時間からスループットとパーセンタイルを求める。
+"""
+import datetime
+import itertools
+import time
+
+import events
+from api import Api
+from benchmarks import datagen
+
+
+def _logged_in(dataset, index=None):
+    """ログイン済みの Api を返す（PBKDF2 の検証は login シナリオだけで測るため、ログイン状態を直接設定する）"""
+    api = Api()
+    if index is None:
+        api.current_user = {'id': dataset['admin_id'], 'name': datagen.ADMIN_NAME, 'is_admin': True}
+    else:
+        api.current_user = {'id': dataset['employee_ids'][index], 'name': f'emp{index:05d}', 'is_admin': False}
+    return api
+
+
+def _month_windows(dataset):
+    """カレンダー表示と同じ、月初の7日前から月末の8日後までの期間"""
+    start = datetime.date.fromisoformat(dataset['start_date'])
+    windows = []
+    for i in range(dataset['months']):
+        month = datagen.add_months(start, i)
+        last_day = datagen.add_months(start, i + 1) - datetime.timedelta(days=1)
+        windows.append((
+            f"{month - datetime.timedelta(days=7)} 00:00:00",
+            f"{last_day + datetime.timedelta(days=8)} 00:00:00",
+        ))
+    return windows
+
+
+def login(dataset):
+    api = Api()
+    names = itertools.cycle(f'emp{i:05d}' for i in range(dataset['employees']))
+
+    def call():
+        assert api.login(next(names), datagen.PASSWORD)['success']
+    return call
+
+
+# 現在の状態 → 次に打刻するイベント（出勤と退勤を交互に繰り返す）
+_NEXT_PUNCH = {
+    'none': 'clock_in', 'clock_out': 'clock_in', 'clock_in': 'clock_out',
+    'start_break': 'end_break', 'end_break': 'clock_out',
+}
+
+
+def record_attendance(dataset):
+    """従業員ごとに出勤/退勤を交互に打刻する（生成データの最後の状態から始める）"""
+    terminals = [[api, None] for api in (_logged_in(dataset, i) for i in range(min(dataset['employees'], 50)))]
+    for terminal in terminals:
+        terminal[1] = _NEXT_PUNCH[terminal[0].get_user_status()['status']]
+    cycle = itertools.cycle(terminals)
+
+    def call():
+        terminal = next(cycle)
+        api, event_type = terminal
+        assert api.record_attendance(event_type)['success']
+        terminal[1] = _NEXT_PUNCH[event_type]
+    return call
+
+
+def get_user_status(dataset):
+    apis = [_logged_in(dataset, i) for i in range(min(dataset['employees'], 20))]
+    cycle = itertools.cycle(apis)
+
+    def call():
+        assert next(cycle).get_user_status()['status'] != 'logged_out'
+    return call
+
+
+def get_presence(dataset):
+    """在席状況の差分取得（毎回1件打刻してから、前回の seq 以降の変更を取る）"""
+    api = _logged_in(dataset)
+    punch = record_attendance(dataset)
+    seq = api.get_presence()['seq']
+
+    def call():
+        nonlocal seq
+        punch()
+        result = api.get_presence(seq)
+        assert result['success'] and not result['full']
+        seq = result['seq']
+    return call
+
+
+def get_events(dataset):
+    """表示期間キャッシュを毎回破棄した場合（月を切り替えた直後）の取得"""
+    api = Api()
+    windows = itertools.cycle(_month_windows(dataset))
+
+    def call():
+        events.window_cache.invalidate()
+        assert api.get_events(*next(windows))['success']
+    return call
+
+
+def get_events_cached(dataset):
+    api = Api()
+    windows = itertools.cycle(_month_windows(dataset))
+
+    def call():
+        assert api.get_events(*next(windows))['success']
+    return call
+
+
+def get_all_employees(dataset):
+    api = _logged_in(dataset)
+
+    def call():
+        assert api.get_all_employees()['success']
+    return call
+
+
+def list_employees(dataset):
+    """一覧の先頭ページ（変更なしの確認を含まない）"""
+    api = _logged_in(dataset)
+
+    def call():
+        assert api.list_employees(None, 100)['success']
+    return call
+
+
+def search_employees(dataset):
+    """名前の部分一致検索（3文字以上は全文索引）"""
+    api = _logged_in(dataset)
+    queries = itertools.cycle([f'{i:03d}' for i in range(0, min(dataset['employees'], 1000), 7)] + ['emp0'])
+
+    def call():
+        assert api.list_employees(None, 100, next(queries))['success']
+    return call
+
+
+def get_attendance_summary(dataset):
+    """従業員1人分の1か月の集計"""
+    api = _logged_in(dataset)
+    start = datetime.date.fromisoformat(dataset['start_date'])
+    months = [
+        (str(datagen.add_months(start, i)), str(datagen.add_months(start, i + 1) - datetime.timedelta(days=1)))
+        for i in range(dataset['months'])
+    ]
+    targets = itertools.cycle(itertools.product(dataset['employee_ids'], months))
+
+    def call():
+        employee_id, (first, last) = next(targets)
+        assert api.get_attendance_summary(employee_id, first, last)['success']
+    return call
+
+
+# シナリオ名 → (セットアップ関数, 既定の繰り返し回数)
+SCENARIOS = {
+    'login': (login, 20),
+    'record_attendance': (record_attendance, 1000),
+    'get_user_status': (get_user_status, 5000),
+    'get_presence': (get_presence, 1000),
+    'get_events': (get_events, 200),
+    'get_events_cached': (get_events_cached, 5000),
+    'get_all_employees': (get_all_employees, 500),
+    'list_employees': (list_employees, 2000),
+    'search_employees': (search_employees, 2000),
+    'get_attendance_summary': (get_attendance_summary, 1000),
+}
+
+
+def _percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, dataset, iterations=None, warmup=5):
+    """シナリオを実行し、スループットとレイテンシ（ミリ秒）を dict で返す"""
+    setup, default_iterations = SCENARIOS[name]
+    iterations = iterations or default_iterations
+    call = setup(dataset)
+    for _ in range(min(warmup, iterations)):
+        call()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'seconds': round(elapsed, 4),
+        'ops_per_second': round(iterations / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / iterations, 4),
+        'p50_ms': round(_percentile(latencies, 50), 4),
+        'p95_ms': round(_percentile(latencies, 95), 4),
+        'p99_ms': round(_percentile(latencies, 99), 4),
+        'max_ms': round(latencies[-1], 4),
+    }
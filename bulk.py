@@ -0,0 +1,367 @@
+"""勤怠打刻の一括インポート/エクスポート（CSV / JSON Lines）
+
+どちらも行単位のストリーミング処理で、メモリ使用量はファイルサイズではなく
+従業員数とバッチサイズにのみ比例する。
+"""
+import csv
+import datetime
+import json
+import logging
+import os
+
+import archive
+import attendance
+import database
+import presence
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = ('id', 'employee_id', 'name', 'event_type', 'timestamp')
+SUMMARY_FIELDS = ('employee_id', 'name', 'day', 'work_hours', 'break_hours', 'hourly_wage', 'wage')
+
+# 1トランザクションで取り込む行数（その間、ライブの打刻は書き込みロックを待つ）
+DEFAULT_BATCH_SIZE = 5_000
+# エラー詳細として保持する最大件数（件数自体はすべて数える）
+MAX_REPORTED_ERRORS = 100
+# 日別集計を作り直す1トランザクションあたりの従業員数
+_ROLLUP_CHUNK_SIZE = 50
+# インデックス遅延の自動判定に使う、1行あたりのおおよそのバイト数
+_APPROX_BYTES_PER_ROW = 40
+
+_DEFERRED_INDEXES = {
+    'idx_attendance_employee_time': "CREATE INDEX IF NOT EXISTS idx_attendance_employee_time ON attendance_records(employee_id, timestamp)",
+    # migrations.py（ts_epoch 列の追加）で作られるインデックス
+    'idx_attendance_employee_epoch': "CREATE INDEX IF NOT EXISTS idx_attendance_employee_epoch ON attendance_records(employee_id, ts_epoch)",
+}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        fmt = fmt.lower()
+    else:
+        fmt = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f'Unsupported format: {fmt}')
+    return fmt
+
+
+def read_csv(path):
+    """CSV を1行ずつ (行番号, dict) で返す（ヘッダ行必須）"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            yield line_no, row
+
+
+def read_jsonl(path):
+    """JSON Lines を1行ずつ (行番号, dict) で返す"""
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, {'__error__': f'invalid JSON: {e}'}
+
+
+def read_records(path, fmt=None):
+    return read_jsonl(path) if detect_format(path, fmt) == 'jsonl' else read_csv(path)
+
+
+def _normalize_timestamp(value):
+    """'YYYY-MM-DD HH:MM:SS' / ISO 8601 を (保存形式の文字列, エポック秒) にする
+
+    保存形式の文字列は辞書順と時刻順が一致するため、以降の順序チェックは文字列比較で行う。
+    タイムゾーン付きの場合は UTC（CURRENT_TIMESTAMP と同じ基準）に変換する。
+    """
+    value = str(value).strip()
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    elif len(value) == 19 and value[10] == ' ':
+        return value, attendance.date_to_epoch(dt)
+    return dt.strftime(attendance.TIMESTAMP_FORMAT), attendance.date_to_epoch(dt)
+
+
+class PunchValidator:
+    """Api.record_attendance と同じ遷移ルールで打刻を検証する
+
+    従業員ごとに直前の状態と時刻だけを保持する。打刻は従業員ごとに時刻順で、
+    かつ既存の最後の打刻より後でなければならない。
+    """
+
+    def __init__(self):
+        self.name_to_id = {}
+        self.states = {}
+        self.horizon = None
+        self.touched = set()
+        self.accepted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def load(self, conn):
+        """従業員と直前の状態を読み直す
+
+        取り込みのトランザクション（書き込みロック）の中で呼ぶ。ロックの外で読むと、
+        その後に確定したライブの打刻が検証に反映されない。
+        """
+        self.name_to_id = {name: employee_id for employee_id, name in conn.execute("SELECT id, name FROM employees")}
+        self.states = {
+            employee_id: (state, attendance.epoch_to_timestamp(last_ts) if last_ts is not None else None)
+            for employee_id, state, last_ts in conn.execute(
+                "SELECT employee_id, state, last_timestamp FROM employee_state"
+            )
+        }
+        # アーカイブ済みの月には取り込まない
+        horizon = archive.horizon(conn)
+        self.horizon = attendance.epoch_to_timestamp(horizon) if horizon is not None else None
+
+    def _reject(self, line_no, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'line {line_no}: {message}')
+
+    def validate(self, records):
+        """検証済みの (employee_id, event_type, timestamp, エポック秒) を順に返す"""
+        for line_no, record in records:
+            if '__error__' in record:
+                self._reject(line_no, record['__error__'])
+                continue
+            employee_id = record.get('employee_id')
+            try:
+                if employee_id not in (None, ''):
+                    employee_id = int(employee_id)
+                else:
+                    employee_id = self.name_to_id.get(record.get('name'))
+            except (TypeError, ValueError):
+                employee_id = None
+            if employee_id is None or employee_id not in self.states:
+                self._reject(line_no, f"unknown employee: {record.get('employee_id') or record.get('name')!r}")
+                continue
+            event_type = record.get('event_type')
+            if event_type not in attendance.EVENT_TYPES:
+                self._reject(line_no, f'invalid event_type: {event_type!r}')
+                continue
+            try:
+                timestamp, epoch = _normalize_timestamp(record.get('timestamp'))
+            except (TypeError, ValueError):
+                self._reject(line_no, f"invalid timestamp: {record.get('timestamp')!r}")
+                continue
+            if self.horizon is not None and timestamp < self.horizon:
+                self._reject(line_no, f'timestamp {timestamp} is in an archived month')
+                continue
+            state, last_timestamp = self.states[employee_id]
+            if last_timestamp is not None and timestamp < last_timestamp:
+                self._reject(line_no, f'timestamp out of order for employee {employee_id}')
+                continue
+            if not attendance.is_transition_allowed(state, event_type):
+                self._reject(line_no, f'{event_type} not allowed after {state} for employee {employee_id}')
+                continue
+            self.states[employee_id] = (event_type, timestamp)
+            self.touched.add(employee_id)
+            self.accepted += 1
+            yield employee_id, event_type, timestamp, epoch
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _should_defer_indexes(conn, path):
+    """取り込み予定の行数が既存の行数を上回る場合のみインデックスを後から作り直す"""
+    try:
+        estimated_rows = os.path.getsize(path) // _APPROX_BYTES_PER_ROW
+    except OSError:
+        return False
+    existing = conn.execute("SELECT COALESCE(MAX(id), 0) FROM attendance_records").fetchone()[0]
+    return estimated_rows > existing
+
+
+def import_punches(conn, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, defer_indexes=None, dry_run=False):
+    """打刻ファイルを検証しながら一括登録する
+
+    batch_size 行ごとに database.write_transaction でコミットし、その間にライブの打刻
+    （record_attendance・打刻キュー）が書き込めるようにする。各トランザクションの中で
+    直前の状態を読み直して検証し、取り込んだ従業員の employee_state を作り直す。
+    日別集計は最後に、取り込んだ従業員の分だけ作り直す（途中で中断した場合は
+    manage.py rebuild-rollup で作り直す）。エラー行はスキップして件数を返す。
+
+    インデックスを後から作り直す場合（defer_indexes、None なら取り込み量から自動判定）は、
+    インデックスの無い状態をコミットしないよう全体を1つのトランザクションで行う。
+    """
+    if defer_indexes is None:
+        defer_indexes = not dry_run and _should_defer_indexes(conn, path)
+    validator = PunchValidator()
+    rows = validator.validate(read_records(path, fmt))
+
+    if dry_run:
+        validator.load(conn)
+        for _ in rows:
+            pass
+    else:
+        try:
+            if defer_indexes:
+                _import_with_deferred_indexes(conn, validator, rows, batch_size)
+            else:
+                _import_in_chunks(conn, validator, rows, batch_size)
+        finally:
+            attendance.state_cache.invalidate()
+        if validator.touched:
+            presence.board.refresh(validator.touched)
+
+    return {
+        'imported': 0 if dry_run else validator.accepted,
+        'valid': validator.accepted,
+        'rejected': validator.error_count,
+        'errors': validator.errors,
+        'employees': len(validator.touched),
+    }
+
+
+def _import_in_chunks(conn, validator, rows, batch_size):
+    batches = _batched(rows, batch_size)
+    while True:
+        with database.write_transaction(conn):
+            validator.load(conn)
+            batch = next(batches, None)
+            if batch is None:
+                break
+            attendance.insert_punch_rows(conn, batch, attendance.has_ts_epoch(conn))
+            touched = sorted({row[0] for row in batch})
+            attendance.rebuild_employee_state(conn, touched)
+        for employee_id in touched:
+            attendance.state_cache.invalidate(employee_id)
+        logger.info(f"Imported {validator.accepted} rows ({validator.error_count} rejected)")
+
+    touched = sorted(validator.touched)
+    for i in range(0, len(touched), _ROLLUP_CHUNK_SIZE):
+        with database.write_transaction(conn):
+            attendance.rebuild_daily_totals(conn, touched[i:i + _ROLLUP_CHUNK_SIZE], archive.horizon_day(conn))
+
+
+def _import_with_deferred_indexes(conn, validator, rows, batch_size):
+    with database.write_transaction(conn):
+        validator.load(conn)
+        # 存在するインデックスだけを外し、同じものを作り直す
+        deferred = [row[0] for row in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'index' AND name IN ({','.join('?' * len(_DEFERRED_INDEXES))})",
+            tuple(_DEFERRED_INDEXES)
+        )]
+        for name in deferred:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        with_epoch = attendance.has_ts_epoch(conn)
+        for batch in _batched(rows, batch_size):
+            attendance.insert_punch_rows(conn, batch, with_epoch)
+            logger.info(f"Imported {validator.accepted} rows ({validator.error_count} rejected)")
+        for name in deferred:
+            conn.execute(_DEFERRED_INDEXES[name])
+        if validator.touched:
+            touched = sorted(validator.touched)
+            attendance.rebuild_employee_state(conn, touched)
+            attendance.rebuild_daily_totals(conn, touched, archive.horizon_day(conn))
+
+
+class _RowWriter:
+    """CSV / JSON Lines 共通の行ライター"""
+
+    def __init__(self, f, fmt, fields):
+        self.f = f
+        self.fmt = fmt
+        self.fields = fields
+        if fmt == 'csv':
+            self._csv = csv.writer(f)
+            self._csv.writerow(fields)
+
+    def write(self, values):
+        if self.fmt == 'csv':
+            self._csv.writerow(values)
+        else:
+            self.f.write(json.dumps(dict(zip(self.fields, values)), ensure_ascii=False))
+            self.f.write('\n')
+
+
+def _date_range_to_epochs(start_date_str, end_date_str):
+    start = end = None
+    if start_date_str:
+        start = attendance.date_to_epoch(datetime.datetime.strptime(start_date_str, '%Y-%m-%d'))
+    if end_date_str:
+        end = attendance.date_to_epoch(datetime.datetime.strptime(end_date_str, '%Y-%m-%d') + datetime.timedelta(days=1))
+    return start, end
+
+
+def export_records(conn, path, fmt=None, start_date_str=None, end_date_str=None, employee_ids=None, fetch_size=10_000):
+    """attendance_records（締めた月はアーカイブを含む）をファイルへストリーミング出力する。戻り値: 出力行数"""
+    fmt = detect_format(path, fmt)
+    start, end = _date_range_to_epochs(start_date_str, end_date_str)
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("a.timestamp >= ?")
+        params.append(attendance.epoch_to_timestamp(start))
+    if end is not None:
+        clauses.append("a.timestamp < ?")
+        params.append(attendance.epoch_to_timestamp(end))
+    if employee_ids:
+        ids = sorted(set(int(i) for i in employee_ids))
+        clauses.append(f"a.employee_id IN ({','.join('?' * len(ids))})")
+        params.extend(ids)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    count = 0
+    with archive.attached(conn, start, end) as sources:
+        cur = conn.execute(
+            f"SELECT a.id, a.employee_id, e.name, a.event_type, a.timestamp FROM {sources.records} a "
+            f"LEFT JOIN employees e ON e.id = a.employee_id {where} ORDER BY a.employee_id, a.timestamp, a.id",
+            params
+        )
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = _RowWriter(f, fmt, RECORD_FIELDS)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    writer.write(tuple(row))
+                count += len(rows)
+    return count
+
+
+def export_summaries(conn, path, start_date_str, end_date_str, fmt=None, employee_ids=None, fetch_size=10_000):
+    """日別の勤務時間・概算給与を日別集計テーブル（締めた月はアーカイブを含む）からストリーミング出力する
+
+    戻り値: 出力行数
+    """
+    fmt = detect_format(path, fmt)
+    params = [start_date_str, end_date_str]
+    id_filter = ""
+    if employee_ids:
+        ids = sorted(set(int(i) for i in employee_ids))
+        id_filter = f"AND d.employee_id IN ({','.join('?' * len(ids))})"
+        params.extend(ids)
+    count = 0
+    with archive.attached(conn, *_date_range_to_epochs(start_date_str, end_date_str)) as sources:
+        # ライブとアーカイブに同じ日の行がある場合（締めた後の日跨ぎの勤務）は合計する
+        cur = conn.execute(
+            f"SELECT d.employee_id, e.name, d.day, SUM(d.work_seconds), SUM(d.break_seconds), COALESCE(e.hourly_wage, 0) "
+            f"FROM {sources.rollup} d JOIN employees e ON e.id = d.employee_id "
+            f"WHERE d.day >= ? AND d.day <= ? {id_filter} GROUP BY d.employee_id, d.day ORDER BY d.employee_id, d.day",
+            params
+        )
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = _RowWriter(f, fmt, SUMMARY_FIELDS)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for employee_id, name, day, work_seconds, break_seconds, hourly_wage in rows:
+                    work_hours = work_seconds / 3600
+                    writer.write((employee_id, name, day, round(work_hours, 4), round(break_seconds / 3600, 4),
+                                  hourly_wage, round(work_hours * hourly_wage)))
+                count += len(rows)
+    return count
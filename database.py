@@ -4,9 +4,15 @@ import secrets
 import string
 import stat
 import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from typing import Optional
-from werkzeug.security import generate_password_hash
 from appdirs import user_data_dir # appdirsをインポート
+import attendance
+import auth
+import metrics
 
 # アプリケーション名と開発者名を定義
 APP_NAME = "AttendanceManager"
@@ -25,16 +31,249 @@ DB_FILE = os.path.join(data_dir, 'database.db')
 logger.debug(f"DB path: {DB_FILE}")
 
 
-def get_db_connection():
-    """データベース接続を取得する"""
-    conn = sqlite3.connect(DB_FILE)
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# create_tables が作る基本スキーマのバージョン（PRAGMA user_version）。
+# 既存の DB に対する以降の変更は migrations.py にバージョンを上げて追加する
+SCHEMA_VERSION = 1
+
+# コネクションプールの設定（環境変数で上書き可能）
+POOL_SIZE = max(1, _env_int('DB_POOL_SIZE', 8))
+POOL_TIMEOUT_SECONDS = 10.0
+# アイドル時間がこれを超えた接続は、貸し出し前に死活確認する
+HEALTH_CHECK_INTERVAL_SECONDS = 30.0
+# sqlite3 モジュールのプリペアドステートメントキャッシュ（接続ごと）
+STATEMENT_CACHE_SIZE = 128
+
+# 接続ごとに一度だけ適用する PRAGMA
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    f"PRAGMA busy_timeout = {_env_int('DB_BUSY_TIMEOUT_MS', 5000)}",
+    "PRAGMA cache_size = -8000",      # 約8MB
+    "PRAGMA mmap_size = 67108864",    # 64MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def _connect(check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_FILE,
+        check_same_thread=check_same_thread,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=metrics.connection_factory(),
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def create_tables():
-    """テーブルが存在しない場合にテーブルを作成する"""
+
+def get_db_connection():
+    """データベース接続を取得する（単発の管理処理向け。API からは db_connection() を使う）"""
+    return _connect()
+
+
+class ConnectionPool:
+    """上限付きの SQLite 接続プール。
+
+    接続はスレッド間で受け渡されるため check_same_thread=False で開くが、
+    同時に一つのスレッドだけが使用することをプール側で保証する。
+    PRAGMA は接続作成時に一度だけ適用し、sqlite3 のステートメントキャッシュも
+    接続と一緒に再利用される。
+    """
+
+    def __init__(self, db_file: str, size: int = POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = deque()  # (conn, 返却時刻)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        if not self._slots.acquire(timeout=POOL_TIMEOUT_SECONDS):
+            raise sqlite3.OperationalError("connection pool exhausted")
+        try:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        raise sqlite3.ProgrammingError("connection pool is closed")
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return _connect(check_same_thread=False)
+                conn, released_at = item
+                if time.monotonic() - released_at < HEALTH_CHECK_INTERVAL_SECONDS or self._is_healthy(conn):
+                    return conn
+                logger.warning("Discarding unhealthy pooled connection")
+                self._close_quietly(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False) -> None:
+        try:
+            if not discard and conn.in_transaction:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    discard = True
+            with self._lock:
+                if not discard and not self._closed and len(self._idle) < self.size:
+                    self._idle.append((conn, time.monotonic()))
+                    conn = None
+            if conn is not None:
+                self._close_quietly(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # 整合性違反などは接続自体に問題がないため再利用する
+            discard = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+# プールを作り直す（DB_FILE が変わる）ときに呼ぶ、プロセス内キャッシュの破棄処理
+_reset_hooks = []
+
+
+def register_reset_hook(func) -> None:
+    """DB の切り替え・プール破棄時に呼ぶ関数を登録する（プロセス内キャッシュの破棄用）"""
+    _reset_hooks.append(func)
+
+
+def _run_reset_hooks() -> None:
+    for func in _reset_hooks:
+        func()
+
+
+register_reset_hook(attendance.state_cache.invalidate)
+
+
+def get_pool() -> ConnectionPool:
+    """現在の DB_FILE に対するプールを返す（DB_FILE が変わった場合は作り直す）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_file != DB_FILE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_FILE)
+            _run_reset_hooks()
+        return _pool
+
+
+def db_connection():
+    """プールから接続を借りるコンテキストマネージャ
+
+    with db_connection() as conn:
+        conn.execute(...)
+    """
+    return get_pool().connection()
+
+
+# 同一プロセス内の書き込みトランザクションを直列化するロック。
+# SQLite の busy ハンドラ（スリープしながらの再試行）に任せるより待ち時間のばらつきが小さい。
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """書き込みトランザクション（BEGIN IMMEDIATE）を開始し、正常終了でコミットする
+
+    with write_transaction(conn):
+        conn.execute(...)
+
+    途中で conn.rollback() した場合はコミットしない。例外時はロールバックする。
+    """
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        if conn.in_transaction:
+            conn.commit()
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+    _run_reset_hooks()
+
+def _ensure_column(cursor, table: str, column: str, declaration: str) -> bool:
+    """既存のテーブルに列が無ければ追加する。追加した場合は True"""
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return True
+
+
+def _event_rtree_end(alias: str) -> str:
+    """events_rtree.end_epoch に入れる値の SQL 式（繰り返しイベントは最終回の終了）"""
+    return (
+        f"CASE WHEN {alias}.rrule IS NULL THEN strftime('%s', {alias}.end_datetime) "
+        f"WHEN {alias}.recurrence_until IS NULL THEN 253402300799 "
+        f"ELSE strftime('%s', {alias}.recurrence_until) + strftime('%s', {alias}.end_datetime) "
+        f"- strftime('%s', {alias}.start_datetime) END"
+    )
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def create_tables(force: bool = False):
+    """テーブルが存在しない場合にテーブルを作成する
+
+    スキーマのバージョンを PRAGMA user_version に記録し、既に最新の DB では
+    DDL を一切実行しない（force=True で常に実行する）。
+    """
     conn = get_db_connection()
+    if not force and schema_version(conn) >= SCHEMA_VERSION:
+        conn.close()
+        logger.debug(f"Schema is up to date (version {SCHEMA_VERSION}).")
+        return
     cursor = conn.cursor()
     # 永続化されるWALモードの有効化（既に設定済みでも冪等）
     try:
@@ -78,12 +317,115 @@ def create_tables():
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    # 繰り返しイベント（RRULE と最終回の開始日時）と、削除された回
+    recurrence_added = _ensure_column(cursor, 'events', 'rrule', 'TEXT')
+    _ensure_column(cursor, 'events', 'recurrence_until', 'TEXT')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS event_exceptions (
+            event_id INTEGER NOT NULL,
+            occurrence_start TEXT NOT NULL,
+            PRIMARY KEY (event_id, occurrence_start),
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    # 日別の勤務/休憩秒数（打刻ごとに差分更新するロールアップ）
+    needs_rollup_backfill = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_work_totals'"
+    ).fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_work_totals (
+            employee_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            work_seconds INTEGER NOT NULL DEFAULT 0,
+            break_seconds INTEGER NOT NULL DEFAULT 0,
+            open_since INTEGER,
+            PRIMARY KEY (employee_id, day),
+            FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    # 従業員ごとの現在の打刻状態（最後の打刻）。打刻のたびに compare-and-set で更新する
+    needs_state_backfill = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employee_state'"
+    ).fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS employee_state (
+            employee_id INTEGER PRIMARY KEY,
+            state TEXT,
+            last_event_id INTEGER,
+            last_timestamp INTEGER,
+            FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_employees_state_insert AFTER INSERT ON employees
+        BEGIN
+            INSERT OR IGNORE INTO employee_state (employee_id) VALUES (NEW.id);
+        END
+    ''')
+    # イベントの期間検索用 R*Tree（開始・終了のエポック秒）。events へのトリガーで同期する。
+    # 繰り返しイベントは初回の開始から最終回の終了まで（無期限なら最大値）を登録する
+    needs_rtree_backfill = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events_rtree'"
+    ).fetchone() is None
+    if recurrence_added:
+        # 繰り返し対応前のトリガーを作り直す
+        for trigger in ('trg_events_rtree_insert', 'trg_events_rtree_update'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        needs_rtree_backfill = True
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree(id, start_epoch, end_epoch)")
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_events_rtree_insert AFTER INSERT ON events
+            BEGIN
+                INSERT INTO events_rtree (id, start_epoch, end_epoch)
+                VALUES (NEW.id, strftime('%s', NEW.start_datetime), {_event_rtree_end('NEW')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_events_rtree_update
+            AFTER UPDATE OF start_datetime, end_datetime, rrule, recurrence_until ON events
+            BEGIN
+                UPDATE events_rtree SET start_epoch = strftime('%s', NEW.start_datetime), end_epoch = {_event_rtree_end('NEW')}
+                WHERE id = NEW.id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_events_rtree_delete AFTER DELETE ON events
+            BEGIN
+                DELETE FROM events_rtree WHERE id = OLD.id;
+            END
+        ''')
+        if needs_rtree_backfill:
+            cursor.execute("DELETE FROM events_rtree")
+            cursor.execute(
+                "INSERT INTO events_rtree (id, start_epoch, end_epoch) "
+                f"SELECT id, strftime('%s', start_datetime), {_event_rtree_end('events')} FROM events"
+            )
+    except sqlite3.OperationalError as e:
+        # R*Tree 無しでビルドされた SQLite では従来のインデックス検索のみ使う
+        logger.warning(f"R*Tree is not available, falling back to index scan for events: {e}")
+
     # パフォーマンス向上のためのインデックス
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_employee_time ON attendance_records(employee_id, timestamp)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_start ON events(start_datetime)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_end ON events(end_datetime)")
-    
-    logger.info("Database tables are ready.")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_recurring ON events(start_datetime) WHERE rrule IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_totals_day ON daily_work_totals(day)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_totals_open ON daily_work_totals(employee_id) WHERE open_since IS NOT NULL")
+
+    if needs_rollup_backfill:
+        # 既存DBに初めてロールアップを作る場合は生の打刻から埋める
+        rows = attendance.rebuild_daily_totals(conn)
+        logger.info(f"Backfilled daily_work_totals: {rows} rows")
+
+    if needs_state_backfill:
+        attendance.rebuild_employee_state(conn)
+        logger.info("Backfilled employee_state from attendance records.")
+
+    # マイグレーション適用済みの DB（force=True での再実行）ではバージョンを戻さない
+    if schema_version(conn) < SCHEMA_VERSION:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    logger.info(f"Database tables are ready (base schema version {SCHEMA_VERSION}).")
     conn.commit()
     conn.close()
 
@@ -94,7 +436,7 @@ def initialize_database():
         create_tables()
         create_initial_admin()
     else:
-        # 既存DBの場合でもテーブルの存在確認は毎回行う
+        # 既存DBはスキーマのバージョンが古い場合のみ DDL を実行する
         create_tables()
         logger.info("Database already exists.")
         # 明示的に環境変数が設定されている場合、管理者パスワードを再発行
@@ -142,7 +484,7 @@ def create_initial_admin():
         logger.warning("No admin user found. Generating initial admin user.")
         # ランダム初期パスワードを生成し、初回のみ安全に保存する
         plain_password = _generate_random_password()
-        hashed_password = generate_password_hash(plain_password, method='pbkdf2:sha256')
+        hashed_password = auth.hash_password(plain_password)
 
         cursor.execute(
             "INSERT INTO employees (name, password, is_admin) VALUES (?, ?, ?)",
@@ -178,7 +520,7 @@ def reset_admin_password(write_file: bool = True) -> Optional[str]:
     user_id = row[0]
     username = row[1] if not isinstance(row, sqlite3.Row) else row['name']
     plain_password = _generate_random_password()
-    hashed_password = generate_password_hash(plain_password, method='pbkdf2:sha256')
+    hashed_password = auth.hash_password(plain_password)
     cur.execute("UPDATE employees SET password = ? WHERE id = ?", (hashed_password, user_id))
     conn.commit()
     conn.close()
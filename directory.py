@@ -0,0 +1,84 @@
+"""従業員一覧のページ送り・検索と変更の検出
+
+一覧は id 順のキーセットページング（前のページの最後の id より後ろを limit 件）で返す。
+名前の検索は、3文字以上なら FTS5（trigram）の全文索引、それより短い場合は LIKE を使う。
+employees の追加・削除・表示項目の変更ごとに change_counters のバージョンが上がり、
+画面側はバージョンが変わったときだけ一覧を取り直す。
+"""
+import logging
+
+import database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# trigram トークナイザが検索できる最短の文字数
+FTS_MIN_QUERY_LENGTH = 3
+# change_counters / employees_fts が使えるスキーマのバージョン（migrations.py）
+DIRECTORY_SCHEMA_VERSION = 4
+
+_COLUMNS = "id, name, hourly_wage, is_admin"
+_PAGE_QUERY = f"SELECT {_COLUMNS} FROM employees WHERE id > ? {{}}ORDER BY id LIMIT ?"
+_FTS_FILTER = "AND id IN (SELECT rowid FROM employees_fts WHERE employees_fts MATCH ?) "
+_LIKE_FILTER = "AND name LIKE ? ESCAPE '\\' "
+
+_fts_available = False
+
+
+def has_fts(conn):
+    """employees_fts が使えるか（マイグレーション前や FTS5 の無い SQLite では False）"""
+    global _fts_available
+    if not _fts_available:
+        # マイグレーションはバックグラウンドで適用されるため、使えると分かるまで毎回確認する
+        _fts_available = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'employees_fts'"
+        ).fetchone() is not None
+    return _fts_available
+
+
+def version(conn):
+    """従業員一覧のバージョン（マイグレーション前は None = 変更を検出できない）"""
+    if database.schema_version(conn) < DIRECTORY_SCHEMA_VERSION:
+        return None
+    row = conn.execute("SELECT version FROM change_counters WHERE name = 'employees'").fetchone()
+    return row[0] if row else None
+
+
+def _fts_phrase(query):
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _like_pattern(query):
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def list_employees(conn, cursor=None, limit=None, query=None):
+    """cursor（前のページの最後の id）より後ろの従業員を返す。戻り値: (行の dict のリスト, 次の cursor | None)"""
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    after = int(cursor or 0)
+    query = (query or '').strip()
+    if not query:
+        sql, params = _PAGE_QUERY.format(''), (after, limit + 1)
+    elif len(query) >= FTS_MIN_QUERY_LENGTH and has_fts(conn):
+        sql, params = _PAGE_QUERY.format(_FTS_FILTER), (after, _fts_phrase(query), limit + 1)
+    else:
+        sql, params = _PAGE_QUERY.format(_LIKE_FILTER), (after, _like_pattern(query), limit + 1)
+    rows = [dict(row) for row in conn.execute(sql, params)]
+    # 1件多く読み、次のページがあるかを判定する
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def get_employee(conn, employee_id):
+    row = conn.execute(f"SELECT {_COLUMNS} FROM employees WHERE id = ?", (employee_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _reset():
+    global _fts_available
+    _fts_available = False
+
+
+database.register_reset_hook(_reset)
@@ -0,0 +1,276 @@
+"""pywebview の js_api 呼び出しをスレッドプールで実行するディスパッチャ
+
+ApiDispatcher は Api の公開メソッドと同名のプロキシを持つため、
+webview.create_window(js_api=...) に Api の代わりにそのまま渡せる。
+
+- パスワードハッシュや集計などの CPU 負荷の高い処理は専用の executor で実行し、
+  時計の更新や状態取得などの軽い呼び出しを待たせない。
+- 同じ引数で同時に実行中の読み取り専用呼び出しは、1回の実行結果を共有する。
+- メソッドごとの呼び出し回数・待ち時間・実行時間と、executor ごとの待ち行列の長さを記録する。
+"""
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 専用 executor で実行する CPU 負荷の高いメソッド
+CPU_BOUND_METHODS = frozenset({
+    'login',
+    'login_with_pin',
+    'set_employee_pin',
+    'add_employee',
+    'change_password',
+    'get_attendance_summary',
+    'get_attendance_summaries',
+    'get_workforce_analytics',
+    'get_shift_variance_report',
+    'import_attendance',
+    'export_attendance',
+    'export_attendance_summary',
+})
+
+# 同じ引数で実行中の呼び出しがあれば結果を共有してよい読み取り専用メソッド
+DEDUPLICATED_METHODS = frozenset({
+    'get_settings',
+    'get_events',
+    'get_user_status',
+    'get_presence',
+    'get_all_employees',
+    'list_employees',
+    'get_employee',
+    'get_attendance_summary',
+    'get_attendance_summaries',
+    'get_workforce_analytics',
+    'get_shift_assignments',
+    'get_shift_variance_report',
+})
+
+# これより時間のかかった呼び出しは警告ログを出す
+SLOW_CALL_SECONDS = 1.0
+# 起動処理（DB の初期化など）の完了を待つ最大時間
+READY_TIMEOUT_SECONDS = 60.0
+
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+class _MethodStats:
+    __slots__ = ('calls', 'errors', 'deduplicated', 'wait_total', 'run_total', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.deduplicated = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        executed = self.calls - self.deduplicated
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'deduplicated': self.deduplicated,
+            'avg_wait_ms': round(self.wait_total / executed * 1000, 3) if executed else 0,
+            'avg_run_ms': round(self.run_total / executed * 1000, 3) if executed else 0,
+            'avg_latency_ms': round(self.latency_total / self.calls * 1000, 3) if self.calls else 0,
+            'max_latency_ms': round(self.latency_max * 1000, 3),
+        }
+
+
+class ApiExecutor:
+    """ディスパッチャが共有する executor 群と統計
+
+    pywebview に公開されないよう、ApiDispatcher とは別のオブジェクトとして保持する。
+    """
+
+    def __init__(self, io_workers=None, cpu_workers=None, ready=True):
+        """ready=False の場合、mark_ready() が呼ばれるまで呼び出しを待たせる
+
+        ウィンドウを先に表示し、DB の初期化をその後で行う場合に使う。
+        """
+        self._executors = {
+            'io': ThreadPoolExecutor(
+                max_workers=io_workers or _env_int('API_IO_WORKERS', 4), thread_name_prefix='api-io'
+            ),
+            'cpu': ThreadPoolExecutor(
+                max_workers=cpu_workers or _env_int('API_CPU_WORKERS', 2), thread_name_prefix='api-cpu'
+            ),
+        }
+        self._ready = threading.Event()
+        if ready:
+            self._ready.set()
+        self._pending = {'io': 0, 'cpu': 0}
+        self._in_flight = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, method, args, dedup_scope=None):
+        """method(*args) を適切な executor で実行し、完了まで待って結果を返す
+
+        dedup_scope を指定した場合、同じスコープ・同じ引数で実行中の呼び出しと結果を共有する。
+        """
+        if not self._ready.is_set() and not self._ready.wait(READY_TIMEOUT_SECONDS):
+            logger.error(f"API call {name} rejected: startup did not finish in {READY_TIMEOUT_SECONDS}s")
+            return {'success': False, 'message': '起動処理が完了していません。しばらくしてから再度お試しください。'}
+        lane = 'cpu' if name in CPU_BOUND_METHODS else 'io'
+        started = time.perf_counter()
+        key = None
+        future = None
+        with self._lock:
+            stats = self._stats.setdefault(name, _MethodStats())
+            stats.calls += 1
+            if dedup_scope is not None and name in DEDUPLICATED_METHODS:
+                key = (dedup_scope, name, json.dumps(args, sort_keys=True, default=str))
+                future = self._in_flight.get(key)
+                if future is not None:
+                    stats.deduplicated += 1
+            if future is None:
+                self._pending[lane] += 1
+                future = self._executors[lane].submit(self._run, name, method, lane, started, args)
+                if key is not None:
+                    self._in_flight[key] = future
+                    future.add_done_callback(lambda f, key=key: self._forget(key, f))
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats.latency_total += elapsed
+                stats.latency_max = max(stats.latency_max, elapsed)
+            if elapsed > SLOW_CALL_SECONDS:
+                logger.warning(f"Slow API call: {name} took {elapsed:.3f}s")
+
+    def mark_ready(self):
+        """起動処理の完了を通知し、待たせていた呼び出しを実行させる"""
+        self._ready.set()
+
+    def _run(self, name, method, lane, submitted, args):
+        started = time.perf_counter()
+        with self._lock:
+            self._pending[lane] -= 1
+        try:
+            return method(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                stats = self._stats[name]
+                stats.wait_total += started - submitted
+                stats.run_total += finished - started
+            metrics.registry.record_queue_wait(lane, (started - submitted) * 1000)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': dict(self._pending),
+                'in_flight_shared': len(self._in_flight),
+                'methods': {name: s.as_dict() for name, s in sorted(self._stats.items())},
+            }
+
+    def shutdown(self, wait=True):
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+
+
+def session_scope(api):
+    """api の呼び出しの結果を共有してよい範囲（同じ Api・同じログインユーザー）
+
+    ユーザーを含めないと、ログイン/ログアウトの前に始まった呼び出しの結果
+    （前のユーザーの状態）が、その後の呼び出しに返ってしまう。
+    """
+    user = api.current_user
+    return (id(api), user['id'], user['is_admin']) if user else (id(api), None, False)
+
+
+class ApiDispatcher:
+    """Api の公開メソッドを ApiExecutor 経由で呼び出すプロキシ
+
+    pywebview 4.x は inspect.ismethod の属性だけを JS に公開し、引数名は
+    getfullargspec の先頭（self）を除いたものを使う。そのためプロキシは self を
+    先頭に持つ関数としてこのインスタンスに束縛する。
+    """
+
+    def __init__(self, api, executor):
+        self._api = api
+        self._executor = executor
+        for name, method in inspect.getmembers(api, inspect.ismethod):
+            if name.startswith('_') or hasattr(self, name):
+                continue
+            setattr(self, name, types.MethodType(self._make_proxy(name, method), self))
+
+    def _make_proxy(self, name, method):
+        executor = self._executor
+        api = self._api
+
+        def proxy(_self, *args):
+            return executor.call(name, method, args, dedup_scope=session_scope(api))
+
+        proxy.__name__ = name
+        proxy.__doc__ = method.__doc__
+        # pywebview は引数名を JS 側の関数定義に使うため、元のシグネチャ（self を先頭に付けたもの）を引き継ぐ
+        signature = inspect.signature(method)
+        proxy.__signature__ = signature.replace(parameters=[
+            inspect.Parameter('self', inspect.Parameter.POSITIONAL_OR_KEYWORD), *signature.parameters.values()
+        ])
+        return proxy
+
+    def get_dispatch_stats(self):
+        """ディスパッチャの統計（待ち行列の長さ・メソッド別の遅延）を返す（管理者のみ）"""
+        user = self._api.current_user
+        if not user or not user['is_admin']:
+            return {'success': False, 'message': '権限がありません。'}
+        return {'success': True, 'stats': self._executor.stats()}
+
+
+def js_api_functions(obj):
+    """pywebview（webview.util.get_functions）と同じ方法で、JS に公開されるメソッド名 → 引数名のリストを返す"""
+    functions = {}
+    for name in dir(obj):
+        if name.startswith('_'):
+            continue
+        attr = getattr(obj, name)
+        if inspect.ismethod(attr):
+            functions[name] = inspect.getfullargspec(attr).args[1:]
+    return functions
+
+
+def check_js_api(dispatcher, api):
+    """api の公開メソッドがすべて同じ引数名で dispatcher から JS に公開されることを確かめる
+
+    公開されないメソッドがあると画面からの呼び出しが黙って失敗するため、起動時に確認する。
+    """
+    exposed = js_api_functions(dispatcher)
+    # Api のメソッドは metrics.instrument で包まれているため、元の関数のシグネチャで比べる
+    expected = {
+        name: list(inspect.signature(method).parameters)
+        for name, method in inspect.getmembers(api, inspect.ismethod) if not name.startswith('_')
+    }
+    problems = [
+        f"{name}{args} is exposed as {exposed.get(name)}" for name, args in sorted(expected.items())
+        if exposed.get(name) != args
+    ]
+    if problems:
+        raise RuntimeError("js_api does not expose the Api methods correctly: " + "; ".join(problems))
+    return exposed
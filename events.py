@@ -0,0 +1,281 @@
+"""カレンダーイベントの期間検索と繰り返しイベントの展開
+
+events_rtree（R*Tree 仮想テーブル）で開始・終了の両方を同時に絞り込み、
+結果はカレンダーの表示期間（月）ごとにプロセス内でキャッシュする。
+R*Tree の座標は 32bit 浮動小数のため外側に丸められる。そのため R*Tree は候補の
+絞り込みにだけ使い、最終的な判定は events の文字列カラムで行う。
+
+繰り返しイベントは events に1行（初回の開始・終了と RRULE）だけ保存し、
+R*Tree には初回の開始から最終回の終了までを登録する。各回は表示期間の中だけ
+ジェネレータで展開し、期間の先頭までは周期の倍数で一気に進めるため、
+展開の手間は過去に発生した回数ではなく表示期間の長さに比例する。
+"""
+import datetime
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# キャッシュする表示期間の数（前後の月への移動を数回分）
+WINDOW_CACHE_SIZE = 24
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+# COUNT 指定で許可する最大回数（保存時に最終回を求めるため）
+MAX_COUNT = 1000
+
+_RTREE_QUERY = (
+    "SELECT e.* FROM events_rtree r JOIN events e ON e.id = r.id "
+    "WHERE r.start_epoch < CAST(strftime('%s', ?) AS INTEGER) AND r.end_epoch > CAST(strftime('%s', ?) AS INTEGER) "
+    "AND e.start_datetime < ? AND (e.rrule IS NOT NULL OR e.end_datetime > ?) ORDER BY e.start_datetime, e.id"
+)
+_SCAN_QUERY = (
+    "SELECT * FROM events WHERE rrule IS NULL AND start_datetime < ? AND end_datetime > ? "
+    "ORDER BY start_datetime, id"
+)
+# idx_events_recurring（rrule IS NOT NULL の部分インデックス）を使う
+_RECURRING_SCAN_QUERY = "SELECT * FROM events WHERE rrule IS NOT NULL AND start_datetime < ?"
+_EXCEPTIONS_QUERY = "SELECT occurrence_start FROM event_exceptions WHERE event_id = ? AND occurrence_start >= ? AND occurrence_start < ?"
+
+RecurrenceRule = namedtuple('RecurrenceRule', ['freq', 'interval', 'byday', 'until', 'count'])
+
+
+def _parse_until(value):
+    """RRULE の UNTIL（YYYYMMDD / YYYYMMDDTHHMMSS）を datetime にする。日付のみはその日の終わりまで"""
+    value = value.rstrip('Z')
+    if 'T' in value:
+        return datetime.datetime.strptime(value, '%Y%m%dT%H%M%S')
+    return datetime.datetime.strptime(value, '%Y%m%d') + datetime.timedelta(days=1, seconds=-1)
+
+
+def parse_rrule(text):
+    """RRULE 文字列（FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL, BYDAY, UNTIL, COUNT）を解析する
+
+    不正な場合は ValueError を送出する。
+    """
+    parts = {}
+    for item in text.strip().removeprefix('RRULE:').split(';'):
+        if not item:
+            continue
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f'invalid RRULE part: {item!r}')
+        parts[key.strip().upper()] = value.strip().upper()
+    unknown = set(parts) - {'FREQ', 'INTERVAL', 'BYDAY', 'UNTIL', 'COUNT'}
+    if unknown:
+        raise ValueError(f'unsupported RRULE parts: {sorted(unknown)}')
+    freq = parts.get('FREQ')
+    if freq not in FREQUENCIES:
+        raise ValueError(f'unsupported FREQ: {freq!r}')
+    interval = int(parts.get('INTERVAL', '1'))
+    if interval < 1:
+        raise ValueError('INTERVAL must be positive')
+    byday = ()
+    if 'BYDAY' in parts:
+        if freq != 'WEEKLY':
+            raise ValueError('BYDAY is only supported with FREQ=WEEKLY')
+        byday = tuple(sorted({WEEKDAYS.index(day) for day in parts['BYDAY'].split(',')}))
+    if 'UNTIL' in parts and 'COUNT' in parts:
+        raise ValueError('UNTIL and COUNT are mutually exclusive')
+    until = _parse_until(parts['UNTIL']) if 'UNTIL' in parts else None
+    count = int(parts['COUNT']) if 'COUNT' in parts else None
+    if count is not None and not 1 <= count <= MAX_COUNT:
+        raise ValueError(f'COUNT must be between 1 and {MAX_COUNT}')
+    return RecurrenceRule(freq, interval, byday, until, count)
+
+
+def iter_occurrence_starts(rule, dtstart, not_before):
+    """not_before 以降（付近）の各回の開始日時を昇順に無限に返す
+
+    not_before より前の回は周期の倍数で飛ばす。終了条件は呼び出し側で判定する。
+    """
+    if rule.freq == 'DAILY':
+        step = datetime.timedelta(days=rule.interval)
+        k = max(0, (not_before - dtstart) // step)
+        while True:
+            yield dtstart + k * step
+            k += 1
+    elif rule.freq == 'WEEKLY':
+        days = rule.byday or (dtstart.weekday(),)
+        week0 = dtstart - datetime.timedelta(days=dtstart.weekday())
+        step = datetime.timedelta(weeks=rule.interval)
+        k = max(0, (not_before - week0) // step)
+        while True:
+            base = week0 + k * step
+            for day in days:
+                start = base + datetime.timedelta(days=day)
+                if start >= dtstart:
+                    yield start
+            k += 1
+    else:
+        months = (not_before.year - dtstart.year) * 12 + not_before.month - dtstart.month
+        k = max(0, months // rule.interval - 1)
+        while True:
+            year, month = divmod(dtstart.month - 1 + k * rule.interval, 12)
+            try:
+                # 31日など存在しない日の月は飛ばす（RFC 5545 と同じ）
+                yield dtstart.replace(year=dtstart.year + year, month=month + 1)
+            except ValueError:
+                pass
+            k += 1
+
+
+def recurrence_until(rule, dtstart):
+    """最終回の開始日時（無期限なら None）を返す。COUNT は保存時にここで日時へ変換する"""
+    if rule.until is not None:
+        return rule.until
+    if rule.count is None:
+        return None
+    for n, start in enumerate(iter_occurrence_starts(rule, dtstart, dtstart), start=1):
+        if n == rule.count:
+            return start
+
+
+def resolve_recurrence_until(rrule, start_datetime):
+    """保存前に RRULE を検証し、recurrence_until 列に入れる文字列（無期限・繰り返し無しは None）を返す
+
+    不正な RRULE の場合は ValueError を送出する。
+    """
+    if not rrule:
+        return None
+    dtstart = datetime.datetime.strptime(start_datetime, DATETIME_FORMAT)
+    until = recurrence_until(parse_rrule(rrule), dtstart)
+    if until is not None and until < dtstart:
+        raise ValueError('UNTIL is before the first occurrence')
+    return until.strftime(DATETIME_FORMAT) if until else None
+
+
+def expand_occurrences(event, window_start, window_end, exceptions=()):
+    """繰り返しイベント1件の、[window_start, window_end) と重なる各回を dict で返すジェネレータ
+
+    各回の start_datetime / end_datetime はその回の日時で、初回の日時は
+    series_start / series_end に入る。exceptions はその回の開始日時の文字列の集合。
+    """
+    rule = parse_rrule(event['rrule'])
+    dtstart = datetime.datetime.fromisoformat(event['start_datetime'])
+    duration = datetime.datetime.fromisoformat(event['end_datetime']) - dtstart
+    until = event['recurrence_until']
+    until = datetime.datetime.fromisoformat(until) if until else None
+    for start in iter_occurrence_starts(rule, dtstart, window_start - duration):
+        if start >= window_end or (until is not None and start > until):
+            return
+        end = start + duration
+        if end <= window_start:
+            continue
+        start_str = start.isoformat(' ')
+        if start_str in exceptions:
+            continue
+        yield {
+            **event,
+            'start_datetime': start_str,
+            'end_datetime': end.isoformat(' '),
+            'series_start': event['start_datetime'],
+            'series_end': event['end_datetime'],
+        }
+
+
+_rtree_available = None
+
+
+def has_rtree(conn):
+    """events_rtree が使えるか（SQLite が R*Tree 無しでビルドされている場合は False）"""
+    global _rtree_available
+    if _rtree_available is None:
+        _rtree_available = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events_rtree'"
+        ).fetchone() is not None
+    return _rtree_available
+
+
+def query_events(conn, start_datetime, end_datetime):
+    """[start_datetime, end_datetime) と重なるイベント（繰り返しは各回に展開）を開始日時順に返す"""
+    if has_rtree(conn):
+        rows = [dict(row) for row in conn.execute(
+            _RTREE_QUERY, (end_datetime, start_datetime, end_datetime, start_datetime)
+        )]
+    else:
+        rows = [dict(row) for row in conn.execute(_SCAN_QUERY, (end_datetime, start_datetime))]
+        rows.extend(dict(row) for row in conn.execute(_RECURRING_SCAN_QUERY, (end_datetime,)))
+    if not any(row['rrule'] for row in rows):
+        return rows
+
+    window_start = datetime.datetime.fromisoformat(start_datetime)
+    window_end = datetime.datetime.fromisoformat(end_datetime)
+    results = []
+    for row in rows:
+        if not row['rrule']:
+            results.append(row)
+            continue
+        duration = (datetime.datetime.fromisoformat(row['end_datetime'])
+                    - datetime.datetime.fromisoformat(row['start_datetime']))
+        exceptions = {r[0] for r in conn.execute(
+            _EXCEPTIONS_QUERY, (row['id'], (window_start - duration).isoformat(' '), end_datetime)
+        )}
+        try:
+            results.extend(expand_occurrences(row, window_start, window_end, exceptions))
+        except ValueError as e:
+            logger.warning(f"Skipping event {row['id']} with invalid rrule {row['rrule']!r}: {e}")
+    results.sort(key=lambda e: (e['start_datetime'], e['id']))
+    return results
+
+
+class EventWindowCache:
+    """表示期間 → イベント一覧の LRU キャッシュ
+
+    イベントの追加・更新・削除で世代を進めて全体を破棄する。問い合わせ中に
+    世代が進んだ場合、その結果は古い可能性があるためキャッシュしない。
+    """
+
+    def __init__(self, size=WINDOW_CACHE_SIZE):
+        self.size = size
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+window_cache = EventWindowCache()
+
+
+def get_events_cached(start_datetime, end_datetime):
+    key = (start_datetime, end_datetime)
+    events = window_cache.get(key)
+    if events is None:
+        generation = window_cache.generation
+        with database.db_connection() as conn:
+            events = query_events(conn, start_datetime, end_datetime)
+        window_cache.put(key, events, generation)
+    return events
+
+
+def _reset():
+    global _rtree_available
+    _rtree_available = None
+    window_cache.invalidate()
+
+
+database.register_reset_hook(_reset)
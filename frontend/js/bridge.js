@@ -0,0 +1,119 @@
+// ===================================================
+//  サーバーモード用ブリッジ
+//  pywebview の外（ブラウザ端末）で開かれた場合、window.pywebview.api を
+//  HTTP の JSON API（POST /api/<method>）で置き換える。
+// ===================================================
+(function () {
+    const TOKEN_KEY = 'attendance-session-token';
+
+    async function callApi(method, args) {
+        const headers = { 'Content-Type': 'application/json' };
+        const token = sessionStorage.getItem(TOKEN_KEY);
+        if (token) headers['X-Session-Token'] = token;
+        const response = await fetch(`api/${method}`, {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ args: args })
+        });
+        const result = await response.json();
+        if (method.startsWith('login') && result && result.success && result.token) {
+            sessionStorage.setItem(TOKEN_KEY, result.token);
+        } else if (method === 'logout') {
+            sessionStorage.removeItem(TOKEN_KEY);
+        }
+        return result;
+    }
+
+    /**
+     * 在席状況のストリーム（GET presence/stream の server-sent events）を開く。
+     * トークンをヘッダーで送るため EventSource ではなく fetch で読み、切断されたら
+     * 最後に受け取った seq 以降の差分から再接続する。権限が無い場合は終了する。
+     * ストリームの数が上限に達している場合（503）は get_presence で取得し、
+     * Retry-After の秒数の後に接続し直す。
+     */
+    function openPresenceStream(since, onPresence) {
+        const controller = new AbortController();
+        let lastSeq = since;
+        let closed = false;
+        let retryDelay = 3000;
+
+        async function connect() {
+            const headers = {};
+            const token = sessionStorage.getItem(TOKEN_KEY);
+            if (token) headers['X-Session-Token'] = token;
+            const query = (lastSeq === null || lastSeq === undefined) ? '' : `?since=${lastSeq}`;
+            const response = await fetch(`presence/stream${query}`, { headers: headers, signal: controller.signal });
+            retryDelay = 3000;
+            if (response.status === 503) {
+                retryDelay = (parseInt(response.headers.get('Retry-After'), 10) || 10) * 1000;
+                const result = await callApi('get_presence', [lastSeq]);
+                if (result && result.success) {
+                    lastSeq = result.seq;
+                    onPresence(result);
+                }
+                return;
+            }
+            if (!response.ok) {
+                closed = true;
+                return;
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            for (;;) {
+                const { value, done } = await reader.read();
+                if (done) return;
+                buffer += decoder.decode(value, { stream: true });
+                let end;
+                while ((end = buffer.indexOf('\n\n')) >= 0) {
+                    const message = buffer.slice(0, end);
+                    buffer = buffer.slice(end + 2);
+                    const data = message.split('\n')
+                        .filter(line => line.startsWith('data: '))
+                        .map(line => line.slice('data: '.length))
+                        .join('\n');
+                    if (!data) continue; // keepalive
+                    const result = JSON.parse(data);
+                    lastSeq = result.seq;
+                    onPresence(result);
+                }
+            }
+        }
+
+        (async () => {
+            while (!closed) {
+                try {
+                    await connect();
+                } catch (e) {
+                    if (closed) return;
+                }
+                if (!closed) await new Promise(resolve => setTimeout(resolve, retryDelay));
+            }
+        })();
+        return {
+            close: () => {
+                closed = true;
+                controller.abort();
+            }
+        };
+    }
+
+    function installHttpBridge() {
+        const api = new Proxy({}, {
+            get: (_, method) => (...args) => callApi(method, args)
+        });
+        window.pywebview = { api: api };
+        window.openPresenceStream = openPresenceStream;
+        window.dispatchEvent(new Event('pywebviewready'));
+    }
+
+    window.addEventListener('DOMContentLoaded', () => {
+        if (window.pywebview) return;
+        fetch('server-info')
+            .then(response => response.ok ? response.json() : null)
+            .then(info => {
+                if (info && info.mode === 'server' && !window.pywebview) installHttpBridge();
+            })
+            .catch(() => {});
+    });
+})();
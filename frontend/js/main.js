@@ -19,7 +19,7 @@ let adminCalendarDate = new Date();
 let eventsCache = {};
 
 // DOM要素
-let calendarGrid, calendarTitle, eventModalOverlay, eventForm, eventModalTitle, deleteEventBtn;
+let calendarGrid, calendarTitle, eventModalOverlay, eventForm, eventModalTitle, deleteEventBtn, deleteOccurrenceBtn;
 
 
 // ===================================================
@@ -59,8 +59,16 @@ function showView(viewName) {
     }
     // ▲▲▲ 修正 ▲▲▲
     
-    if (viewName === 'admin' && !isAdminViewInitialized) {
-        initializeAdminView();
+    if (viewName === 'admin') {
+        startPresenceBoard();
+        if (!isAdminViewInitialized) {
+            initializeAdminView();
+        } else {
+            // 変更があった場合のみ一覧を取り直す
+            loadEmployees();
+        }
+    } else {
+        stopPresenceBoard();
     }
 }
 
@@ -186,13 +194,19 @@ function openEventModal(date, event = null) {
         document.getElementById('event-description').value = event.description || '';
         const isAllday = event.is_allday === 1;
         document.getElementById('event-allday').checked = isAllday;
-        const start = new Date(event.start_datetime.replace(' ', 'T'));
-        const end = new Date(event.end_datetime.replace(' ', 'T'));
+        // 繰り返しイベントは全体（初回の日時）を編集する
+        const start = new Date((event.series_start || event.start_datetime).replace(' ', 'T'));
+        const end = new Date((event.series_end || event.end_datetime).replace(' ', 'T'));
+        const rule = parseRepeatRule(event.rrule);
+        document.getElementById('event-repeat').value = rule.freq;
+        document.getElementById('event-repeat-until').value = rule.until;
+        document.getElementById('event-occurrence-start').value = event.rrule ? event.start_datetime : '';
         document.getElementById('event-start').type = isAllday ? 'date' : 'datetime-local';
         document.getElementById('event-end').type = isAllday ? 'date' : 'datetime-local';
         document.getElementById('event-start').value = formatDateForInput(start, isAllday);
         document.getElementById('event-end').value = formatDateForInput(end, isAllday);
         deleteEventBtn.style.display = 'block';
+        deleteOccurrenceBtn.style.display = event.rrule ? 'block' : 'none';
     } else {
         eventModalTitle.textContent = 'イベントを追加';
         document.getElementById('event-id').value = '';
@@ -205,8 +219,11 @@ function openEventModal(date, event = null) {
         document.getElementById('event-end').type = 'datetime-local';
         document.getElementById('event-start').value = formatDateForInput(start, false);
         document.getElementById('event-end').value = formatDateForInput(end, false);
+        document.getElementById('event-occurrence-start').value = '';
         deleteEventBtn.style.display = 'none';
+        deleteOccurrenceBtn.style.display = 'none';
     }
+    updateRepeatUntilVisibility();
     views.eventModal.style.display = 'flex';
 }
 
@@ -237,7 +254,9 @@ async function handleSaveEvent(e) {
         return;
     }
 
-    const result = id ? await window.pywebview.api.update_event(id, title, description, start_datetime, end_datetime, is_allday) : await window.pywebview.api.add_event(title, description, start_datetime, end_datetime, is_allday);
+    const rrule = buildRepeatRule(document.getElementById('event-repeat').value, document.getElementById('event-repeat-until').value);
+
+    const result = id ? await window.pywebview.api.update_event(id, title, description, start_datetime, end_datetime, is_allday, rrule) : await window.pywebview.api.add_event(title, description, start_datetime, end_datetime, is_allday, rrule);
     if (result.success) {
         closeEventModal();
         if (views.admin.style.display !== 'none') {
@@ -264,6 +283,45 @@ async function handleDeleteEvent() {
     }
 }
 
+async function handleDeleteOccurrence() {
+    const id = document.getElementById('event-id').value;
+    const occurrenceStart = document.getElementById('event-occurrence-start').value;
+    if (!id || !occurrenceStart) return;
+    if (confirm(`${occurrenceStart} の回のみ削除しますか？`)) {
+        const result = await window.pywebview.api.delete_event_occurrence(id, occurrenceStart);
+        if (result.success) {
+            closeEventModal();
+            if (views.admin.style.display !== 'none') {
+                await renderCalendar({ date: adminCalendarDate, titleEl: document.getElementById('calendar-title'), gridEl: document.getElementById('calendar-grid'), cacheKey: 'admin', isReadOnly: false });
+            }
+        } else {
+            alert('削除に失敗しました: ' + result.message);
+        }
+    }
+}
+
+function updateRepeatUntilVisibility() {
+    const repeat = document.getElementById('event-repeat').value;
+    document.getElementById('event-repeat-until-group').style.display = repeat ? 'block' : 'none';
+}
+
+// 'FREQ=WEEKLY;UNTIL=20251231' → { freq: 'WEEKLY', until: '2025-12-31' }
+function parseRepeatRule(rrule) {
+    const rule = { freq: '', until: '' };
+    if (!rrule) return rule;
+    for (const part of rrule.split(';')) {
+        const [key, value] = part.split('=');
+        if (key === 'FREQ') rule.freq = value;
+        if (key === 'UNTIL') rule.until = `${value.slice(0, 4)}-${value.slice(4, 6)}-${value.slice(6, 8)}`;
+    }
+    return rule;
+}
+
+function buildRepeatRule(freq, until) {
+    if (!freq) return null;
+    return until ? `FREQ=${freq};UNTIL=${until.replace(/-/g, '')}` : `FREQ=${freq}`;
+}
+
 
 // --- ヘルパー関数 ---
 function formatDateForAPI(date) {
@@ -299,21 +357,41 @@ function handleLogin(e) {
     e.preventDefault();
     const name = document.getElementById('name').value;
     const password = document.getElementById('password').value;
+    const usePin = document.getElementById('login-use-pin').checked;
+    const login = usePin ? window.pywebview.api.login_with_pin(name, password) : window.pywebview.api.login(name, password);
+    login.then(handleLoginResult);
+}
+
+// 社員証の読み取り機はコードを入力して Enter を送るため、フォームの送信で受け取る
+function handleBadgeLogin(e) {
+    e.preventDefault();
+    const badgeInput = document.getElementById('badge-code');
+    const code = badgeInput.value;
+    badgeInput.value = '';
+    if (!code) return;
+    window.pywebview.api.login_with_badge(code).then(handleLoginResult);
+}
+
+function handleLoginResult(result) {
     const loginError = document.getElementById('login-error');
+    if (result && result.success) {
+        currentUser = result.user;
+        loginError.textContent = '';
+        document.getElementById('login-form').reset();
+        updatePasswordLabel();
+        initializeMainView();
+        showView('main');
+        setupMainViewListeners();
+        startInactivityObserver();
+    } else {
+        loginError.textContent = result ? result.message : '不明なエラーです。';
+    }
+}
 
-    window.pywebview.api.login(name, password).then(result => {
-        if (result && result.success) {
-            currentUser = result.user;
-            loginError.textContent = '';
-            document.getElementById('login-form').reset();
-            initializeMainView();
-            showView('main');
-            setupMainViewListeners();
-            startInactivityObserver();
-        } else {
-            loginError.textContent = result ? result.message : '不明なエラーです。';
-        }
-    });
+function updatePasswordLabel() {
+    const usePin = document.getElementById('login-use-pin').checked;
+    document.getElementById('password-label').textContent = usePin ? 'PIN' : 'パスワード';
+    document.getElementById('password').inputMode = usePin ? 'numeric' : 'text';
 }
 
 // ▼▼▼ ここから修正 ▼▼▼
@@ -387,58 +465,228 @@ function updateAttendanceStatus() {
 }
 
 
+// --- 在席状況 (管理者) ---
+// 表示中のボード。seq より後の変更だけを受け取り、該当する従業員の行だけを書き換える
+const presenceBoard = { seq: null, rows: new Map(), stream: null, active: false, fetching: false, pending: false };
+const PRESENCE_LABELS = { working: '勤務中', on_break: '休憩中' };
+
+function formatPresenceSince(since) {
+    if (!since) return '';
+    const d = new Date(since * 1000);
+    return `${String(d.getHours()).padStart(2, '0')}:${String(d.getMinutes()).padStart(2, '0')}`;
+}
+
+function applyPresenceEntry(entry) {
+    let row = presenceBoard.rows.get(entry.employee_id);
+    // 退勤済み・未出勤の従業員は表示しない
+    if (entry.removed || entry.status === 'off') {
+        if (row) {
+            row.remove();
+            presenceBoard.rows.delete(entry.employee_id);
+        }
+        return;
+    }
+    if (!row) {
+        row = document.createElement('tr');
+        row.append(document.createElement('td'), document.createElement('td'), document.createElement('td'));
+        presenceBoard.rows.set(entry.employee_id, row);
+        document.querySelector('#presence-table tbody').appendChild(row);
+    }
+    row.className = `presence-${entry.status}`;
+    row.cells[0].textContent = entry.name ?? '';
+    row.cells[1].textContent = PRESENCE_LABELS[entry.status];
+    row.cells[2].textContent = formatPresenceSince(entry.since);
+}
+
+function applyPresence(result) {
+    if (!result || !result.success) return;
+    if (result.full) {
+        document.querySelector('#presence-table tbody').innerHTML = '';
+        presenceBoard.rows.clear();
+        result.employees.forEach(applyPresenceEntry);
+    } else {
+        result.changes.forEach(applyPresenceEntry);
+    }
+    presenceBoard.seq = result.seq;
+    document.getElementById('presence-working-count').textContent = String(result.counts.working);
+    document.getElementById('presence-break-count').textContent = String(result.counts.on_break);
+}
+
+function fetchPresence() {
+    // 取得中に届いた通知は、取得が終わってから1回にまとめて取り直す
+    if (presenceBoard.fetching) {
+        presenceBoard.pending = true;
+        return;
+    }
+    presenceBoard.fetching = true;
+    window.pywebview.api.get_presence(presenceBoard.seq).then(applyPresence).finally(() => {
+        presenceBoard.fetching = false;
+        if (presenceBoard.pending && presenceBoard.active) {
+            presenceBoard.pending = false;
+            fetchPresence();
+        }
+    });
+}
+
+// GUI モードでは Python 側（presence.PresencePusher）が evaluate_js で変更後の seq を通知する
+window.onPresenceChanged = (seq) => {
+    if (presenceBoard.active && seq !== presenceBoard.seq) fetchPresence();
+};
+
+function startPresenceBoard() {
+    if (presenceBoard.active) return;
+    presenceBoard.active = true;
+    if (window.openPresenceStream) {
+        // サーバーモード（ブラウザ端末）では server-sent events で差分を受け取る
+        presenceBoard.stream = window.openPresenceStream(presenceBoard.seq, applyPresence);
+    } else {
+        fetchPresence();
+    }
+}
+
+function stopPresenceBoard() {
+    presenceBoard.active = false;
+    if (presenceBoard.stream) {
+        presenceBoard.stream.close();
+        presenceBoard.stream = null;
+    }
+}
+
+
 // --- 従業員・勤怠集計関連 (管理者) ---
-function loadEmployees() {
-    window.pywebview.api.get_all_employees().then(result => {
-        if (result.success) {
-            const tableBody = document.querySelector("#employee-table tbody");
-            const employeeSelect = document.getElementById('employee-select');
-            tableBody.innerHTML = '';
-            employeeSelect.innerHTML = '';
-
-            result.employees.forEach(emp => {
-                const row = document.createElement('tr');
-
-                const tdId = document.createElement('td');
-                tdId.textContent = String(emp.id);
-                row.appendChild(tdId);
-
-                const tdName = document.createElement('td');
-                tdName.textContent = emp.name ?? '';
-                row.appendChild(tdName);
-
-                const tdWage = document.createElement('td');
-                const wage = (emp.hourly_wage ?? 0);
-                tdWage.textContent = `${Number(wage).toLocaleString()}円`;
-                row.appendChild(tdWage);
-
-                const tdAdmin = document.createElement('td');
-                tdAdmin.textContent = emp.is_admin ? '✔' : '';
-                row.appendChild(tdAdmin);
-
-                const tdActions = document.createElement('td');
-                const delBtn = document.createElement('button');
-                delBtn.className = 'delete-employee-btn';
-                delBtn.dataset.employeeId = String(emp.id);
-                delBtn.textContent = '削除';
-                tdActions.appendChild(delBtn);
-                row.appendChild(tdActions);
-
-                tableBody.appendChild(row);
-
-                const option = document.createElement('option');
-                option.value = String(emp.id);
-                option.textContent = emp.name ?? '';
-                employeeSelect.appendChild(option);
-            });
-        } else {
+const EMPLOYEE_PAGE_SIZE = 100;
+// 表示中の一覧の状態（version が変わらなければ取り直さない）
+const employeeDirectory = { version: null, query: '', nextCursor: null };
+
+function createEmployeeRow(emp) {
+    const row = document.createElement('tr');
+
+    const tdId = document.createElement('td');
+    tdId.textContent = String(emp.id);
+    row.appendChild(tdId);
+
+    const tdName = document.createElement('td');
+    tdName.textContent = emp.name ?? '';
+    row.appendChild(tdName);
+
+    const tdWage = document.createElement('td');
+    const wage = (emp.hourly_wage ?? 0);
+    tdWage.textContent = `${Number(wage).toLocaleString()}円`;
+    row.appendChild(tdWage);
+
+    const tdAdmin = document.createElement('td');
+    tdAdmin.textContent = emp.is_admin ? '✔' : '';
+    row.appendChild(tdAdmin);
+
+    const tdActions = document.createElement('td');
+    const delBtn = document.createElement('button');
+    delBtn.className = 'delete-employee-btn';
+    delBtn.dataset.employeeId = String(emp.id);
+    delBtn.textContent = '削除';
+    const pinBtn = document.createElement('button');
+    pinBtn.className = 'set-pin-btn';
+    pinBtn.dataset.employeeId = String(emp.id);
+    pinBtn.textContent = 'PIN';
+    const badgeBtn = document.createElement('button');
+    badgeBtn.className = 'set-badge-btn';
+    badgeBtn.dataset.employeeId = String(emp.id);
+    badgeBtn.textContent = '社員証';
+    tdActions.append(pinBtn, badgeBtn, delBtn);
+    row.appendChild(tdActions);
+    return row;
+}
+
+function appendEmployees(employees) {
+    const tableRows = document.createDocumentFragment();
+    const options = document.createDocumentFragment();
+    employees.forEach(emp => {
+        tableRows.appendChild(createEmployeeRow(emp));
+        const option = document.createElement('option');
+        option.value = String(emp.id);
+        option.textContent = emp.name ?? '';
+        options.appendChild(option);
+    });
+    document.querySelector("#employee-table tbody").appendChild(tableRows);
+    document.getElementById('employee-select').appendChild(options);
+}
+
+function updateMoreEmployeesButton() {
+    document.getElementById('employee-more-btn').style.display = employeeDirectory.nextCursor ? 'block' : 'none';
+}
+
+/**
+ * 従業員一覧の先頭ページを読み込む。
+ * 検索条件が同じで、サーバー側のバージョンが変わっていなければ何もしない。
+ */
+function loadEmployees(force = false) {
+    const query = document.getElementById('employee-search').value.trim();
+    const sameQuery = query === employeeDirectory.query;
+    const ifVersion = (!force && sameQuery) ? employeeDirectory.version : null;
+    window.pywebview.api.list_employees(null, EMPLOYEE_PAGE_SIZE, query, ifVersion).then(result => {
+        if (!result.success) {
+            alert(result.message);
+            return;
+        }
+        if (result.not_modified) return;
+        employeeDirectory.version = result.version;
+        employeeDirectory.query = query;
+        employeeDirectory.nextCursor = result.next_cursor;
+        const employeeSelect = document.getElementById('employee-select');
+        const selected = employeeSelect.value;
+        document.querySelector("#employee-table tbody").innerHTML = '';
+        employeeSelect.innerHTML = '';
+        appendEmployees(result.employees);
+        if (selected) employeeSelect.value = selected;
+        updateMoreEmployeesButton();
+    });
+}
+
+function loadMoreEmployees() {
+    if (!employeeDirectory.nextCursor) return;
+    window.pywebview.api.list_employees(employeeDirectory.nextCursor, EMPLOYEE_PAGE_SIZE, employeeDirectory.query).then(result => {
+        if (!result.success) {
             alert(result.message);
+            return;
         }
+        if (result.version !== employeeDirectory.version) {
+            // 途中で一覧が変わった場合は先頭から読み直す
+            loadEmployees(true);
+            return;
+        }
+        employeeDirectory.nextCursor = result.next_cursor;
+        appendEmployees(result.employees);
+        updateMoreEmployeesButton();
     });
 }
 
+let employeeSearchTimer = null;
+function handleEmployeeSearch() {
+    clearTimeout(employeeSearchTimer);
+    employeeSearchTimer = setTimeout(() => loadEmployees(), 250);
+}
+
+// 打刻端末向けの PIN / 社員証の登録（空欄で解除）
+async function handleSetPin(employeeId) {
+    const pin = prompt('新しい PIN（4桁以上の数字、空欄で解除）を入力してください。');
+    if (pin === null) return;
+    const result = await window.pywebview.api.set_employee_pin(employeeId, pin);
+    alert(result.success ? result.message : 'エラー: ' + result.message);
+}
+
+async function handleSetBadge(employeeId) {
+    const code = prompt('社員証を読み取り機にかざしてください（空欄で登録解除）。');
+    if (code === null) return;
+    const result = await window.pywebview.api.set_employee_badge(employeeId, code);
+    alert(result.success ? result.message : 'エラー: ' + result.message);
+}
+
 async function handleDeleteEmployee(employeeId) {
-    const employee = (await window.pywebview.api.get_all_employees()).employees.find(e => e.id == employeeId);
+    const found = await window.pywebview.api.get_employee(employeeId);
+    if (!found.success) {
+        alert("エラー: " + found.message);
+        return;
+    }
+    const employee = found.employee;
     if (confirm(`従業員「${employee.name}」を削除しますか？\nこの操作は元に戻せません。`)) {
         const result = await window.pywebview.api.delete_employee(employeeId);
         if (result.success) {
@@ -592,9 +840,13 @@ function initializeAdminView() {
     loadEmployees();
 
     document.querySelector('#employee-table tbody').addEventListener('click', (e) => {
+        const employeeId = e.target.dataset.employeeId;
         if (e.target.classList.contains('delete-employee-btn')) {
-            const employeeId = e.target.dataset.employeeId;
             handleDeleteEmployee(employeeId);
+        } else if (e.target.classList.contains('set-pin-btn')) {
+            handleSetPin(employeeId);
+        } else if (e.target.classList.contains('set-badge-btn')) {
+            handleSetBadge(employeeId);
         }
     });
 
@@ -631,6 +883,24 @@ function initializeAdminView() {
 }
 
 
+/**
+ * 最初の描画までの時間（Performance API）をサーバーへ送り、起動時間の記録に含める
+ */
+function reportPaintTiming() {
+    if (!window.performance || !performance.getEntriesByType) return;
+    const timings = { time_origin: performance.timeOrigin };
+    performance.getEntriesByType('paint').forEach(entry => {
+        timings[entry.name] = entry.startTime;
+    });
+    const navigation = performance.getEntriesByType('navigation')[0];
+    if (navigation) {
+        timings['dom-content-loaded'] = navigation.domContentLoadedEventEnd;
+        timings['load'] = navigation.loadEventEnd;
+    }
+    window.pywebview.api.report_paint_timing(timings).catch(() => {});
+}
+
+
 // ===================================================
 //  アプリケーション初期化 (エントリーポイント)
 // ===================================================
@@ -646,11 +916,18 @@ window.addEventListener('pywebviewready', () => {
     eventForm = document.getElementById('event-form');
     eventModalTitle = document.getElementById('event-modal-title');
     deleteEventBtn = document.getElementById('delete-event-btn');
+    deleteOccurrenceBtn = document.getElementById('delete-occurrence-btn');
     
     document.getElementById('login-form').addEventListener('submit', handleLogin);
+    document.getElementById('badge-login-form').addEventListener('submit', handleBadgeLogin);
+    document.getElementById('login-use-pin').addEventListener('change', updatePasswordLabel);
+    document.getElementById('employee-search').addEventListener('input', handleEmployeeSearch);
+    document.getElementById('employee-more-btn').addEventListener('click', loadMoreEmployees);
     document.getElementById('cancel-event-btn').addEventListener('click', closeEventModal);
     eventForm.addEventListener('submit', handleSaveEvent);
     deleteEventBtn.addEventListener('click', handleDeleteEvent);
+    deleteOccurrenceBtn.addEventListener('click', handleDeleteOccurrence);
+    document.getElementById('event-repeat').addEventListener('change', updateRepeatUntilVisibility);
     
     document.getElementById('event-allday').addEventListener('change', (e) => {
         const isChecked = e.target.checked;
@@ -664,6 +941,8 @@ window.addEventListener('pywebviewready', () => {
         endInput.value = formatDateForInput(endDate, isChecked);
     });
 
+    reportPaintTiming();
+
     // 設定値を取得し、非アクティブ時間などを上書き
     if (window.pywebview && window.pywebview.api && window.pywebview.api.get_settings) {
         window.pywebview.api.get_settings().then(result => {
@@ -1,15 +1,13 @@
-import webview
+import startup  # 起動時間の計測の基準点にするため最初に import する
+import argparse
 import os
 import sys
 import threading
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask, send_from_directory
-from api import Api
-from database import initialize_database, data_dir
+# Flask・Api（werkzeug を含む）・各サブシステムの import は重いため、必要になる関数の中で行う
+from database import data_dir
 
-# pywebview の GUI バックエンドは環境により異なるため、
-# 明示指定が必要な場合のみ環境変数で指定可能にする（例: WEBVIEW_GUI=qt）
 logging.basicConfig(
     level=os.getenv('LOG_LEVEL', 'INFO').upper(),
     format='[%(asctime)s] %(levelname)s %(name)s: %(message)s'
@@ -25,9 +23,7 @@ try:
 except Exception:
     logging.getLogger(__name__).warning('Failed to initialize file logger')
 
-gui_backend = os.getenv('WEBVIEW_GUI')
-if gui_backend:
-    webview.gui = gui_backend
+startup.mark('imports')
 
 def resolve_path(path):
     """
@@ -42,45 +38,212 @@ def resolve_path(path):
         base_path = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_path, path)
 
-# --- Flaskサーバーの設定 ---
-# frontendフォルダへの絶対パスを解決
-frontend_dir = resolve_path('frontend')
-# Flaskに静的フォルダの場所を絶対パスで指定する
-server = Flask(__name__, static_folder=frontend_dir)
+# --host の既定。これ以外で待ち受ける場合は警告する
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+# GUI モードでウィンドウが画面を読み込むまでに、配信の開始を待つ最大時間
+SERVER_START_TIMEOUT_SECONDS = 10.0
 
-@server.route('/')
-def index():
-    # index.htmlを提供する
-    return send_from_directory(frontend_dir, 'index.html')
 
-@server.route('/<path:path>')
-def static_files(path):
-    # cssやjsファイルを提供する
-    return send_from_directory(frontend_dir, path)
+def create_server():
+    """Flaskサーバーと画面のファイルの配信を用意する。戻り値: (Flask アプリ, AssetStore)"""
+    from flask import Flask
+    from assets import AssetStore
 
-def run_server():
+    # frontendフォルダへの絶対パスを解決
+    frontend_dir = resolve_path('frontend')
+    # Flaskに静的フォルダの場所を絶対パスで指定する
+    server = Flask(__name__, static_folder=frontend_dir)
+
+    # 画面のファイルはメモリから返す（ハッシュ付きのパス・事前圧縮・キャッシュヘッダー。assets.py を参照）
+    asset_store = AssetStore(frontend_dir)
+
+    @server.route('/')
+    def index():
+        # index.htmlを提供する
+        return asset_store.response('index.html')
+
+    @server.route('/<path:path>')
+    def static_files(path):
+        # cssやjsファイルを提供する
+        return asset_store.response(path)
+
+    return server, asset_store
+
+
+def run_server(server, asset_store, host='127.0.0.1', port=5000, ready=None):
+    """server を配信する（戻らない）。待ち受けを始めたら ready（threading.Event）を立てる"""
+    import webserver
+
+    # 配信を始める前に frontend/ を読み込む（GUI モードでは pywebview の読み込みと並行して行われる）
+    asset_store.build()
+    startup.mark('assets_built')
     # ポートは任意
-    server.run(host='127.0.0.1', port=5000)
+    httpd = webserver.WSGIServer(server, host, port)
+    if ready is not None:
+        ready.set()
+    httpd.serve_forever()
+
+
+def run_gui_server(ready):
+    """GUI モードの画面を別スレッドで配信する（Flask の import もこのスレッドで行う）"""
+    try:
+        run_server(*create_server(), ready=ready)
+    finally:
+        # 起動に失敗した場合もウィンドウの表示を待たせない
+        ready.set()
+
+
+def run_server_mode(host, port):
+    """複数の打刻端末向けのサーバーモード（GUI なし）
+
+    各端末はブラウザで http://<host>:<port>/ を開き、セッショントークンごとに
+    独立したログイン状態で API を利用する。
+    """
+    from backup import BackupScheduler
+    from dispatcher import ApiExecutor
+    from metrics import MetricsDumper
+    from migrations import BackgroundMigrator
+    from server_api import register_api_routes
+    import punch_queue
+
+    server, asset_store = create_server()
+    executor = ApiExecutor()
+    register_api_routes(server, executor)
+    # 未適用のマイグレーションは受付と並行して小分けに適用する
+    migrator = BackgroundMigrator().start()
+    # BACKUP_INTERVAL_MINUTES が設定されていれば、稼働中に定期的にスナップショットを作る
+    backups = BackupScheduler().start()
+    dumper = MetricsDumper(os.path.join(data_dir, 'logs')).start()
+    logger = logging.getLogger(__name__)
+    logger.info(f"Server mode: listening on http://{host}:{port}/")
+    if host not in LOOPBACK_HOSTS:
+        # TLS もログイン試行の制限も無いため、信頼できるネットワークでのみ公開する
+        logger.warning(f"The API is served over plain HTTP on {host}; expose it only on a trusted network.")
+    try:
+        run_server(server, asset_store, host, port)
+    finally:
+        backups.stop()
+        migrator.stop()
+        executor.shutdown()
+        # 実行中の呼び出しが終わってから、キューに残った打刻を書き込む
+        punch_queue.stop()
+        dumper.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='従業員勤務管理アプリ')
+    parser.add_argument('--server', action='store_true', help='GUI を起動せず、複数端末向けのサーバーとして起動する')
+    parser.add_argument(
+        '--host', default=os.getenv('SERVER_HOST', '127.0.0.1'),
+        help='サーバーモードの待ち受けアドレス（既定はこのPCのみ。他の端末から使う場合は 0.0.0.0 などを明示する）'
+    )
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVER_PORT', '5000')), help='サーバーモードのポート')
+    parser.add_argument('--startup-report', action='store_true', help='起動の各段階の所要時間を logs/startup.json に出力する')
+    return parser.parse_args(argv)
 
 # --- メインの処理 ---
 if __name__ == '__main__':
-    initialize_database()
+    args = parse_args()
+    if args.startup_report:
+        startup.enable()
+    logs_dir = os.path.join(data_dir, 'logs')
 
-    api = Api()
+    if args.server:
+        import presence
+        import punch_queue
+        from database import initialize_database
+
+        # サーバーモードは受付開始前に DB を用意する（webview/Qt は読み込まない）
+        initialize_database()
+        # PUNCH_QUEUE_MODE が設定されていれば、前回のジャーナルを書き込んでから打刻キューを開始する
+        punch_queue.start()
+        # 在席状況のボードは各従業員の最新の打刻から1回だけ読み込み、以降は打刻ごとに更新する
+        presence.board.load()
+        startup.mark('database_ready')
+        startup.report(logs_dir)
+        run_server_mode(args.host, args.port)
+        sys.exit(0)
+
+    dumper = migrator = backups = pusher = None
 
-    # Flaskサーバーを別のスレッドで起動
-    t = threading.Thread(target=run_server)
+    # Flaskサーバーを別のスレッドで起動（Flask の import と画面のファイルの読み込みは pywebview の読み込みと並行する）
+    server_ready = threading.Event()
+    t = threading.Thread(target=run_gui_server, args=(server_ready,))
     t.daemon = True
     t.start()
 
+    # pywebview（GUI ツールキット）の読み込みは重いため、GUI モードでのみ行う
+    import webview
+    # pywebview の GUI バックエンドは環境により異なるため、
+    # 明示指定が必要な場合のみ環境変数で指定可能にする（例: WEBVIEW_GUI=qt）
+    gui_backend = os.getenv('WEBVIEW_GUI')
+    if gui_backend:
+        webview.gui = gui_backend
+    startup.mark('webview_imported')
+
+    from api import Api
+    from dispatcher import ApiDispatcher, ApiExecutor, check_js_api
+    import punch_queue
+
+    api = Api()
+    # ブリッジ呼び出しはスレッドプールで実行し、重い処理が軽い呼び出しを待たせないようにする。
+    # DB の初期化はウィンドウ表示後に行うため、それまでの呼び出しは待たせる
+    executor = ApiExecutor(ready=False)
+    js_api = ApiDispatcher(api, executor)
+    # pywebview が公開するメソッドと引数名を Api と突き合わせる（欠けていると画面の呼び出しが黙って失敗する）
+    check_js_api(js_api, api)
+
     # ウィンドウを作成し、FlaskサーバーのURLを指定
     window = webview.create_window(
         '従業員勤務管理アプリ',
         'http://127.0.0.1:5000', # FlaskサーバーのURL
-        js_api=api,
+        js_api=js_api,
         width=1000,
         height=750,
         resizable=True
     )
+    if startup.enabled:
+        window.events.loaded += lambda: startup.mark('window_loaded')
+
+    def finish_startup():
+        """ウィンドウの表示と並行して、DB の初期化など起動後の処理を行う"""
+        global dumper, migrator, backups, pusher
+        startup.mark('window_created')
+        from backup import BackupScheduler
+        from database import initialize_database
+        from metrics import MetricsDumper
+        from migrations import BackgroundMigrator
+        import presence
+
+        try:
+            initialize_database()
+            punch_queue.start()
+            presence.board.load()
+            startup.mark('database_ready')
+        finally:
+            # 初期化に失敗しても呼び出しを止めたままにはしない（エラーは各 API で返る）
+            executor.mark_ready()
+        # 未適用のマイグレーションは打刻を止めないよう、バックグラウンドで小分けに適用する
+        migrator = BackgroundMigrator().start()
+        backups = BackupScheduler().start()
+        # 在席状況が変わったら画面へ seq を通知する（画面は get_presence で差分だけを取得する）
+        pusher = presence.PresencePusher(
+            lambda seq: window.evaluate_js(f"window.onPresenceChanged && window.onPresenceChanged({seq})")
+        ).start()
+        # API/SQL の計測結果を定期的に logs ディレクトリへ出力する
+        dumper = MetricsDumper(logs_dir).start()
+        startup.report(logs_dir)
 
-    webview.start(debug=True)
+    # ウィンドウが画面を読み込む前に、Flaskサーバーの待ち受けを始めておく
+    server_ready.wait(SERVER_START_TIMEOUT_SECONDS)
+    webview.start(finish_startup, debug=True)
+    if pusher is not None:
+        pusher.stop()
+    if backups is not None:
+        backups.stop()
+    if migrator is not None:
+        migrator.stop()
+    executor.shutdown()
+    punch_queue.stop()
+    if dumper is not None:
+        dumper.stop()
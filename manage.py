@@ -0,0 +1,278 @@
+"""運用向けのコマンドラインツール
+
+    python manage.py rebuild-rollup [--employee ID ...]
+    python manage.py verify-rollup [--employee ID ...]
+    python manage.py import-attendance FILE [--format csv|jsonl] [--dry-run]
+    python manage.py export-attendance FILE [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    python manage.py export-summary FILE --start YYYY-MM-DD --end YYYY-MM-DD
+    python manage.py migrate [--status] [--target VERSION] [--chunk-size N]
+    python manage.py archive [--status] [--dry-run] [--keep-months N] [--before YYYY-MM] [--vacuum]
+    python manage.py backup [--list | --verify SNAPSHOT | --restore SNAPSHOT --to DIR] [--dir DIR] [--keep N]
+"""
+import argparse
+import logging
+import os
+import sys
+
+import archive
+import attendance
+import backup
+import bulk
+import migrations
+from database import get_db_connection, create_tables, schema_version
+
+logger = logging.getLogger(__name__)
+
+
+def cmd_rebuild_rollup(args):
+    conn = get_db_connection()
+    try:
+        since_day = archive.horizon_day(conn)
+        rows = attendance.rebuild_daily_totals(conn, args.employee, since_day)
+        conn.commit()
+        logger.info(f"Rebuilt daily_work_totals: {rows} rows")
+        mismatches = attendance.verify_daily_totals(conn, args.employee, since_day=since_day)
+    finally:
+        conn.close()
+    if mismatches:
+        logger.error(f"daily_work_totals still differs from raw records: {mismatches}")
+        return 1
+    logger.info("daily_work_totals matches raw attendance records.")
+    return 0
+
+
+def cmd_verify_rollup(args):
+    conn = get_db_connection()
+    try:
+        mismatches = attendance.verify_daily_totals(
+            conn, args.employee, limit=args.limit, since_day=archive.horizon_day(conn)
+        )
+    finally:
+        conn.close()
+    for employee_id, day, expected, actual in mismatches:
+        print(f"employee={employee_id} day={day} expected={expected} actual={actual}")
+    if mismatches:
+        logger.error(f"Found {len(mismatches)} mismatched rows (run rebuild-rollup to fix).")
+        return 1
+    logger.info("daily_work_totals matches raw attendance records.")
+    return 0
+
+
+def cmd_import_attendance(args):
+    conn = get_db_connection()
+    try:
+        result = bulk.import_punches(
+            conn, args.file, args.format, batch_size=args.batch_size,
+            defer_indexes=args.defer_indexes, dry_run=args.dry_run
+        )
+    finally:
+        conn.close()
+    for error in result['errors']:
+        print(error)
+    logger.info(
+        f"{'Validated' if args.dry_run else 'Imported'} {result['valid']} rows for {result['employees']} employees, "
+        f"{result['rejected']} rejected"
+    )
+    return 1 if result['rejected'] else 0
+
+
+def cmd_export_attendance(args):
+    conn = get_db_connection()
+    try:
+        count = bulk.export_records(conn, args.file, args.format, args.start, args.end, args.employee)
+    finally:
+        conn.close()
+    logger.info(f"Exported {count} attendance records to {args.file}")
+    return 0
+
+
+def cmd_export_summary(args):
+    conn = get_db_connection()
+    try:
+        count = bulk.export_summaries(conn, args.file, args.start, args.end, args.format, args.employee)
+    finally:
+        conn.close()
+    logger.info(f"Exported {count} daily summary rows to {args.file}")
+    return 0
+
+
+def cmd_migrate(args):
+    conn = get_db_connection()
+    try:
+        if args.status:
+            print(f"schema version: {schema_version(conn)} (latest {migrations.LATEST_VERSION})")
+            for m in migrations.status(conn):
+                progress = ''
+                if m['state'] == 'in_progress' and m['backfill_target']:
+                    progress = f" backfilled {m['backfill_position']}/{m['backfill_target']}"
+                print(f"{m['version']:>4} {m['name']:<32} {m['state']}{progress}")
+            return 0
+
+        def progress(migration, position, target):
+            percent = 100.0 if not target else position * 100 / target
+            print(f"\r{migration.version} {migration.name}: {position}/{target} ({percent:5.1f}%)", end='', flush=True)
+            if position >= target:
+                print()
+
+        applied = migrations.migrate(
+            conn, target=args.target, chunk_size=args.chunk_size, pause_seconds=args.pause_ms / 1000,
+            progress=progress
+        )
+    except KeyboardInterrupt:
+        print()
+        logger.warning("Migration interrupted; run migrate again to resume from the last completed chunk.")
+        return 1
+    finally:
+        conn.close()
+    logger.info(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+    return 0
+
+
+def cmd_archive(args):
+    conn = get_db_connection()
+    try:
+        if args.status:
+            for m in archive.archived_months(conn):
+                print(f"{m['month']} {m['records']:>10} records {m['rollup_rows']:>8} daily totals  "
+                      f"{archive.archive_path(m['year'])}  ({m['archived_at']})")
+            return 0
+        if args.dry_run:
+            for label, _, _, records in archive.plan(conn, args.keep_months, args.before):
+                print(f"{label} {records:>10} records")
+            return 0
+        results = archive.archive(conn, args.keep_months, args.before, args.chunk_size)
+        if results and args.vacuum:
+            logger.info("Vacuuming the live database...")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except (archive.ArchiveError, ValueError) as e:
+        logger.error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        logger.warning("Archiving interrupted; months already archived are kept, run archive again to continue.")
+        return 1
+    finally:
+        conn.close()
+    logger.info(f"Archived {len(results)} months." if results else "No closed months to archive.")
+    return 0
+
+
+def cmd_backup(args):
+    try:
+        if args.list:
+            for path, manifest in backup.list_snapshots(args.dir):
+                stored = sum(f['stored_bytes'] for f in manifest['files'])
+                print(f"{path}  {manifest['created_at']}  schema {manifest['schema_version']}  "
+                      f"{len(manifest['files'])} files  {stored / 1e6:.1f} MB  ({manifest['elapsed_seconds']:.1f}s)")
+            return 0
+        if args.verify:
+            manifest = backup.verify(args.verify)
+            logger.info(f"{args.verify}: {len(manifest['files'])} files verified.")
+            return 0
+        if args.restore:
+            if not args.to:
+                logger.error("--restore requires --to DIR")
+                return 1
+            for path in backup.restore(args.restore, args.to):
+                logger.info(f"Restored {path}")
+            logger.info("Stop the app and replace the files in the data directory with the restored ones.")
+            return 0
+
+        def progress(name, copied, total):
+            print(f"\r{name}: {copied}/{total} pages", end='', flush=True)
+            if copied >= total:
+                print()
+
+        path = backup.create_snapshot(
+            args.dir, compress=not args.no_compress, pages=args.pages, pause_seconds=args.pause_ms / 1000,
+            keep=args.keep, progress=progress
+        )
+    except backup.BackupError as e:
+        logger.error(str(e))
+        return 1
+    logger.info(f"Backup written to {path}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='勤務管理アプリの運用コマンド')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('rebuild-rollup', help='生の打刻から日別集計テーブルを再生成して検証する')
+    p.add_argument('--employee', type=int, action='append', help='対象の従業員ID（複数指定可、省略時は全員）')
+    p.set_defaults(func=cmd_rebuild_rollup)
+
+    p = sub.add_parser('verify-rollup', help='日別集計テーブルと生の打刻の整合性を検証する')
+    p.add_argument('--employee', type=int, action='append', help='対象の従業員ID（複数指定可、省略時は全員）')
+    p.add_argument('--limit', type=int, default=50, help='表示する不一致の最大件数')
+    p.set_defaults(func=cmd_verify_rollup)
+
+    p = sub.add_parser('import-attendance', help='CSV / JSON Lines の打刻を検証して一括登録する')
+    p.add_argument('file')
+    p.add_argument('--format', choices=('csv', 'jsonl'), help='省略時は拡張子から判定')
+    p.add_argument('--batch-size', type=int, default=bulk.DEFAULT_BATCH_SIZE)
+    p.add_argument('--defer-indexes', action=argparse.BooleanOptionalAction, default=None,
+                   help='登録中はインデックスを外し最後に作り直す（省略時は取り込み量から自動判定）')
+    p.add_argument('--dry-run', action='store_true', help='検証のみ行い登録しない')
+    p.set_defaults(func=cmd_import_attendance)
+
+    p = sub.add_parser('export-attendance', help='打刻データを書き出す')
+    p.add_argument('file')
+    p.add_argument('--format', choices=('csv', 'jsonl'))
+    p.add_argument('--start', help='開始日 YYYY-MM-DD')
+    p.add_argument('--end', help='終了日 YYYY-MM-DD（当日を含む）')
+    p.add_argument('--employee', type=int, action='append')
+    p.set_defaults(func=cmd_export_attendance)
+
+    p = sub.add_parser('export-summary', help='日別の勤務時間・概算給与を書き出す')
+    p.add_argument('file')
+    p.add_argument('--format', choices=('csv', 'jsonl'))
+    p.add_argument('--start', required=True, help='開始日 YYYY-MM-DD')
+    p.add_argument('--end', required=True, help='終了日 YYYY-MM-DD（当日を含む）')
+    p.add_argument('--employee', type=int, action='append')
+    p.set_defaults(func=cmd_export_summary)
+
+    p = sub.add_parser('migrate', help='未適用のスキーマ変更を適用する（中断しても途中から再開できる）')
+    p.add_argument('--status', action='store_true', help='適用状況を表示するだけで変更しない')
+    p.add_argument('--target', type=int, help='このバージョンまで適用する（省略時は最新）')
+    p.add_argument('--chunk-size', type=int, default=migrations.CHUNK_SIZE, help='バックフィルの1トランザクションあたりの行数')
+    p.add_argument('--pause-ms', type=int, default=int(migrations.CHUNK_PAUSE_SECONDS * 1000),
+                   help='チャンクの間に他の書き込みへ譲る時間（ミリ秒）')
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser('archive', help='締めた月の打刻を年別のアーカイブ DB へ移す')
+    p.add_argument('--status', action='store_true', help='アーカイブ済みの月を表示するだけで変更しない')
+    p.add_argument('--dry-run', action='store_true', help='アーカイブする月と打刻数を表示するだけで変更しない')
+    p.add_argument('--keep-months', type=int, default=archive.KEEP_MONTHS, help='ライブの DB に残す月数（当月を除く）')
+    p.add_argument('--before', help='この月（YYYY-MM）より前だけを対象にする')
+    p.add_argument('--chunk-size', type=int, default=archive.CHUNK_SIZE, help='コピーの1トランザクションあたりの行数')
+    p.add_argument('--vacuum', action='store_true', help='移した後にライブの DB を VACUUM する')
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser('backup', help='稼働中でも安全に DB のスナップショット（gzip 圧縮）を作る')
+    p.add_argument('--dir', help='スナップショットの保存先（省略時は BACKUP_DIR またはデータディレクトリの backups）')
+    p.add_argument('--list', action='store_true', help='保存済みのスナップショットを表示する')
+    p.add_argument('--verify', metavar='SNAPSHOT', help='スナップショットを展開してチェックサムと整合性を確認する')
+    p.add_argument('--restore', metavar='SNAPSHOT', help='スナップショットを --to のディレクトリへ展開する')
+    p.add_argument('--to', help='--restore の展開先ディレクトリ')
+    p.add_argument('--keep', type=int, default=backup.KEEP, help='残すスナップショットの数')
+    p.add_argument('--no-compress', action='store_true', help='圧縮せずに保存する')
+    p.add_argument('--pages', type=int, default=backup.PAGES_PER_STEP, help='1ステップで写すページ数')
+    p.add_argument('--pause-ms', type=int, default=int(backup.STEP_PAUSE_SECONDS * 1000),
+                   help='ステップの間に打刻などの書き込みへ譲る時間（ミリ秒）')
+    p.set_defaults(func=cmd_backup)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='[%(asctime)s] %(levelname)s %(name)s: %(message)s'
+    )
+    args = build_parser().parse_args(argv)
+    create_tables()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""API メソッドと SQL の計測（呼び出し回数・レイテンシのヒストグラム）とプロファイリング
+
+- `@instrument` を付けたクラスの公開メソッドは、呼び出し回数・失敗/例外の数・
+  レイテンシのヒストグラム（p50/p95/p99）を registry に記録する。
+- `TimedConnection` を sqlite3.connect(factory=...) に渡すと、execute / executemany に
+  かかった時間を正規化した SQL 文ごとに記録する。SELECT は最初の行を返すまでの時間で、
+  以降の fetch の時間は呼び出し元の API メソッドに含まれる。
+- 環境変数 API_PROFILE=cprofile で API 呼び出しごとに cProfile を有効にし、
+  API_PROFILE=sample でスタックのサンプリングを行う。結果は dump() でログディレクトリに出力する。
+"""
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケット上限（ミリ秒）。おおよそ 1.5 倍刻み
+BUCKET_BOUNDS_MS = (
+    0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75,
+    100, 150, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000,
+)
+# 集計する SQL 文の種類の上限（超えた分は '<other>' にまとめる）
+MAX_SQL_STATEMENTS = 500
+SQL_KEY_LENGTH = 160
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Histogram:
+    """固定バケットのレイテンシヒストグラム（パーセンタイルはバケット内で線形補間）"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS_MS[i - 1] if i else 0.0
+                upper = BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 3) if self.count else 0,
+            'p50_ms': round(self.percentile(50), 3),
+            'p95_ms': round(self.percentile(95), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'max_ms': round(self.max, 3),
+        }
+
+
+class MetricsRegistry:
+    """メソッド別・SQL 文別のヒストグラムを保持する（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._methods = {}
+        self._outcomes = Counter()
+        self._sql = {}
+        self._queues = {}
+        self._profile_stats = None
+        self._samples = Counter()
+
+    def record_call(self, name, ms, outcome=None):
+        """outcome: None（成功）/ 'failed'（success=False を返した）/ 'error'（例外）"""
+        with self._lock:
+            hist = self._methods.get(name)
+            if hist is None:
+                hist = self._methods[name] = Histogram()
+            hist.record(ms)
+            if outcome:
+                self._outcomes[name, outcome] += 1
+
+    def record_queue_wait(self, lane, ms):
+        """ディスパッチャの executor で実行開始まで待った時間"""
+        with self._lock:
+            hist = self._queues.get(lane)
+            if hist is None:
+                hist = self._queues[lane] = Histogram()
+            hist.record(ms)
+
+    def record_sql(self, sql, ms):
+        key = _WHITESPACE.sub(' ', sql).strip()[:SQL_KEY_LENGTH]
+        with self._lock:
+            hist = self._sql.get(key)
+            if hist is None:
+                if len(self._sql) >= MAX_SQL_STATEMENTS:
+                    key = '<other>'
+                    hist = self._sql.get(key)
+                if hist is None:
+                    hist = self._sql[key] = Histogram()
+            hist.record(ms)
+
+    def add_profile(self, profiler):
+        stats = pstats.Stats(profiler)
+        with self._lock:
+            if self._profile_stats is None:
+                self._profile_stats = stats
+            else:
+                self._profile_stats.add(stats)
+
+    def add_sample(self, stack):
+        with self._lock:
+            self._samples[stack] += 1
+
+    def snapshot(self, top_sql=20):
+        """現在の集計を dict で返す。SQL は合計時間の長い順に top_sql 件"""
+        with self._lock:
+            methods = {
+                name: {
+                    **hist.as_dict(),
+                    'failed': self._outcomes.get((name, 'failed'), 0),
+                    'errors': self._outcomes.get((name, 'error'), 0),
+                }
+                for name, hist in sorted(self._methods.items())
+            }
+            queues = {lane: hist.as_dict() for lane, hist in sorted(self._queues.items())}
+            sql = sorted(self._sql.items(), key=lambda item: item[1].total, reverse=True)[:top_sql]
+            sql = [{'sql': key, **hist.as_dict(), 'total_ms': round(hist.total, 3)} for key, hist in sql]
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'profile_mode': PROFILE_MODE or None,
+            'methods': methods,
+            'queue_wait': queues,
+            'sql': sql,
+        }
+
+    def profile_report(self, limit=40):
+        """cProfile の累積結果（cumulative 順）とサンプリング結果（collapsed stack 形式）を文字列で返す"""
+        with self._lock:
+            stats = self._profile_stats
+            samples = self._samples.most_common()
+        parts = []
+        if stats is not None:
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats('cumulative').print_stats(limit)
+            parts.append(out.getvalue())
+        if samples:
+            parts.append('\n'.join(f'{stack} {count}' for stack, count in samples))
+        return '\n'.join(parts)
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._methods.clear()
+            self._outcomes.clear()
+            self._sql.clear()
+            self._queues.clear()
+            self._profile_stats = None
+            self._samples.clear()
+
+
+registry = MetricsRegistry()
+
+# '', 'cprofile', 'sample'
+PROFILE_MODE = os.getenv('API_PROFILE', '').strip().lower()
+if PROFILE_MODE not in ('', 'cprofile', 'sample'):
+    logger.warning(f"Unknown API_PROFILE={PROFILE_MODE!r}; profiling disabled")
+    PROFILE_MODE = ''
+SQL_TIMING_ENABLED = os.getenv('METRICS_SQL_TIMING', '1') != '0'
+
+_local = threading.local()
+# API_PROFILE=sample のとき、計測対象のメソッドを実行中のスレッド
+_active_threads = set()
+
+
+def _timed(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # 入れ子の呼び出し（Api メソッドから別の Api メソッド）は外側だけでプロファイルする
+        depth = getattr(_local, 'depth', 0)
+        profiler = cProfile.Profile() if PROFILE_MODE == 'cprofile' and depth == 0 else None
+        _local.depth = depth + 1
+        sampled = PROFILE_MODE == 'sample' and depth == 0
+        if sampled:
+            _active_threads.add(threading.get_ident())
+        outcome = 'error'
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            result = func(*args, **kwargs)
+            outcome = 'failed' if isinstance(result, dict) and result.get('success') is False else None
+            return result
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _local.depth = depth
+            if sampled:
+                _active_threads.discard(threading.get_ident())
+            registry.record_call(name, elapsed_ms, outcome)
+            if profiler is not None:
+                registry.add_profile(profiler)
+    return wrapper
+
+
+def instrument(cls):
+    """クラスの公開メソッドをすべて計測するクラスデコレータ"""
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(func):
+            continue
+        setattr(cls, name, _timed(name, func))
+    return cls
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            registry.record_sql(sql, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            registry.record_sql(sql, (time.perf_counter() - started) * 1000)
+
+
+class TimedConnection(sqlite3.Connection):
+    """execute / executemany の所要時間を registry に記録する接続クラス"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            registry.record_sql(sql, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            registry.record_sql(sql, (time.perf_counter() - started) * 1000)
+
+
+def connection_factory():
+    """sqlite3.connect に渡す接続クラス（SQL 計測が無効なら標準の Connection）"""
+    return TimedConnection if SQL_TIMING_ENABLED else sqlite3.Connection
+
+
+def _collapse(frame, limit=64):
+    names = []
+    while frame is not None and len(names) < limit:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """計測対象のメソッドを実行中のスレッドのスタックを定期的に採取する"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            active = set(_active_threads)
+            for ident, frame in sys._current_frames().items():
+                if ident in active:
+                    registry.add_sample(_collapse(frame))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def dump(directory):
+    """集計を directory/metrics-YYYY-MM-DD.jsonl に1行追記し、プロファイル結果があれば上書き保存する"""
+    os.makedirs(directory, exist_ok=True)
+    snapshot = registry.snapshot()
+    snapshot['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    path = os.path.join(directory, f"metrics-{time.strftime('%Y-%m-%d')}.jsonl")
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(snapshot, ensure_ascii=False))
+        f.write('\n')
+    report = registry.profile_report()
+    if report:
+        with open(os.path.join(directory, f'profile-{PROFILE_MODE}.txt'), 'w', encoding='utf-8') as f:
+            f.write(report)
+    return path
+
+
+class MetricsDumper:
+    """interval_seconds ごとに dump() するバックグラウンドスレッド（停止時にも1回出力する）"""
+
+    def __init__(self, directory, interval_seconds=None):
+        self.directory = directory
+        if interval_seconds is None:
+            try:
+                interval_seconds = int(os.getenv('METRICS_DUMP_INTERVAL_SECONDS', '300'))
+            except ValueError:
+                interval_seconds = 300
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self._sampler = StackSampler() if PROFILE_MODE == 'sample' else None
+
+    def start(self):
+        if self._sampler is not None:
+            self._sampler.start()
+        if self.interval_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name='metrics-dumper', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._dump()
+
+    def _dump(self):
+        try:
+            dump(self.directory)
+        except Exception as e:
+            logger.warning(f"Failed to dump metrics: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self._dump()
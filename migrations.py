@@ -0,0 +1,350 @@
+"""スキーマのマイグレーション（PRAGMA user_version）
+
+database.create_tables が作る基本スキーマ（バージョン 1）より後の変更を、
+バージョン番号の順に適用する。各マイグレーションは次の2段階で行う。
+
+- schema: 列・トリガー・インデックスの追加などの短い DDL。何度実行しても
+  同じ結果になるように書く（中断後の再実行に備える）。
+- backfill: 既存行の書き換え。id の範囲ごとの短い書き込みトランザクションに
+  分けて行い、打刻などの通常の書き込みを長く待たせない。進んだ位置は
+  schema_migrations に記録し、中断してもその位置から再開する。
+
+user_version はバックフィルまで完了してから上げる。アプリのコードは
+user_version を見て新しい列を使うかどうかを判断する。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import archive
+import attendance
+import auth
+import database
+import directory
+import scheduling
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# バックフィルの1トランザクションあたりの行数（id の範囲）
+CHUNK_SIZE = max(1, _env_int('MIGRATION_CHUNK_SIZE', 5000))
+# チャンクの間に他の書き込みへ譲る時間
+CHUNK_PAUSE_SECONDS = max(0, _env_int('MIGRATION_PAUSE_MS', 5)) / 1000
+# 進捗ログの最小間隔
+PROGRESS_LOG_SECONDS = 5.0
+
+# backfill: table の id が (lo, hi] の行を書き換える UPDATE 文（パラメータは lo, hi）
+Backfill = namedtuple('Backfill', ['table', 'sql'])
+# schema: カーソルを受け取り DDL を実行する関数
+Migration = namedtuple('Migration', ['version', 'name', 'schema', 'backfill'])
+
+
+def _add_attendance_epoch(cursor):
+    database._ensure_column(cursor, 'attendance_records', 'ts_epoch', 'INTEGER')
+    # アプリはバージョン 2 以降、ts_epoch も渡して打刻を登録する（attendance.insert_punch）。
+    # トリガーはバックフィル中の打刻と、値を渡さない古い呼び出し元・打刻の修正の分を埋める
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_records_epoch_insert
+        AFTER INSERT ON attendance_records WHEN NEW.ts_epoch IS NULL
+        BEGIN
+            UPDATE attendance_records SET ts_epoch = CAST(strftime('%s', NEW.timestamp) AS INTEGER) WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_records_epoch_update
+        AFTER UPDATE OF timestamp ON attendance_records
+        BEGIN
+            UPDATE attendance_records SET ts_epoch = CAST(strftime('%s', NEW.timestamp) AS INTEGER) WHERE id = NEW.id;
+        END
+    """)
+    # 列がまだ NULL のうちに作ると、構築は表の走査だけで済み、以降はバックフィルの各チャンクで更新される
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_attendance_employee_epoch ON attendance_records(employee_id, ts_epoch)"
+    )
+
+
+def _add_quick_login(cursor):
+    database._ensure_column(cursor, 'employees', 'pin_hash', 'TEXT')
+    database._ensure_column(cursor, 'employees', 'badge_digest', 'TEXT')
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_employees_badge ON employees(badge_digest) WHERE badge_digest IS NOT NULL"
+    )
+
+
+def _add_employee_directory(cursor):
+    # 一覧に表示する項目が変わるたびに上がるバージョン（画面側の再取得の判定に使う）
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS change_counters (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+    )
+    cursor.execute("INSERT OR IGNORE INTO change_counters (name, version) VALUES ('employees', 0)")
+    bump = "BEGIN UPDATE change_counters SET version = version + 1 WHERE name = 'employees'; END"
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS employees_version_insert AFTER INSERT ON employees {bump}")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS employees_version_delete AFTER DELETE ON employees {bump}")
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS employees_version_update AFTER UPDATE OF name, hourly_wage, is_admin ON employees {bump}"
+    )
+    try:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS employees_fts "
+            "USING fts5(name, content='employees', content_rowid='id', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError as e:
+        # FTS5（trigram）の無い SQLite では LIKE による検索のみ
+        logger.warning(f"FTS5 trigram is not available; employee search falls back to LIKE: {e}")
+        return
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_fts_insert AFTER INSERT ON employees BEGIN
+            INSERT INTO employees_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_fts_delete AFTER DELETE ON employees BEGIN
+            INSERT INTO employees_fts (employees_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS employees_fts_update AFTER UPDATE OF name ON employees BEGIN
+            INSERT INTO employees_fts (employees_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO employees_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    """)
+    # 従業員数は多くても数千件のため、索引の構築はこのトランザクション内で行う
+    cursor.execute("INSERT INTO employees_fts (employees_fts) VALUES ('rebuild')")
+
+
+def _add_archive_registry(cursor):
+    # archive.py がアーカイブへ移した月。end_epoch の最大値より前の打刻はアーカイブにある
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archive_months (
+            month TEXT PRIMARY KEY,
+            year INTEGER NOT NULL,
+            start_epoch INTEGER NOT NULL,
+            end_epoch INTEGER NOT NULL,
+            records INTEGER NOT NULL,
+            rollup_rows INTEGER NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    """)
+
+
+def _add_shift_assignments(cursor):
+    # event_id はシフトの元になったカレンダーのイベント（イベントを削除してもシフトは残す）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS shift_assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id INTEGER NOT NULL,
+            event_id INTEGER,
+            start_epoch INTEGER NOT NULL,
+            end_epoch INTEGER NOT NULL CHECK (end_epoch > start_epoch),
+            FOREIGN KEY (employee_id) REFERENCES employees (id) ON DELETE CASCADE,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE SET NULL
+        )
+    """)
+    # 差異レポート・一覧は従業員ごとに開始の範囲で読み、並べ替えを省く。同じ従業員・開始のシフトは1件
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_shift_assignments_employee_start "
+        "ON shift_assignments(employee_id, start_epoch)"
+    )
+    # イベントの割り当て直し（と events の削除時の SET NULL）用
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_shift_assignments_event "
+        "ON shift_assignments(event_id, start_epoch) WHERE event_id IS NOT NULL"
+    )
+
+
+MIGRATIONS = (
+    Migration(
+        attendance.TS_EPOCH_SCHEMA_VERSION,
+        'attendance_records.ts_epoch',
+        _add_attendance_epoch,
+        Backfill(
+            'attendance_records',
+            "UPDATE attendance_records SET ts_epoch = CAST(strftime('%s', timestamp) AS INTEGER) "
+            "WHERE id > ? AND id <= ? AND ts_epoch IS NULL",
+        ),
+    ),
+    Migration(auth.QUICK_LOGIN_SCHEMA_VERSION, 'employees.pin_hash / badge_digest', _add_quick_login, None),
+    Migration(directory.DIRECTORY_SCHEMA_VERSION, 'employee directory search / version', _add_employee_directory, None),
+    Migration(archive.ARCHIVE_SCHEMA_VERSION, 'attendance archive registry', _add_archive_registry, None),
+    Migration(scheduling.SCHEDULING_SCHEMA_VERSION, 'shift assignments', _add_shift_assignments, None),
+)
+
+LATEST_VERSION = max([database.SCHEMA_VERSION, *(m.version for m in MIGRATIONS)])
+
+
+class MigrationInterrupted(Exception):
+    """stop_event によりバックフィルを途中で止めた（次回はその位置から再開する）"""
+
+
+def _ensure_progress_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            completed_at TEXT,
+            backfill_position INTEGER NOT NULL DEFAULT 0,
+            backfill_target INTEGER
+        )
+    """)
+
+
+def pending(conn, target=None):
+    """未適用のマイグレーションをバージョン順に返す"""
+    current = database.schema_version(conn)
+    target = LATEST_VERSION if target is None else target
+    return [m for m in MIGRATIONS if current < m.version <= target]
+
+
+def status(conn):
+    """各マイグレーションの状態を dict のリストで返す"""
+    current = database.schema_version(conn)
+    recorded = {}
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_migrations'").fetchone():
+        recorded = {row[0]: row for row in conn.execute(
+            "SELECT version, started_at, completed_at, backfill_position, backfill_target FROM schema_migrations"
+        )}
+    result = []
+    for m in MIGRATIONS:
+        row = recorded.get(m.version)
+        if m.version <= current:
+            state = 'applied'
+        elif row:
+            state = 'in_progress'
+        else:
+            state = 'pending'
+        result.append({
+            'version': m.version,
+            'name': m.name,
+            'state': state,
+            'started_at': row[1] if row else None,
+            'completed_at': row[2] if row else None,
+            'backfill_position': row[3] if row else None,
+            'backfill_target': row[4] if row else None,
+        })
+    return result
+
+
+def _log_progress(migration, done, total):
+    percent = 100.0 if not total else done * 100 / total
+    logger.info(f"Migration {migration.version} ({migration.name}): backfilled up to id {done}/{total} ({percent:.1f}%)")
+
+
+def _apply_schema(conn, migration):
+    """DDL を実行し、バックフィルの対象範囲（開始時点の最大 id）を記録する。(位置, 目標) を返す"""
+    with database.write_transaction(conn):
+        migration.schema(conn.cursor())
+        _ensure_progress_table(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_migrations (version, name, started_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (migration.version, migration.name)
+        )
+        position, target = conn.execute(
+            "SELECT backfill_position, backfill_target FROM schema_migrations WHERE version = ?",
+            (migration.version,)
+        ).fetchone()
+        if target is None:
+            # これより後に追加される行はトリガーが埋めるため、開始時点の行だけを対象にする
+            target = 0
+            if migration.backfill:
+                target = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {migration.backfill.table}").fetchone()[0]
+            conn.execute(
+                "UPDATE schema_migrations SET backfill_target = ? WHERE version = ?", (target, migration.version)
+            )
+    return position, target
+
+
+def _run_backfill(conn, migration, position, target, chunk_size, pause_seconds, progress, stop_event):
+    last_log = time.monotonic()
+    while position < target:
+        if stop_event is not None and stop_event.is_set():
+            raise MigrationInterrupted(f"Migration {migration.version} stopped at id {position}/{target}")
+        upper = min(position + chunk_size, target)
+        with database.write_transaction(conn):
+            conn.execute(migration.backfill.sql, (position, upper))
+            conn.execute(
+                "UPDATE schema_migrations SET backfill_position = ? WHERE version = ?", (upper, migration.version)
+            )
+        position = upper
+        if progress is not None:
+            progress(migration, position, target)
+        elif time.monotonic() - last_log >= PROGRESS_LOG_SECONDS:
+            _log_progress(migration, position, target)
+            last_log = time.monotonic()
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+
+def migrate(conn, target=None, chunk_size=None, pause_seconds=None, progress=None, stop_event=None):
+    """未適用のマイグレーションを順に適用し、適用したバージョンのリストを返す
+
+    progress(migration, position, target) はバックフィルのチャンクごとに呼ばれる。
+    stop_event がセットされるとチャンクの境目で MigrationInterrupted を送出する。
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    pause_seconds = CHUNK_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+    applied = []
+    for migration in pending(conn, target):
+        started = time.perf_counter()
+        logger.info(f"Applying migration {migration.version} ({migration.name})")
+        position, backfill_target = _apply_schema(conn, migration)
+        if migration.backfill:
+            _run_backfill(conn, migration, position, backfill_target, chunk_size, pause_seconds, progress, stop_event)
+        with database.write_transaction(conn):
+            conn.execute(
+                "UPDATE schema_migrations SET completed_at = CURRENT_TIMESTAMP WHERE version = ?", (migration.version,)
+            )
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+        applied.append(migration.version)
+        logger.info(
+            f"Migration {migration.version} ({migration.name}) completed in {time.perf_counter() - started:.1f}s"
+        )
+    return applied
+
+
+class BackgroundMigrator:
+    """アプリの起動後、未適用のマイグレーションを別スレッドで適用する
+
+    終了時に stop() を呼ぶと、実行中のチャンクの後で止まる（次回の起動で再開する）。
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        conn = database.get_db_connection()
+        try:
+            if not pending(conn):
+                return self
+        finally:
+            conn.close()
+        self._thread = threading.Thread(target=self._run, name='migrations', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        conn = database.get_db_connection()
+        try:
+            migrate(conn, stop_event=self._stop)
+        except MigrationInterrupted as e:
+            logger.info(f"{e}; it will resume on next start.")
+        except Exception as e:
+            logger.error(f"Migration failed: {e}")
+        finally:
+            conn.close()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
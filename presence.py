@@ -0,0 +1,238 @@
+"""在席状況（誰が勤務中・休憩中か）のプロセス内ボードと変更の通知
+
+全従業員の現在の状態を起動時に employee_state（従業員ごとの最新の打刻）から1回だけ読み込み、
+以降は打刻のたびに record_attendance / 打刻キューがボードを更新する。
+更新には連番（seq）を振って直近 PRESENCE_LOG_SIZE 件を変更ログに残すため、
+画面は前回の seq 以降の変更だけを受け取ればよく、更新の手間は従業員数ではなく変更の件数に比例する。
+
+変更の通知は、GUI モードでは PresencePusher が window.evaluate_js で seq を送り、
+サーバーモードでは /presence/stream（server-sent events）が変更そのものを送る。
+ボードが反映するのはこのプロセスでの打刻だけで、他のプロセスが同じ DB に書き込んだ打刻は
+refresh() で読み直すまで反映されない。
+"""
+import itertools
+import logging
+import os
+import threading
+from collections import deque
+
+import database
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# 変更ログに残す件数（これより古い seq からの差分要求には全件を返す）
+LOG_SIZE = max(1, _env_int('PRESENCE_LOG_SIZE', 1000))
+# 通知をまとめる間隔（出勤が集中しても画面への通知はこの間隔に1回）
+PUSH_INTERVAL_SECONDS = max(0, _env_int('PRESENCE_PUSH_INTERVAL_MS', 200)) / 1000
+
+# 状態（最後の打刻種別）→ 在席の区分
+WORKING_STATES = ('clock_in', 'end_break')
+BREAK_STATES = ('start_break',)
+
+_LOAD_QUERY = (
+    "SELECT e.id, e.name, s.state, s.last_timestamp FROM employees e "
+    "LEFT JOIN employee_state s ON s.employee_id = e.id ORDER BY e.id"
+)
+
+
+def status_of(state):
+    """打刻の状態を 'working' / 'on_break' / 'off' に分類する"""
+    if state in WORKING_STATES:
+        return 'working'
+    if state in BREAK_STATES:
+        return 'on_break'
+    return 'off'
+
+
+def _entry(employee_id, name, state, since):
+    return {'employee_id': employee_id, 'name': name, 'status': status_of(state), 'state': state, 'since': since}
+
+
+class PresenceBoard:
+    """全従業員の在席状況と、seq 付きの変更ログ
+
+    読み込み前（load() 前）の update() は無視する。読み込みは DB の現在の状態から行うため、
+    それ以前の打刻も含まれる。
+    """
+
+    def __init__(self, log_size=None):
+        self.log_size = log_size or LOG_SIZE
+        self._entries = {}
+        self._counts = {'working': 0, 'on_break': 0, 'off': 0}
+        self._log = deque(maxlen=self.log_size)
+        self._seq = 0
+        self._loaded = False
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def load(self, conn=None):
+        """employee_state から全従業員の状態を読み込む。戻り値: 読み込んだ人数"""
+        # 読み込み中の update() を待たせ、読み込みより古い状態で上書きしないようにする
+        with self._cond:
+            if conn is None:
+                with database.db_connection() as conn:
+                    rows = conn.execute(_LOAD_QUERY).fetchall()
+            else:
+                rows = conn.execute(_LOAD_QUERY).fetchall()
+            self._entries = {row[0]: _entry(*row) for row in rows}
+            self._counts = {'working': 0, 'on_break': 0, 'off': 0}
+            for entry in self._entries.values():
+                self._counts[entry['status']] += 1
+            # 画面側が持っている差分は使えないため、ログを空にして seq を進める
+            self._log.clear()
+            self._seq += 1
+            self._loaded = True
+            self._cond.notify_all()
+        logger.info(f"Presence board loaded: {len(rows)} employees")
+        return len(rows)
+
+    def reset(self):
+        """DB の切り替え時に破棄する（次の snapshot() で読み直す）"""
+        with self._cond:
+            self._entries = {}
+            self._counts = {'working': 0, 'on_break': 0, 'off': 0}
+            self._log.clear()
+            self._loaded = False
+            self._seq += 1
+            self._cond.notify_all()
+
+    def _record(self, change):
+        self._seq += 1
+        self._log.append((self._seq, change))
+        self._cond.notify_all()
+
+    def update(self, employee_id, state, since, name=None):
+        """打刻の結果を反映する（name は新しい従業員の場合のみ必要）"""
+        with self._cond:
+            if not self._loaded:
+                return
+            previous = self._entries.get(employee_id)
+            if previous is None:
+                if name is None:
+                    # 読み込み後に他のプロセスで追加された従業員。名前は次の refresh() で補う
+                    name = ''
+            else:
+                if previous['state'] == state and previous['since'] == since:
+                    return
+                self._counts[previous['status']] -= 1
+                name = previous['name'] if name is None else name
+            entry = _entry(employee_id, name, state, since)
+            self._entries[employee_id] = entry
+            self._counts[entry['status']] += 1
+            self._record(entry)
+
+    def remove(self, employee_id):
+        with self._cond:
+            previous = self._entries.pop(employee_id, None)
+            if previous is None:
+                return
+            self._counts[previous['status']] -= 1
+            self._record({'employee_id': employee_id, 'removed': True})
+
+    def refresh(self, employee_ids=None):
+        """DB から読み直す（employee_ids を指定した場合はその従業員だけ）"""
+        if employee_ids is None:
+            return self.load()
+        ids = sorted(set(employee_ids))
+        if not ids or not self._loaded:
+            return 0
+        placeholders = ','.join('?' * len(ids))
+        with database.db_connection() as conn:
+            rows = conn.execute(
+                f"SELECT e.id, e.name, s.state, s.last_timestamp FROM employees e "
+                f"LEFT JOIN employee_state s ON s.employee_id = e.id WHERE e.id IN ({placeholders})", ids
+            ).fetchall()
+        found = set()
+        for employee_id, name, state, since in rows:
+            found.add(employee_id)
+            self.update(employee_id, state, since, name=name)
+        for employee_id in set(ids) - found:
+            self.remove(employee_id)
+        return len(rows)
+
+    def snapshot(self):
+        """全従業員の状態。戻り値: (seq, エントリのリスト, 区分ごとの人数)"""
+        if not self._loaded:
+            self.load()
+        with self._cond:
+            return self._seq, list(self._entries.values()), dict(self._counts)
+
+    def changes_since(self, seq):
+        """seq より後の変更。戻り値: (現在の seq, 変更のリスト, 区分ごとの人数)
+
+        seq が変更ログより古い（または別の読み込みの seq）場合は変更のリストの代わりに None を返す。
+        """
+        with self._cond:
+            if not self._loaded:
+                return self._seq, None, dict(self._counts)
+            if seq == self._seq:
+                return seq, [], dict(self._counts)
+            if seq > self._seq or not self._log or self._log[0][0] > seq + 1:
+                return self._seq, None, dict(self._counts)
+            # ログの seq は連番のため、先頭からの位置で開始位置が分かる
+            start = seq + 1 - self._log[0][0]
+            # 同じ従業員の変更は最後の1件だけを返す
+            latest = {}
+            for _, change in itertools.islice(self._log, start, None):
+                latest[change['employee_id']] = change
+            return self._seq, list(latest.values()), dict(self._counts)
+
+    def wait(self, seq, timeout=None):
+        """seq より新しい変更があるか timeout 秒が経つまで待つ。戻り値: 現在の seq"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != seq, timeout)
+            return self._seq
+
+
+board = PresenceBoard()
+
+
+class PresencePusher:
+    """変更があるたびに push(seq) を呼ぶスレッド（GUI モードで window.evaluate_js に渡す）
+
+    出勤が集中しても、通知は PRESENCE_PUSH_INTERVAL_MS に1回にまとめる。
+    """
+
+    def __init__(self, push, presence_board=None, interval_seconds=None):
+        self.push = push
+        self.board = presence_board or board
+        self.interval_seconds = PUSH_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='presence-pusher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        seq = self.board.seq
+        while not self._stop.is_set():
+            current = self.board.wait(seq, timeout=1.0)
+            if current == seq or self._stop.is_set():
+                continue
+            seq = current
+            try:
+                self.push(seq)
+            except Exception as e:
+                logger.debug(f"Failed to push presence change: {e}")
+            self._stop.wait(self.interval_seconds)
+
+
+database.register_reset_hook(board.reset)
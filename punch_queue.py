@@ -0,0 +1,373 @@
+"""打刻のまとめ書き（グループコミット）
+
+出勤が集中する時間帯は、打刻1件ごとのコミット（WAL の fsync）が直列に並ぶ。
+PUNCH_QUEUE_MODE を設定すると、打刻はメモリ上の状態で検証してキューに積み、
+PUNCH_QUEUE_FLUSH_MS ごと（または PUNCH_QUEUE_MAX_BATCH 件たまった時点）に
+1つのトランザクションでまとめて書き込む。
+
+応答（ack）を返す時点と、その時点で保証される耐久性はモードで異なる。
+
+- off（既定）: キューを使わない。1件ごとにコミットしてから応答する。
+- commit: 打刻を含むグループがコミットされてから応答する。耐久性は off と同じで、
+  応答は最大でフラッシュ間隔だけ遅れる。同時に待てる件数は API のスレッド数まで。
+- journal: ジャーナルファイル（DB と同じディレクトリ）に追記してから応答する。
+  プロセスが異常終了しても、次回の起動時にジャーナルから未コミットの打刻を書き込む。
+  PUNCH_JOURNAL_FSYNC=1 でなければ、OS のクラッシュや電源断では直前の打刻を失うことがある。
+
+どちらのモードでも、キューの検証は同じプロセスの打刻だけを前提にしている。
+他のプロセスが同じ従業員の打刻を先に書き込んでいた場合は、書き込み時の
+compare-and-set で検出してその打刻を破棄する（journal モードでは応答済みのため警告ログのみ）。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import attendance
+import database
+import presence
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'commit', 'journal')
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+MODE = os.getenv('PUNCH_QUEUE_MODE', 'off')
+FLUSH_INTERVAL_SECONDS = max(1, _env_int('PUNCH_QUEUE_FLUSH_MS', 20)) / 1000
+MAX_BATCH = max(1, _env_int('PUNCH_QUEUE_MAX_BATCH', 200))
+JOURNAL_FSYNC = os.getenv('PUNCH_JOURNAL_FSYNC') == '1'
+JOURNAL_NAME = 'punch-journal.jsonl'
+# commit モードで書き込みを待つ最大時間
+COMMIT_TIMEOUT_SECONDS = 30.0
+# 書き込みに失敗した場合（journal モード）の再試行間隔
+RETRY_SECONDS = 1.0
+
+
+class _Punch:
+    """キュー内の打刻。previous は同じ従業員の直前の打刻（未書き込みなら _Punch、書き込み済みなら EmployeeState）"""
+    __slots__ = ('seq', 'employee_id', 'event_type', 'ts', 'previous', 'record_id', 'error', 'done')
+
+    def __init__(self, seq, employee_id, event_type, ts, previous, wait):
+        self.seq = seq
+        self.employee_id = employee_id
+        self.event_type = event_type
+        self.ts = ts
+        self.previous = previous
+        self.record_id = None
+        self.error = None
+        self.done = threading.Event() if wait else None
+
+
+def _ensure_state_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS punch_queue_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO punch_queue_state (id, last_seq) VALUES (1, 0)")
+
+
+def read_journal(path):
+    """ジャーナルの打刻を順に返す。書きかけの最終行（異常終了時）は無視する"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                logger.warning(f"Ignoring incomplete journal line in {path}")
+                break
+            yield json.loads(line)
+
+
+class PunchQueue:
+    def __init__(self, mode=None, flush_interval=None, max_batch=None, journal_path=None, fsync=None):
+        self.mode = mode or MODE
+        if self.mode not in ('commit', 'journal'):
+            raise ValueError(f"Unsupported punch queue mode: {self.mode}")
+        self.flush_interval = FLUSH_INTERVAL_SECONDS if flush_interval is None else flush_interval
+        self.max_batch = max_batch or MAX_BATCH
+        self.journal_path = journal_path or os.path.join(os.path.dirname(database.DB_FILE), JOURNAL_NAME)
+        self.fsync = JOURNAL_FSYNC if fsync is None else fsync
+        self._buffer = []
+        # 従業員ID → キュー内の最後の打刻
+        self._tails = {}
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._journal = None
+        self._closing = False
+        self._thread = None
+        self.stats = {'submitted': 0, 'flushed': 0, 'batches': 0, 'rejected': 0, 'max_batch': 0}
+
+    # --- 起動・終了 ---
+
+    def start(self):
+        """ジャーナルに残った打刻を書き込んでから、フラッシュ用のスレッドを開始する"""
+        with database.db_connection() as conn:
+            with database.write_transaction(conn):
+                _ensure_state_table(conn)
+            self._seq = conn.execute("SELECT last_seq FROM punch_queue_state WHERE id = 1").fetchone()[0]
+        self.recover()
+        if self.mode == 'journal':
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='punch-queue', daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Punch queue started: mode={self.mode}, flush every {self.flush_interval * 1000:.0f} ms "
+            f"or {self.max_batch} punches"
+        )
+        return self
+
+    def recover(self):
+        """前回の異常終了でコミットされなかったジャーナルの打刻を書き込む。書き込んだ件数を返す"""
+        pending = [entry for entry in read_journal(self.journal_path) if entry['seq'] > self._seq]
+        if pending:
+            tails = {}
+            batch = []
+            for entry in pending:
+                employee_id = entry['employee_id']
+                previous = tails.get(employee_id)
+                if previous is None:
+                    with database.db_connection() as conn:
+                        previous = attendance.state_cache.load(conn, employee_id)
+                punch = _Punch(entry['seq'], employee_id, entry['event_type'], entry['ts'], previous, wait=False)
+                tails[employee_id] = punch
+                batch.append(punch)
+            self._write(batch)
+            self._seq = max(self._seq, batch[-1].seq)
+            # 状態のキャッシュは回復前の状態を読み込んでいるため、書き込んだ最後の打刻に置き換える
+            for employee_id, punch in tails.items():
+                if punch.error is None:
+                    attendance.state_cache.set(
+                        employee_id, attendance.EmployeeState(punch.event_type, punch.record_id, punch.ts)
+                    )
+                else:
+                    attendance.state_cache.invalidate(employee_id)
+            presence.board.refresh(tails)
+            recovered = sum(1 for p in batch if p.error is None)
+            logger.warning(f"Recovered {recovered} punches from journal ({len(batch) - recovered} rejected)")
+        if os.path.exists(self.journal_path):
+            os.truncate(self.journal_path, 0)
+        return len(pending)
+
+    def close(self):
+        """新しい打刻の受付を止め、キューを書き込み終えてからスレッドを止める"""
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            if not self._buffer:
+                os.truncate(self.journal_path, 0)
+        logger.info(f"Punch queue drained: {self.stats}")
+
+    # --- 受付 ---
+
+    def submit(self, employee_id, event_type):
+        """打刻を検証してキューに積み、Api.record_attendance と同じ形式の dict を返す"""
+        with self._cond:
+            if self._closing:
+                return {'success': False, 'message': '終了処理中のため打刻できません。'}
+            tail = self._tails.get(employee_id)
+            previous = tail or attendance.state_cache.get(employee_id)
+            if previous is None:
+                with database.db_connection() as conn:
+                    previous = attendance.state_cache.load(conn, employee_id)
+            previous_type = tail.event_type if tail else previous.state
+            previous_ts = tail.ts if tail else previous.last_timestamp
+            if not attendance.is_transition_allowed(previous_type, event_type):
+                return {'success': False, 'message': '現在の状態ではその操作はできません。'}
+            self._seq += 1
+            punch = _Punch(
+                self._seq, employee_id, event_type, max(int(time.time()), previous_ts or 0), previous,
+                wait=self.mode == 'commit'
+            )
+            if self._journal is not None:
+                self._journal.write(json.dumps({
+                    'seq': punch.seq, 'employee_id': employee_id, 'event_type': event_type, 'ts': punch.ts
+                }) + '\n')
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            self._buffer.append(punch)
+            self._tails[employee_id] = punch
+            # 状態の表示はキューの内容を反映する（ID は書き込み後に確定）
+            attendance.state_cache.set(employee_id, attendance.EmployeeState(event_type, None, punch.ts))
+            presence.board.update(employee_id, event_type, punch.ts)
+            self.stats['submitted'] += 1
+            # 空のキューへの最初の1件でフラッシュの待ち時間を開始し、上限に達したらすぐ書き込む
+            if len(self._buffer) == 1 or len(self._buffer) >= self.max_batch:
+                self._cond.notify_all()
+        if punch.done is None:
+            return {'success': True}
+        if not punch.done.wait(COMMIT_TIMEOUT_SECONDS):
+            return {'success': False, 'message': '打刻の書き込みが完了しませんでした。'}
+        if punch.error:
+            return {'success': False, 'message': punch.error}
+        return {'success': True}
+
+    def flush(self, timeout=None):
+        """現在キューにある打刻が書き込まれるまで待つ"""
+        deadline = time.monotonic() + (timeout or COMMIT_TIMEOUT_SECONDS)
+        with self._cond:
+            target = self._seq
+            self._cond.notify_all()
+            while self._buffer and self._buffer[0].seq <= target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def __len__(self):
+        with self._cond:
+            return len(self._buffer)
+
+    # --- 書き込み ---
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                # 最初の打刻からフラッシュ間隔が経つか、件数が上限に達するまで待つ
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._buffer) < self.max_batch and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._buffer[:self.max_batch]
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.exception(f"Failed to flush {len(batch)} punches: {e}")
+                if self.mode == 'journal':
+                    # 応答済みの打刻は捨てずに再試行する。終了処理中なら次回の起動時にジャーナルから書き込む
+                    if self._closing:
+                        logger.error(f"{len(self._buffer)} punches left in {self.journal_path} for recovery")
+                        return
+                    time.sleep(RETRY_SECONDS)
+                    continue
+                for punch in batch:
+                    punch.record_id = None
+                    punch.error = 'データベースエラーが発生しました。'
+            self._complete(batch)
+
+    def _write(self, batch):
+        """batch を1つのトランザクションで書き込む。検証に失敗した打刻は punch.error を設定して飛ばす"""
+        for punch in batch:
+            # 失敗したトランザクションの再試行に備えて結果を消しておく
+            punch.record_id = punch.error = None
+        with database.db_connection() as conn:
+            with database.write_transaction(conn):
+                with_epoch = attendance.has_ts_epoch(conn)
+                for punch in batch:
+                    self._write_one(conn, punch, with_epoch)
+                conn.execute("UPDATE punch_queue_state SET last_seq = ? WHERE id = 1", (batch[-1].seq,))
+
+    def _write_one(self, conn, punch, with_epoch):
+        previous = punch.previous
+        if isinstance(previous, _Punch):
+            if previous.record_id is None:
+                punch.error = '直前の打刻が登録できなかったため、この打刻も登録できませんでした。'
+                return
+            expected = attendance.EmployeeState(previous.event_type, previous.record_id, previous.ts)
+        else:
+            expected = previous
+        try:
+            record_id = attendance.insert_punch(conn, punch.employee_id, punch.event_type, punch.ts, with_epoch)
+        except sqlite3.IntegrityError:
+            # キューにある間に従業員が削除された
+            punch.error = '従業員が見つかりません。'
+            return
+        current = attendance.EmployeeState(punch.event_type, record_id, punch.ts)
+        if not attendance.compare_and_set_state(conn, punch.employee_id, expected, current):
+            conn.execute("DELETE FROM attendance_records WHERE id = ?", (record_id,))
+            punch.error = '他の端末で打刻が行われました。状態を確認してもう一度お試しください。'
+            logger.warning(
+                f"Queued punch rejected (concurrent punch): employee_id={punch.employee_id} "
+                f"event_type={punch.event_type} seq={punch.seq}"
+            )
+            return
+        attendance.apply_punch_to_rollup(
+            conn, punch.employee_id, expected.state, expected.last_timestamp, punch.event_type, punch.ts
+        )
+        punch.record_id = record_id
+
+    def _complete(self, batch):
+        rejected = set()
+        with self._cond:
+            del self._buffer[:len(batch)]
+            for punch in batch:
+                if punch.error is None:
+                    committed = attendance.EmployeeState(punch.event_type, punch.record_id, punch.ts)
+                else:
+                    committed = None
+                    rejected.add(punch.employee_id)
+                    self.stats['rejected'] += 1
+                if self._tails.get(punch.employee_id) is punch:
+                    del self._tails[punch.employee_id]
+                    if committed is None:
+                        attendance.state_cache.invalidate(punch.employee_id)
+                    else:
+                        attendance.state_cache.set(punch.employee_id, committed)
+                elif committed is None:
+                    attendance.state_cache.invalidate(punch.employee_id)
+                if punch.done is not None:
+                    punch.done.set()
+            self.stats['flushed'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            if self._journal is not None and not self._buffer:
+                # すべてコミット済みならジャーナルを空にする
+                self._journal.truncate(0)
+            self._cond.notify_all()
+        if rejected:
+            # 受付時にボードへ反映した打刻が登録できなかったため、DB の状態に戻す
+            presence.board.refresh(rejected)
+
+
+_queue = None
+
+
+def active():
+    """起動中のキュー（PUNCH_QUEUE_MODE=off の場合は None）"""
+    return _queue
+
+
+def start(mode=None, **kwargs):
+    """mode（省略時は PUNCH_QUEUE_MODE）が off 以外ならキューを開始して返す"""
+    global _queue
+    mode = mode or MODE
+    if mode == 'off':
+        return None
+    if mode not in MODES:
+        logger.warning(f"Unknown PUNCH_QUEUE_MODE={mode!r}; punches are committed one by one.")
+        return None
+    _queue = PunchQueue(mode, **kwargs).start()
+    return _queue
+
+
+def stop():
+    """キューを書き込み終えて止める"""
+    global _queue
+    if _queue is not None:
+        _queue.close()
+        _queue = None
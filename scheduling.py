@@ -0,0 +1,373 @@
+"""シフトの割り当てと、予定（シフト）と実績（打刻）の差異レポート
+
+シフトは shift_assignments に従業員ごとの区間（開始・終了のエポック秒）として保存する。
+カレンダーのイベント（繰り返しを含む）を従業員に割り当てると、期間内の各回を
+1件ずつのシフトに展開し、元のイベントの id を event_id に残す。イベントを後から
+変更した場合は、割り当て直すと期間内のそのイベントのシフトが置き換わる。
+
+差異レポートは、シフトと勤務/休憩の区間（attendance.iter_segments）をどちらも
+(従業員ID, 開始) の順に読み、2本の列を1回ずつ走査して突き合わせる（ソートマージ）。
+各シフトについて、重なる区間のうち最初の開始を出勤、最後の終了を退勤とし、
+猶予（SCHEDULE_GRACE_MINUTES）を超えた遅刻・早退と、重なる区間の無い欠勤を判定する。
+コストはシフト数と打刻数の和に比例し、従業員ごとの問い合わせは行わない。
+
+カレンダーの日時（イベント・API の引数と戻り値）は保存時刻（UTC）に
+SCHEDULE_UTC_OFFSET_HOURS を足した現地時間として扱う。既定値 0 は
+日別集計（daily_work_totals）や勤怠分析の既定と同じ基準。
+"""
+import datetime
+import logging
+import os
+import time
+from collections import deque, namedtuple
+
+import archive
+import attendance
+import database
+import events
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# shift_assignments が使えるスキーマのバージョン（migrations.py）
+SCHEDULING_SCHEMA_VERSION = 6
+# これ以内の遅刻・早退は差異として扱わない
+GRACE_SECONDS = max(0, int(_env_float('SCHEDULE_GRACE_MINUTES', 5) * 60))
+UTC_OFFSET_SECONDS = int(_env_float('SCHEDULE_UTC_OFFSET_HOURS', 0) * 3600)
+# 1件のシフトの最大の長さ（打刻の読み込み範囲の前後の余裕と同じ）
+MAX_SHIFT_SECONDS = attendance.MAX_SHIFT_SECONDS
+# 1回の割り当てで作るシフトの上限
+MAX_ASSIGNMENTS = 100000
+
+_ID_CHUNK_SIZE = 500
+_SHIFT_COLUMNS = "id, employee_id, event_id, start_epoch, end_epoch"
+# idx_shift_assignments_employee_start を従業員ごとに範囲検索し、並べ替えずに (従業員ID, 開始) の順で返す
+_SHIFT_QUERY = (
+    f"SELECT {_SHIFT_COLUMNS} FROM shift_assignments "
+    "WHERE employee_id IN ({ids}) AND start_epoch >= ? AND start_epoch < ? ORDER BY employee_id, start_epoch"
+)
+_SEGMENT_COLUMNS = "employee_id, event_type, {epoch}"
+
+# start / end はエポック秒（end は排他的）
+Shift = namedtuple('Shift', ['id', 'employee_id', 'event_id', 'start', 'end'])
+# arrival / departure は重なる区間の最初の開始・最後の終了（欠勤・未開始は None）
+ShiftVariance = namedtuple('ShiftVariance', [
+    'shift', 'arrival', 'departure', 'worked_seconds', 'late_seconds', 'early_leave_seconds', 'no_show'
+])
+
+
+class ScheduleError(ValueError):
+    """割り当ての内容が不正（メッセージは画面に表示する）"""
+
+
+def is_enabled(conn):
+    return database.schema_version(conn) >= SCHEDULING_SCHEMA_VERSION
+
+
+def to_epoch(value):
+    """カレンダーの日時（datetime）を保存時刻のエポック秒にする"""
+    return attendance.date_to_epoch(value) - UTC_OFFSET_SECONDS
+
+
+def parse_datetime(text):
+    """カレンダーの日時の文字列（YYYY-MM-DD HH:MM[:SS]）を保存時刻のエポック秒にする"""
+    try:
+        return to_epoch(datetime.datetime.fromisoformat(text))
+    except (TypeError, ValueError):
+        raise ScheduleError('日時の形式が不正です。') from None
+
+
+def to_datetime_str(epoch):
+    """保存時刻のエポック秒をカレンダーの日時の文字列にする"""
+    # レポートでは数万件を変換するため、日付部分はキャッシュされた日付ラベルを使う
+    epoch += UTC_OFFSET_SECONDS
+    seconds = epoch % attendance.SECONDS_PER_DAY
+    return f"{attendance.epoch_to_day(epoch)} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _validate(start, end):
+    if end <= start:
+        raise ScheduleError('終了日時は開始日時より後にしてください。')
+    if end - start > MAX_SHIFT_SECONDS:
+        raise ScheduleError(f'シフトの長さは {MAX_SHIFT_SECONDS // 3600} 時間以内にしてください。')
+
+
+def _employee_ids(conn, employee_ids):
+    ids = sorted({int(i) for i in employee_ids})
+    found = set()
+    for i in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[i:i + _ID_CHUNK_SIZE]
+        found.update(row[0] for row in conn.execute(
+            f"SELECT id FROM employees WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    missing = [i for i in ids if i not in found]
+    if missing:
+        raise ScheduleError(f'従業員が見つかりません: {missing}')
+    return ids
+
+
+def _insert(conn, employee_ids, intervals, event_id):
+    if len(employee_ids) * len(intervals) > MAX_ASSIGNMENTS:
+        raise ScheduleError(f'一度に割り当てられるシフトは {MAX_ASSIGNMENTS} 件までです。')
+    # 同じ従業員・開始のシフトは置き換える（idx_shift_assignments_employee_start）
+    conn.executemany(
+        "INSERT OR REPLACE INTO shift_assignments (employee_id, event_id, start_epoch, end_epoch) VALUES (?, ?, ?, ?)",
+        ((employee_id, event_id, start, end) for employee_id in employee_ids for start, end in intervals)
+    )
+    return len(employee_ids) * len(intervals)
+
+
+def assign(conn, employee_ids, start_datetime, end_datetime):
+    """employee_ids に1件のシフトを割り当てる。戻り値: 作成したシフト数
+
+    呼び出し側でトランザクションを管理する。
+    """
+    start, end = parse_datetime(start_datetime), parse_datetime(end_datetime)
+    _validate(start, end)
+    return _insert(conn, _employee_ids(conn, employee_ids), [(start, end)], None)
+
+
+def assign_event(conn, event_id, employee_ids, window_start, window_end):
+    """イベントの [window_start, window_end)（datetime）に開始する各回を employee_ids のシフトにする
+
+    期間内に開始するそのイベントのシフトは、employee_ids の分を作り直す
+    （イベントの日時を変更した後に割り当て直す場合）。戻り値: 作成したシフト数
+    呼び出し側でトランザクションを管理する。
+    """
+    event = conn.execute("SELECT * FROM events WHERE id = ?", (event_id,)).fetchone()
+    if event is None:
+        raise ScheduleError('イベントが見つかりません。')
+    if event['is_allday']:
+        raise ScheduleError('終日のイベントはシフトにできません。')
+    event = dict(event)
+    if event['rrule']:
+        exceptions = {row[0] for row in conn.execute(
+            "SELECT occurrence_start FROM event_exceptions WHERE event_id = ?", (event_id,)
+        )}
+        occurrences = [
+            o for o in events.expand_occurrences(event, window_start, window_end, exceptions)
+            if datetime.datetime.fromisoformat(o['start_datetime']) >= window_start
+        ]
+    else:
+        start = datetime.datetime.fromisoformat(event['start_datetime'])
+        occurrences = [event] if window_start <= start < window_end else []
+    intervals = [(parse_datetime(o['start_datetime']), parse_datetime(o['end_datetime'])) for o in occurrences]
+    for start, end in intervals[:1]:
+        # 各回の長さは同じ
+        _validate(start, end)
+
+    ids = _employee_ids(conn, employee_ids)
+    epoch_range = (to_epoch(window_start), to_epoch(window_end))
+    for i in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[i:i + _ID_CHUNK_SIZE]
+        conn.execute(
+            f"DELETE FROM shift_assignments WHERE event_id = ? AND employee_id IN ({','.join('?' * len(chunk))}) "
+            "AND start_epoch >= ? AND start_epoch < ?",
+            (event_id, *chunk, *epoch_range)
+        )
+    return _insert(conn, ids, intervals, event_id)
+
+
+def delete(conn, assignment_ids):
+    """シフトを削除する。戻り値: 削除した件数（呼び出し側でトランザクションを管理する）"""
+    ids = sorted({int(i) for i in assignment_ids})
+    deleted = 0
+    for i in range(0, len(ids), _ID_CHUNK_SIZE):
+        chunk = ids[i:i + _ID_CHUNK_SIZE]
+        deleted += conn.execute(
+            f"DELETE FROM shift_assignments WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        ).rowcount
+    return deleted
+
+
+def iter_shifts(conn, employee_ids, window_start, window_end):
+    """[window_start, window_end) に開始するシフトを (従業員ID, 開始) の順に返す
+
+    employee_ids が None の場合は全従業員。
+    """
+    for row in _iter_rows(conn, _SHIFT_QUERY, employee_ids, (window_start, window_end)):
+        yield Shift(*row)
+
+
+def _iter_rows(conn, sql, employee_ids, params):
+    """{ids} を従業員IDの IN 句にした sql の結果をタプルで順に返す（None は全従業員）"""
+    if employee_ids is None:
+        queries = [(sql.format(ids="SELECT id FROM employees"), params)]
+    else:
+        ids = sorted(set(employee_ids))
+        queries = [
+            (sql.format(ids=','.join('?' * len(chunk))), (*chunk, *params))
+            for chunk in (ids[i:i + _ID_CHUNK_SIZE] for i in range(0, len(ids), _ID_CHUNK_SIZE))
+        ]
+    for query, query_params in queries:
+        cursor = conn.cursor()
+        # sqlite3.Row を作らずにタプルのまま読む
+        cursor.row_factory = None
+        yield from cursor.execute(query, query_params)
+
+
+def reconcile(shifts, segments, window_start, window_end, now):
+    """シフトと勤務/休憩の区間を突き合わせる
+
+    shifts は Shift、segments は (従業員ID, 'work' | 'break', 開始, 終了 | None) で、
+    どちらも (従業員ID, 開始) の順に並んでいること（終了 None の未終了区間は now までとする）。
+    戻り値: (ShiftVariance のリスト, 従業員ID → 期間内の勤務秒数)
+
+    同じ従業員の区間は互いに重ならないため、シフトの開始より前に終わった区間は
+    以降のシフトとも重ならない。先頭から捨てていく待ち行列（pending）に、まだ重なり得る
+    区間だけを持つため、各区間の読み込みと破棄は1回ずつで済む。
+    """
+    segments = iter(segments)
+    work_seconds = {}
+    pending = deque()
+
+    def read():
+        segment = next(segments, None)
+        if segment is None:
+            return None
+        employee_id, kind, start, end = segment
+        if end is None:
+            end = max(start, now)
+            segment = (employee_id, kind, start, end)
+        if kind == 'work':
+            seconds = min(end, window_end) - max(start, window_start)
+            if seconds > 0:
+                work_seconds[employee_id] = work_seconds.get(employee_id, 0) + seconds
+        return segment
+
+    results = []
+    upcoming = read()
+    for shift in shifts:
+        _, employee_id, _, shift_start, shift_end = shift
+        if pending and pending[0][0] != employee_id:
+            pending.clear()
+        while pending and pending[0][3] <= shift_start:
+            pending.popleft()
+        while upcoming is not None and (
+            upcoming[0] < employee_id or (upcoming[0] == employee_id and upcoming[2] < shift_end)
+        ):
+            if upcoming[0] == employee_id and upcoming[3] > shift_start:
+                pending.append(upcoming)
+            upcoming = read()
+
+        arrival = departure = None
+        worked = 0
+        for _, kind, start, end in pending:
+            if start >= shift_end:
+                # 前のシフトより短いシフトでは、待ち行列の後ろに重ならない区間が残る
+                break
+            if arrival is None:
+                arrival = start
+            departure = end
+            if kind == 'work':
+                worked += min(end, shift_end) - max(start, shift_start)
+        late = early_leave = 0
+        if arrival is not None:
+            if arrival - shift_start > GRACE_SECONDS:
+                late = arrival - shift_start
+            # 勤務中のシフトは退勤していないため早退と判定しない
+            if shift_end <= now and shift_end - departure > GRACE_SECONDS:
+                early_leave = shift_end - departure
+        no_show = arrival is None and shift_end <= now
+        results.append(ShiftVariance(shift, arrival, departure, worked, late, early_leave, no_show))
+
+    # シフトの無い従業員・最後のシフトより後の区間も勤務秒数に数える
+    while upcoming is not None:
+        upcoming = read()
+    return results, work_seconds
+
+
+def variance_report(conn, employees, window_start, window_end, all_employees=False, now=None):
+    """employees（id, name を持つ行）の期間のシフトの差異を API の形式で返す
+
+    window_start / window_end は保存時刻のエポック秒。期間内に開始したシフトを対象にする。
+    all_employees=True の場合は従業員IDで絞り込まずに読み込む。
+    """
+    now = int(time.time()) if now is None else now
+    ids = None if all_employees else [e['id'] for e in employees]
+    shifts = list(iter_shifts(conn, ids, window_start, window_end))
+    # 期間の最初のシフトの前の出勤から、最後のシフトの終了までの打刻を読む
+    range_start = window_start - attendance.MAX_SHIFT_SECONDS
+    range_end = max([window_end, *(s.end for s in shifts)]) + 1
+    with archive.attached(conn, range_start, range_end) as sources:
+        event_sql, params = attendance.epoch_range_query(conn, _SEGMENT_COLUMNS, range_start, range_end, sources.records)
+        punches = _iter_rows(conn, event_sql, ids, params)
+        variances, work_seconds = reconcile(
+            shifts, attendance.iter_segments(punches, include_open=True), window_start, window_end, now
+        )
+
+    names = {e['id']: e['name'] for e in employees}
+    per_employee = {e['id']: {
+        'shifts': 0, 'scheduled': 0, 'worked': 0, 'late_count': 0, 'late': 0,
+        'early_leave_count': 0, 'early_leave': 0, 'no_show_count': 0,
+    } for e in employees}
+    exceptions = []
+    for v in variances:
+        totals = per_employee.get(v.shift.employee_id)
+        if totals is None:
+            continue
+        totals['shifts'] += 1
+        totals['scheduled'] += v.shift.end - v.shift.start
+        totals['worked'] += v.worked_seconds
+        totals['late_count'] += bool(v.late_seconds)
+        totals['late'] += v.late_seconds
+        totals['early_leave_count'] += bool(v.early_leave_seconds)
+        totals['early_leave'] += v.early_leave_seconds
+        totals['no_show_count'] += v.no_show
+        if v.late_seconds or v.early_leave_seconds or v.no_show:
+            exceptions.append({
+                'assignment_id': v.shift.id,
+                'employee_id': v.shift.employee_id,
+                'name': names[v.shift.employee_id],
+                'event_id': v.shift.event_id,
+                'start_datetime': to_datetime_str(v.shift.start),
+                'end_datetime': to_datetime_str(v.shift.end),
+                'arrival': to_datetime_str(v.arrival) if v.arrival is not None else None,
+                'departure': to_datetime_str(v.departure) if v.departure is not None else None,
+                'late_minutes': round(v.late_seconds / 60, 1),
+                'early_leave_minutes': round(v.early_leave_seconds / 60, 1),
+                'no_show': v.no_show,
+            })
+    exceptions.sort(key=lambda e: (e['start_datetime'], e['employee_id']))
+
+    results = []
+    for employee in employees:
+        totals = per_employee[employee['id']]
+        actual = work_seconds.get(employee['id'], 0)
+        results.append({
+            'employee_id': employee['id'],
+            'name': employee['name'],
+            'shifts': totals['shifts'],
+            'scheduled_hours': round(totals['scheduled'] / 3600, 2),
+            'actual_hours': round(actual / 3600, 2),
+            'worked_in_shift_hours': round(totals['worked'] / 3600, 2),
+            # 重なり合うシフトがあると負になり得るため 0 で止める
+            'unscheduled_hours': round(max(0, actual - totals['worked']) / 3600, 2),
+            'late_count': totals['late_count'],
+            'late_minutes': round(totals['late'] / 60, 1),
+            'early_leave_count': totals['early_leave_count'],
+            'early_leave_minutes': round(totals['early_leave'] / 60, 1),
+            'no_show_count': totals['no_show_count'],
+        })
+    return {'employees': results, 'exceptions': exceptions, 'grace_minutes': GRACE_SECONDS / 60}
+
+
+def list_assignments(conn, employees, window_start, window_end, all_employees=False):
+    """期間内に開始するシフトを (従業員ID, 開始) の順に dict のリストで返す"""
+    names = {e['id']: e['name'] for e in employees}
+    ids = None if all_employees else list(names)
+    return [{
+        'id': s.id,
+        'employee_id': s.employee_id,
+        'name': names.get(s.employee_id),
+        'event_id': s.event_id,
+        'start_datetime': to_datetime_str(s.start),
+        'end_datetime': to_datetime_str(s.end),
+    } for s in iter_shifts(conn, ids, window_start, window_end)]
@@ -0,0 +1,247 @@
+"""複数の打刻端末から1つの DB を共有するためのサーバーモード
+
+Api の公開メソッドを `POST /api/<method>`（JSON: {"args": [...]}) として公開する。
+ログイン状態は Api インスタンスごとに持つため、セッショントークンごとに
+Api を1つ割り当て、端末ごとに独立したログイン状態を保つ。
+在席状況の変更は `GET /presence/stream`（server-sent events）で管理者の画面へ送る。
+"""
+import inspect
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from flask import Response, jsonify, request
+
+import presence
+import webserver
+from api import Api
+from dispatcher import session_scope
+
+logger = logging.getLogger(__name__)
+
+TOKEN_HEADER = 'X-Session-Token'
+
+# 成功すると新しいセッションを作るメソッド
+LOGIN_METHODS = frozenset({'login', 'login_with_pin', 'login_with_badge'})
+
+# サーバー上のファイルパスを引数に取るため、HTTP 経由では公開しないメソッド
+SERVER_EXCLUDED_METHODS = frozenset({
+    'import_attendance',
+    'export_attendance',
+    'export_attendance_summary',
+})
+
+
+# 変更が無い間も接続の切断を検出できるよう、この間隔でコメント行を送る
+STREAM_KEEPALIVE_SECONDS = 15.0
+# 切断（waitress の client_disconnected）を確かめる間隔
+STREAM_CHECK_SECONDS = 1.0
+# 上限に達して断ったストリームを、画面が get_presence で取得し直してから再接続するまでの秒数
+STREAM_RETRY_SECONDS = 10
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# 同時に開いておける在席状況のストリームの数。ストリームは開いている間サーバーのスレッド
+# （webserver.THREADS）を1つずつ使い続けるため、少なくとも1つは JSON API の分に残す
+MAX_STREAMS = max(0, min(_env_int('PRESENCE_MAX_STREAMS', webserver.THREADS // 4), webserver.THREADS - 1))
+
+
+def _session_ttl_seconds():
+    try:
+        return int(os.getenv('INACTIVITY_TIMEOUT_SECONDS', '900'))
+    except ValueError:
+        return 900
+
+
+class SessionStore:
+    """セッショントークン → Api インスタンスの対応を保持する
+
+    最後の利用から ttl_seconds を過ぎたセッションは破棄する。
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else _session_ttl_seconds()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, api):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = [api, time.monotonic()]
+        return token
+
+    def get(self, token):
+        if not token:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl_seconds:
+                del self._sessions[token]
+                return None
+            entry[1] = now
+            return entry[0]
+
+    def peek(self, token):
+        """get() と同じだが最後の利用時刻を更新しない（ストリームの接続中にセッションを延長しないため）"""
+        if not token:
+            return None
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                return None
+            return entry[0]
+
+    def remove(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [t for t, (_, used) in self._sessions.items() if now - used > self.ttl_seconds]
+            for token in expired:
+                del self._sessions[token]
+        return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+def _public_methods():
+    return {
+        name for name, _ in inspect.getmembers(Api, inspect.isfunction)
+        if not name.startswith('_') and name not in SERVER_EXCLUDED_METHODS
+    }
+
+
+def _presence_events(api, sessions, token, since, disconnected=None):
+    """在席状況の変更を server-sent events の形式で順に返す
+
+    最初に since 以降の変更（または全件）を送り、以降は変更があるたびに差分を送る。
+    ログアウト・期限切れでセッションが無くなるか、disconnected() が真（接続が切れた）になったら終了する。
+    """
+    # 変更が無くてもすぐに応答ヘッダーを送り出す
+    yield ": connected\n\n"
+    seq = since
+    idle = 0.0
+    while sessions.peek(token) is api and not (disconnected and disconnected()):
+        result = api.get_presence(seq)
+        if not result['success']:
+            return
+        seq = result['seq']
+        if result['full'] or result['changes']:
+            idle = 0.0
+            data = json.dumps(result, ensure_ascii=False)
+            yield f"id: {seq}\nevent: presence\ndata: {data}\n\n"
+            # 出勤が集中する時間帯は、続けて届く変更をまとめて次の1回で送る
+            time.sleep(presence.PUSH_INTERVAL_SECONDS)
+        if presence.board.wait(seq, STREAM_CHECK_SECONDS) == seq:
+            idle += STREAM_CHECK_SECONDS
+            if idle >= STREAM_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keepalive\n\n"
+
+
+def register_api_routes(app, executor, sessions=None):
+    """Flask アプリに JSON API のルートを登録する
+
+    呼び出しは ApiExecutor 経由で実行されるため、GUI モードと同じく
+    重い処理は専用のスレッドで実行される。
+    """
+    sessions = sessions or SessionStore()
+    methods = _public_methods()
+    # 未ログインの呼び出し（get_events など）は共有の Api で処理し、同時実行の重複排除を効かせる
+    anonymous = Api()
+    stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+    def current_token():
+        token = request.headers.get(TOKEN_HEADER)
+        if not token:
+            auth = request.headers.get('Authorization', '')
+            if auth.startswith('Bearer '):
+                token = auth[len('Bearer '):]
+        return token
+
+    @app.route('/server-info')
+    def server_info():
+        return jsonify({'mode': 'server'})
+
+    @app.route('/presence/stream')
+    def presence_stream():
+        token = current_token()
+        api = sessions.get(token)
+        if api is None or not api.current_user or not api.current_user['is_admin']:
+            return jsonify({'success': False, 'message': '権限がありません。'}), 403
+        # 再接続時は最後に受け取った seq 以降の差分から送る
+        since = request.args.get('since', type=int)
+        if since is None:
+            since = request.headers.get('Last-Event-ID', type=int)
+        if not stream_slots.acquire(blocking=False):
+            # 画面は get_presence で取得し直し、Retry-After の後に再接続する
+            logger.warning(f"Presence stream rejected: {MAX_STREAMS} streams are already open")
+            return (
+                jsonify({'success': False, 'message': '在席状況のストリームの数が上限に達しています。'}),
+                503, {'Retry-After': str(STREAM_RETRY_SECONDS)}
+            )
+        try:
+            # 各イベントは1つのチャンクとして書き出す（waitress は書き込みごとに送信する）。
+            # 途中のプロキシにも溜めずに送らせる
+            response = Response(
+                _presence_events(api, sessions, token, since, request.environ.get('waitress.client_disconnected')),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache, no-transform', 'X-Accel-Buffering': 'no'}
+            )
+        except BaseException:
+            stream_slots.release()
+            raise
+        # 切断・ログアウトでストリームが閉じられたら枠を返す
+        response.call_on_close(stream_slots.release)
+        return response
+
+    @app.route('/api/<method>', methods=['POST'])
+    def call_api(method):
+        if method not in methods:
+            return jsonify({'success': False, 'message': '不明な API です。'}), 404
+        payload = request.get_json(silent=True) or {}
+        args = payload.get('args', [])
+        if not isinstance(args, list):
+            return jsonify({'success': False, 'message': '引数の形式が不正です。'}), 400
+
+        token = current_token()
+        if method in LOGIN_METHODS:
+            api = Api()
+        else:
+            api = sessions.get(token) or anonymous
+        bound = getattr(api, method)
+        try:
+            inspect.signature(bound).bind(*args)
+        except TypeError as e:
+            return jsonify({'success': False, 'message': f'引数が不正です: {e}'}), 400
+
+        if method in LOGIN_METHODS:
+            # ログインのたびに新しいセッションを作る（引数が正しい場合のみ、既存トークンを破棄する）
+            sessions.remove(token)
+            result = executor.call(method, bound, args)
+            if result.get('success'):
+                result = {**result, 'token': sessions.create(api)}
+            return jsonify(result)
+
+        result = executor.call(method, bound, args, dedup_scope=session_scope(api))
+        if method == 'logout' and api is not anonymous:
+            sessions.remove(token)
+        return jsonify(result)
+
+    return sessions
@@ -0,0 +1,88 @@
+"""起動時間の計測（--startup-report / 環境変数 STARTUP_REPORT=1）
+
+main.py の最初に import し、起動の各段階で mark() を呼ぶ。report() は
+各段階の経過時間（このモジュールの import からのミリ秒）をログと
+logs/startup.json に出力する。モジュール単位の import 時間は
+`python -X importtime main.py` で確認する。
+
+画面側は最初の描画（Performance API の first-paint / first-contentful-paint）を
+Api.report_paint_timing で送り、record_paint() がアプリの起動からの時間に直して追記する。
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+# 画面側の時刻（エポックミリ秒）との比較用
+_started_wall = time.time()
+_phases = []
+_paint = None
+_report_dir = None
+enabled = os.getenv('STARTUP_REPORT') == '1'
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def mark(phase):
+    """起動の段階 phase に到達した時刻を記録する"""
+    _phases.append((phase, round((time.perf_counter() - _started) * 1000, 1), round(time.process_time() * 1000, 1)))
+
+
+def record_paint(timings):
+    """画面側で計測した描画のタイミングを記録する（最初の1回のみ）
+
+    timings は Performance API の値（ページの読み込み開始からのミリ秒）と time_origin（エポックミリ秒）。
+    戻り値: 記録した場合 True
+    """
+    global _paint
+    if _paint is not None:
+        return False
+    time_origin = timings.get('time_origin')
+    _paint = {}
+    for name in ('first-paint', 'first-contentful-paint', 'dom-content-loaded', 'load'):
+        value = timings.get(name)
+        if not isinstance(value, (int, float)):
+            continue
+        entry = _paint[name] = {'page_ms': round(value, 1)}
+        if isinstance(time_origin, (int, float)):
+            # アプリの起動からの時間（別の端末の時計で測った値は意味を持たないため、負の値は捨てる）
+            since_start = time_origin + value - _started_wall * 1000
+            if since_start >= 0:
+                entry['since_start_ms'] = round(since_start, 1)
+    if enabled:
+        report(_report_dir)
+    return True
+
+
+def report(directory=None):
+    """記録した段階をログに出力し、directory があれば startup.json に書き出す（無効時は何もしない）"""
+    global _report_dir
+    if not enabled:
+        return None
+    _report_dir = directory
+    data = {
+        'phases': [{'phase': phase, 'elapsed_ms': elapsed, 'cpu_ms': cpu} for phase, elapsed, cpu in _phases],
+        'paint': _paint,
+        'modules_loaded': len(sys.modules),
+        'heavy_modules_loaded': sorted(m for m in ('webview', 'flask', 'numpy', 'PySide6', 'qtpy') if m in sys.modules),
+    }
+    lines = [f"  {phase:<24} {elapsed:9.1f} ms (cpu {cpu:.1f} ms)" for phase, elapsed, cpu in _phases]
+    for name, entry in (_paint or {}).items():
+        since_start = f" (since start {entry['since_start_ms']:.1f} ms)" if 'since_start_ms' in entry else ''
+        lines.append(f"  {name:<24} {entry['page_ms']:9.1f} ms{since_start}")
+    logger.info("Startup report:\n" + '\n'.join(lines) + f"\n  modules loaded: {data['modules_loaded']}")
+    if directory:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, 'startup.json'), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"Failed to write startup report: {e}")
+    return data
@@ -0,0 +1,72 @@
+"""組み込みの HTTP サーバー（WSGI）
+
+waitress がインストールされていれば、スレッドプール型の本番向けサーバーで Flask アプリを動かす。
+無ければ werkzeug のスレッド型サーバーで代用する（開発用のため警告を出す）。
+どちらも1リクエストを1スレッドで処理するため、サーバーモードで開いたままの
+在席状況のストリーム（/presence/stream）は1本につき1スレッドを使う。waitress では
+スレッド数が固定のため、ストリームの数は server_api.MAX_STREAMS で制限する。
+"""
+import logging
+import os
+
+from werkzeug.serving import make_server
+
+try:
+    import waitress.server
+except ImportError:  # 任意の依存関係
+    waitress = None
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# 同時に処理するリクエスト数
+THREADS = max(1, _env_int('SERVER_THREADS', 16))
+
+
+def backend():
+    return 'waitress' if waitress is not None else 'werkzeug'
+
+
+class WSGIServer:
+    """待ち受けを開始したサーバー。serve_forever() で受付を始め、shutdown() で止める"""
+
+    def __init__(self, app, host='127.0.0.1', port=5000, threads=None):
+        self.threads = threads or THREADS
+        if waitress is not None:
+            # channel_request_lookahead: 処理中も接続を読み続け、切断を environ['waitress.client_disconnected'] で
+            # 検出できるようにする（開いたままの在席状況のストリームがスレッドを早く返すため）
+            self._server = waitress.server.create_server(
+                app, host=host, port=port, threads=self.threads, ident=None, channel_request_lookahead=1
+            )
+            self.port = self._server.effective_port
+        else:
+            self._server = make_server(host, port, app, threaded=True)
+            self.port = self._server.port
+        self.host = host
+
+    def serve_forever(self):
+        if waitress is None:
+            logger.info(f"Serving http://{self.host}:{self.port}/ with werkzeug (thread per request)")
+            logger.warning("waitress is not installed; using the werkzeug development server.")
+            self._server.serve_forever()
+        else:
+            logger.info(f"Serving http://{self.host}:{self.port}/ with waitress ({self.threads} threads)")
+            self._server.run()
+
+    def shutdown(self):
+        if waitress is None:
+            self._server.shutdown()
+        else:
+            self._server.close()
+
+
+def serve(app, host='127.0.0.1', port=5000, threads=None):
+    """app を host:port で配信する（戻らない）"""
+    WSGIServer(app, host, port, threads).serve_forever()